@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+
+import cryodecoder
+
+CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+SAMPLES = 500000
+USERS = 50
+
+def samples(count):
+    # Varying packets from several instruments, decoded and converted
+    # beforehand so only the database writes are timed
+    packets = []
+    for i in range(count):
+        payload = bytearray(CRYOEGG_DATA)
+        payload[4:6] = (16384 + i % 8192).to_bytes(2, "little")
+        payload[10] = i % 256
+        packets.append(cryodecoder.CryoeggPacket(payload))
+    return packets
+
+def rows_per_second(path, values, **kwargs):
+    start = time.perf_counter()
+    with cryodecoder.DatabaseWriter(path, **kwargs) as writer:
+        for i, value in enumerate(values):
+            writer.write(value, user_id = 0xCE220000 + i % USERS, timestamp = 1700000000 + i)
+    return len(values) / (time.perf_counter() - start)
+
+def main():
+
+    packets = samples(SAMPLES)
+    records = [cryodecoder.CryoeggData(packet).to_record() for packet in packets]
+
+    print(f"{'rows':<16} {'batch size':>10} {'rows/s':>10}")
+
+    for name, values in (("CryoeggPacket", packets), ("CryoeggRecord", records)):
+        for batch_size in (1000, 10000, 50000, 100000):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                rate = rows_per_second(
+                    os.path.join(temp_dir, "bench.db"), values, 
+                    batch_size = batch_size, flush_interval = 60
+                )
+            print(f"{name:<16} {batch_size:>10} {rate:>10.0f}")
+
+if __name__ == "__main__":
+    main()
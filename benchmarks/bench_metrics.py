@@ -0,0 +1,55 @@
+import timeit
+
+import cryodecoder
+
+##############################################################################
+# Overhead of cryodecoder.Metrics
+##############################################################################
+# Throughput of decoding and converting packets before metrics are enabled,
+# while enabled, and after they are disabled again, which should match the
+# first column.
+
+CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+MBUS_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA' + CRYOEGG_DATA + b'\x5A'
+CRYORECEIVER_DATA = MBUS_DATA + b'\x01\x25\x4C\x27\xE0\x2E'
+
+CASES = (
+    ("CryoeggPacket", lambda: cryodecoder.CryoeggPacket(CRYOEGG_DATA)),
+    ("MBusPacket", lambda: cryodecoder.MBusPacket(MBUS_DATA)),
+    ("CryoReceiverPacket", lambda: cryodecoder.CryoReceiverPacket(CRYORECEIVER_DATA)),
+    ("CryoeggData", lambda packet = cryodecoder.CryoeggPacket(CRYOEGG_DATA): cryodecoder.CryoeggData(packet)),
+)
+
+ROUNDS = 30
+NUMBER = 5000
+
+def best_ops_per_second(timings):
+    return NUMBER / min(timings)
+
+def main():
+
+    # Best of several rounds, where enabled and disabled rounds alternate so
+    # that noise from other processes affects both alike
+    metrics = cryodecoder.Metrics()
+    parse = cryodecoder.Packet.parse
+    results = []
+    for name, function in CASES:
+        timeit.timeit(function, number = NUMBER)
+        timings = {"never" : [], "enabled" : [], "disabled" : []}
+        for _ in range(ROUNDS):
+            timings["never"].append(timeit.timeit(function, number = NUMBER))
+        for _ in range(ROUNDS):
+            with metrics:
+                timings["enabled"].append(timeit.timeit(function, number = NUMBER))
+            timings["disabled"].append(timeit.timeit(function, number = NUMBER))
+        results.append((name, *[best_ops_per_second(timings[state]) for state in ("never", "enabled", "disabled")]))
+
+    print(f"{'Case':<20} {'never (op/s)':>14} {'enabled (op/s)':>15} {'disabled (op/s)':>16} {'enabled':>8} {'disabled':>9}")
+    for name, before, enabled, after in results:
+        print(f"{name:<20} {before:>14,.0f} {enabled:>15,.0f} {after:>16,.0f} {enabled / before - 1:>+8.1%} {after / before - 1:>+9.1%}")
+    # Disabling restores the original methods, so there's nothing left to
+    # cost anything
+    print(f"Original methods restored: {cryodecoder.Packet.parse is parse}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import time
+
+import cryodecoder
+
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+SAMPLES = 400000
+
+def worker_counts():
+    # 1, 2, 4, ... up to the number of cores
+    cores = os.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+def main():
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        path = os.path.join(temp_dir, "archive.bin")
+        with open(path, "wb") as archive_fh:
+            archive_fh.write(SD_PACKET_DATA * SAMPLES)
+
+        print(f"{SAMPLES} records, {os.cpu_count()} cores")
+        print(f"{'workers':>8} {'records/s':>12} {'speedup':>8} {'efficiency':>11}")
+
+        baseline = None
+        for workers in worker_counts():
+            start = time.perf_counter()
+            count = sum(1 for _ in cryodecoder.decode_archive(path, workers = workers))
+            rate = count / (time.perf_counter() - start)
+            baseline = baseline or rate
+            speedup = rate / baseline
+            print(f"{workers:>8} {rate:>12.0f} {speedup:>7.1f}x {speedup / workers:>10.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import timeit
+
+import cryodecoder
+from cryodecoder import Packet
+
+##############################################################################
+# Sample packets
+##############################################################################
+CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+CRYOWURST_DATA = bytes.fromhex("010a00610137004a002d00e6fc35001a0085047f00000dc6f8")
+HYDROBEAN_DATA = bytes.fromhex("a00ff33f4559ac0f0100")
+MBUS_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA' + CRYOEGG_DATA + b'\x5A'
+CRYORECEIVER_DATA = MBUS_DATA + b'\x01\x25\x4C\x27\xE0\x2E'
+SDSATELLITE_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+
+SAMPLES = (
+    (cryodecoder.CryoeggPacket, CRYOEGG_DATA),
+    (cryodecoder.CryowurstPacket, CRYOWURST_DATA),
+    (cryodecoder.HydrobeanPacket, HYDROBEAN_DATA),
+    (cryodecoder.MBusPacket, MBUS_DATA),
+    (cryodecoder.CryoReceiverPacket, CRYORECEIVER_DATA),
+    (cryodecoder.SDSatellitePacket, SDSATELLITE_DATA),
+)
+
+##############################################################################
+# Reference implementation of Packet.parse prior to the compiled decoder
+##############################################################################
+def legacy_parse(self):
+
+    length = len(self.raw)
+
+    for field, field_config in Packet.CONFIG[self.__class__].fields.items():
+
+        if isinstance(field_config.offset, list):
+            offset_list = field_config.offset.copy()
+        else:
+            offset_list = [field_config.offset, field_config.offset + field_config.length - 1]
+
+        for i in range(len(offset_list)):
+            if offset_list[i] < 0:
+                offset_list[i] = length + offset_list[i]
+
+        start_idx, end_idx = offset_list
+
+        # Fields configured with arguments (e.g. the payload, which takes
+        # the CI byte) come after the fields they refer to
+        parser = getattr(self.__class__, field_config.parser)
+        arguments = [getattr(self, argument) for argument in field_config.arguments or ()]
+        setattr(self, field, parser(self.raw[start_idx : end_idx + 1], *arguments))
+
+def packets_per_second(packet_class, raw, repeat = 5):
+    # Best of several runs to reduce scheduling noise
+    number = 20000
+    best = min(timeit.repeat(lambda: packet_class(raw), number = number, repeat = repeat))
+    return number / best
+
+def main():
+
+    print(f"{'Packet':<20} {'before (pkt/s)':>15} {'after (pkt/s)':>15} {'speedup':>8}")
+
+    for packet_class, raw in SAMPLES:
+
+        compiled_parse = Packet.parse
+        Packet.parse = legacy_parse
+        try:
+            before = packets_per_second(packet_class, raw)
+        finally:
+            Packet.parse = compiled_parse
+        after = packets_per_second(packet_class, raw)
+
+        print(f"{packet_class.__name__:<20} {before:>15,.0f} {after:>15,.0f} {after / before:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import tracemalloc
+
+import cryodecoder
+
+MBUS_HEADER = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA'
+CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+RECEIVER_TRAILER = b'\x5A\x01\x25\x4C\x27\xE0\x2E'
+SAMPLES = 100000
+
+def receiver_stream(count):
+    # Length-framed receiver packets, with varying raw values so that
+    # converted values aren't shared objects
+    stream = bytearray()
+    for i in range(count):
+        payload = bytearray(CRYOEGG_DATA)
+        payload[0:2] = (i % 4096).to_bytes(2, "little")
+        payload[4:6] = (16384 + i % 8192).to_bytes(2, "little")
+        payload[6:8] = (0x5945 + i % 256).to_bytes(2, "little")
+        payload[10] = i % 256
+        frame = MBUS_HEADER + payload + RECEIVER_TRAILER
+        stream += bytes([len(frame)]) + frame
+    return bytes(stream)
+
+def bytes_per_sample(stream, keep):
+    # Memory retained per sample when holding decoded samples, as an ingest
+    # process would for windowed processing
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        kept = [
+            keep(cryodecoder.CryoeggData(packet.mbus_packet.payload))
+            for packet in cryodecoder.PacketReader(stream, chunk_size = 1 << 16)
+        ]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(kept)
+
+def main():
+
+    stream = receiver_stream(SAMPLES)
+
+    data_size = bytes_per_sample(stream, lambda data: data)
+    record_size = bytes_per_sample(stream, lambda data: data.to_record())
+
+    print(f"CryoeggData   : {data_size:8.1f} bytes/sample")
+    print(f"CryoeggRecord : {record_size:8.1f} bytes/sample")
+    print(f"reduction     : {data_size / record_size:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import cryodecoder
+
+##############################################################################
+# Benchmark suite
+##############################################################################
+# Measures throughput (operations per second, best of several runs) and the
+# memory retained per operation for the main decode and conversion paths,
+# and the time taken to import cryodecoder. Results are written as JSON and
+# can be compared against a previous run:
+#
+#       python benchmarks/suite.py --output baseline.json
+#       python benchmarks/suite.py --compare baseline.json
+#
+# which exits with a non-zero status if anything has regressed by more than
+# the threshold.
+
+CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+CRYOWURST_DATA = bytes.fromhex("010a00610137004a002d00e6fc35001a0085047f00000dc6f8")
+HYDROBEAN_DATA = bytes.fromhex("a00ff33f4559ac0f0100")
+MBUS_HEADER = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07'
+RECEIVER_TRAILER = b'\x01\x25\x4C\x27\xE0\x2E'
+MBUS_CRYOEGG_DATA = MBUS_HEADER + b'\xAA' + CRYOEGG_DATA + b'\x5A'
+MBUS_CRYOWURST_DATA = MBUS_HEADER + b'\xAC' + CRYOWURST_DATA + b'\x5A'
+SDSATELLITE_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+
+# Sample raw data for each registered packet type
+SAMPLES = {
+    cryodecoder.MBusPacket : MBUS_CRYOEGG_DATA,
+    cryodecoder.CryoeggPacket : CRYOEGG_DATA,
+    cryodecoder.CryowurstPacket : CRYOWURST_DATA,
+    cryodecoder.HydrobeanPacket : HYDROBEAN_DATA,
+    cryodecoder.CryoReceiverPacket : MBUS_CRYOEGG_DATA + RECEIVER_TRAILER,
+    cryodecoder.SDSatellitePacket : SDSATELLITE_DATA,
+}
+
+ALLOCATION_SAMPLES = 10000
+# Packets per batch for DataConverter.convert_records
+CONVERTER_BATCH_SIZE = 100
+IMPORT_REPEAT = 5
+# Relative change treated as a regression by --compare
+THRESHOLD_DEFAULT = 0.10
+
+def cases():
+
+    # Yield (name, function) for each benchmark, where function performs one
+    # operation and returns its result
+    for packet_class in cryodecoder.REGISTERED_PACKETS:
+        if packet_class not in SAMPLES:
+            raise ValueError(f"No sample data for {packet_class.__name__}, add one to SAMPLES")
+        raw = SAMPLES[packet_class]
+        yield f"parse/{packet_class.__name__}", lambda packet_class = packet_class, raw = raw : packet_class(raw)
+
+    # Nested decoding, CryoReceiverPacket -> MBusPacket -> payload
+    for name, mbus_data in (("Cryoegg", MBUS_CRYOEGG_DATA), ("Cryowurst", MBUS_CRYOWURST_DATA)):
+        raw = mbus_data + RECEIVER_TRAILER
+        yield f"nested/CryoReceiverPacket/{name}Packet", \
+            lambda raw = raw : cryodecoder.CryoReceiverPacket(raw)
+
+    # Data.convert on an existing Data object
+    for data_class, packet in (
+        (cryodecoder.CryoeggData, cryodecoder.CryoeggPacket(CRYOEGG_DATA)),
+        (cryodecoder.CryowurstData, cryodecoder.CryowurstPacket(CRYOWURST_DATA)),
+        (cryodecoder.CryoReceiverData, cryodecoder.CryoReceiverPacket(SAMPLES[cryodecoder.CryoReceiverPacket])),
+    ):
+        data = data_class(packet)
+        yield f"convert/{data_class.__name__}", data.convert
+        yield f"data/{data_class.__name__}", \
+            lambda data_class = data_class, packet = packet : data_class(packet)
+        converter = data_class.converter()
+        yield f"converter/{data_class.__name__}", \
+            lambda converter = converter, packet = packet : converter.convert(packet)
+        yield f"converter_records/{data_class.__name__}x{CONVERTER_BATCH_SIZE}", \
+            lambda converter = converter, packets = [packet] * CONVERTER_BATCH_SIZE : \
+                converter.convert_records(packets)
+
+def ops_per_second(function, repeat):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat = repeat, number = number))
+
+def bytes_per_op(function):
+
+    # Memory retained by the results of each operation
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        results = [function() for _ in range(ALLOCATION_SAMPLES)]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del results
+    return (after - before) / ALLOCATION_SAMPLES
+
+def import_seconds(repeat):
+
+    # Import in a fresh interpreter each time, best of several runs
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(cryodecoder.__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_dir, env.get("PYTHONPATH")]))
+    script = "import time; start = time.perf_counter(); import cryodecoder; print(time.perf_counter() - start)"
+
+    return min(
+        float(subprocess.run(
+            [sys.executable, "-c", script], env = env, check = True,
+            capture_output = True, text = True
+        ).stdout)
+        for _ in range(repeat)
+    )
+
+def run(repeat):
+
+    results = {}
+    for name, function in cases():
+        results[name] = {
+            "ops_per_second" : ops_per_second(function, repeat),
+            "bytes_per_op" : bytes_per_op(function),
+        }
+        print(f"{name:<45} {results[name]['ops_per_second']:>12,.0f} ops/s {results[name]['bytes_per_op']:>8.0f} B/op", file = sys.stderr)
+
+    results["import"] = {"seconds" : import_seconds(IMPORT_REPEAT)}
+    print(f"{'import':<45} {results['import']['seconds'] * 1000:>12.1f} ms", file = sys.stderr)
+
+    return {
+        "timestamp" : time.time(),
+        "python" : platform.python_version(),
+        "implementation" : platform.python_implementation(),
+        "machine" : platform.machine(),
+        "platform" : platform.platform(),
+        "results" : results,
+    }
+
+def compare(report, baseline, threshold):
+
+    # Return a list of regressions, relative to the baseline
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base == None:
+            continue
+        for metric, value in result.items():
+            if metric not in base or base[metric] <= 0:
+                continue
+            change = value / base[metric] - 1
+            # Higher is better for throughput, lower for everything else
+            worse = -change if metric == "ops_per_second" else change
+            print(f"{name:<45} {metric:<15} {change:>+8.1%}", file = sys.stderr)
+            if worse > threshold:
+                regressions.append((name, metric, base[metric], value))
+    return regressions
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Run the cryodecoder benchmark suite.")
+    parser.add_argument("-o", "--output", help = "Write results as JSON to this file (default: stdout)")
+    parser.add_argument("-c", "--compare", help = "Compare results against a previous JSON file")
+    parser.add_argument("-t", "--threshold", type = float, default = THRESHOLD_DEFAULT,
+        help = "Relative change treated as a regression (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type = int, default = 5,
+        help = "Number of timing runs per benchmark (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as output_fh:
+            json.dump(report, output_fh, indent = 2)
+    else:
+        json.dump(report, sys.stdout, indent = 2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as baseline_fh:
+            baseline = json.load(baseline_fh)
+        regressions = compare(report, baseline, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f"REGRESSION {name} {metric}: {before:.6g} -> {after:.6g}", file = sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
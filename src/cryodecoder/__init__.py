@@ -2,8 +2,38 @@
 from .base import *
 from .packets import *
 from .data import *
+from .reader import *
+from .archive import *
+from .stream import *
 
-from importlib.resources import files, as_file
+import importlib
+import os
+
+# Modules with slow imports (multiprocessing, sqlite3, http.client, csv) and
+# optional features are only imported when one of their names is first used
+LAZY_IMPORTS = {
+    "PARALLEL_CHUNK_SIZE_DEFAULT" : ".parallel",
+    "packet_records" : ".parallel",
+    "packet_record" : ".parallel",
+    "decode_chunk" : ".parallel",
+    "decode_archive" : ".parallel",
+    "DatabaseWriter" : ".database",
+    "Uploader" : ".upload",
+    "CalibrationCatalogue" : ".calibration",
+    "Aggregator" : ".aggregate",
+    "WindowAggregate" : ".aggregate",
+    "Metrics" : ".metrics",
+    "BulkDecoder" : ".bulk",
+    "decode_bulk" : ".bulk",
+}
+
+def __getattr__(name):
+    module = LAZY_IMPORTS.get(name)
+    if module == None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __package__), name)
+    globals()[name] = value
+    return value
 
 # Define __all__ to expose public API
 __all__ = [
@@ -14,7 +44,22 @@ __all__ = [
     "CryoReceiverPacket",
     "SDSatellitePacket",
     #
-    "CryoeggData"
+    "CryoeggData",
+    "DataConverter",
+    #
+    "PacketReader",
+    "SDArchive",
+    "decode_archive",
+    "DatabaseWriter",
+    "Uploader",
+    "CalibrationCatalogue",
+    "Deduplicator",
+    "SequenceTracker",
+    "Aggregator",
+    "Metrics",
+    "decode_bulk",
+    "InvalidPacketError",
+    "ErrorReason"
 ]
 
 # List registered packet types
@@ -28,12 +73,22 @@ REGISTERED_PACKETS = (
     SDSatellitePacket
 )
 
-# Load packet config from file and configure each packet type
+# Load the compiled packet config (cached, see load_compiled_packet_config)
+# and configure each packet type, which is compiled when first used
 PACKET_CONFIG = None
-source = files(__package__).joinpath("packets.toml") 
-with as_file(source) as packet_config_path:
-    # Get config object:
-    PACKET_CONFIG = load_packet_config(packet_config_path)
-    # and registor for each packet
-    for packet in REGISTERED_PACKETS:
-        Packet.configure(packet, PACKET_CONFIG)
\ No newline at end of file
+packet_config_path = os.path.join(os.path.dirname(__file__), "packets.toml")
+if not os.path.exists(packet_config_path):
+    # e.g. installed as a zip, so extract it
+    from importlib.resources import files, as_file
+    with as_file(files(__package__).joinpath("packets.toml")) as packet_config_path:
+        PACKET_CONFIG = load_compiled_packet_config(packet_config_path)
+else:
+    PACKET_CONFIG = load_compiled_packet_config(packet_config_path)
+# and registor for each packet
+for packet in REGISTERED_PACKETS:
+    Packet.configure(packet, PACKET_CONFIG, lazy = True)
+
+# Register payload types with a control_field in the config, so that the
+# payload of an MBusPacket is found with a single lookup
+for packet in REGISTERED_PACKETS:
+    MBusPacket.register_payload(packet)
\ No newline at end of file
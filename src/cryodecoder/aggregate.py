@@ -0,0 +1,196 @@
+from cryodecoder import Data, Record
+
+import collections
+import heapq
+import itertools
+import math
+
+##############################################################################
+# WINDOWED AGGREGATION
+##############################################################################
+# Incremental count, sum, min and max of each field of each instrument over
+# fixed windows (e.g. 1 minute, 1 hour and 1 day), aligned to multiples of
+# the window length from the epoch. Samples are Data objects or records
+# (CryoeggData, CryowurstData, CryoReceiverData, ...) pushed with a
+# timestamp, and each sample only updates the open window it falls in for
+# each window length, so the cost per sample is constant.
+#
+# Windows close once the watermark, the latest timestamp seen less the
+# allowed lateness, passes their end, and are then returned by push() as a
+# WindowAggregate for each field. Samples for windows which have already
+# closed are counted as late and dropped, so memory is bounded by the
+# number of open windows. This can also be capped with max_open, in which
+# case the windows ending soonest are closed early, with partial aggregates.
+
+class WindowAggregate(collections.namedtuple(
+    "WindowAggregate", ("user_id", "field", "window", "start", "count", "sum", "min", "max")
+)):
+
+    # Aggregate of one field of one instrument over [start, start + window)
+    __slots__ = ()
+
+    @property
+    def end(self):
+        return self.start + self.window
+
+    @property
+    def mean(self):
+        return self.sum / self.count
+
+class Aggregator:
+
+    WINDOWS_DEFAULT = (60, 3600, 86400) # seconds
+    # Fields which aren't measurements, so aren't aggregated by default
+    EXCLUDE = ("sequence_number", "channel", "length", "timestamp")
+
+    def __init__(self, windows = None, fields = None, lateness = 0.0, max_open = None):
+
+        self.windows = tuple(windows or Aggregator.WINDOWS_DEFAULT)
+        if any(window <= 0 for window in self.windows) or lateness < 0:
+            raise ValueError("Windows should be positive and lateness should not be negative")
+        # Fields to aggregate, or None for every measurement
+        self.fields = None if fields == None else tuple(fields)
+        self.lateness = lateness
+        self.max_open = max_open
+
+        # Fields of each sample type and their indices in its records
+        self.layouts = {}
+        # (user_id, sample type, window, start) -> [[count, sum, min, max]]
+        # for each field of the sample type
+        self.open = {}
+        # (end, order, key) of each open window, soonest first (the order
+        # breaks ties, so keys are never compared)
+        self.ends = []
+        self.order = itertools.count()
+        self.watermark = -math.inf
+
+        # Statistics
+        self.samples = 0
+        self.late = 0
+        self.closed = 0
+
+    def __len__(self):
+        return len(self.open)
+
+    def layout(self, sample_class):
+
+        # Fields to aggregate for a type of sample, and their indices in
+        # its records
+        if sample_class not in self.layouts:
+            if issubclass(sample_class, Record):
+                all_fields = sample_class._fields
+            elif issubclass(sample_class, Data):
+                all_fields = sample_class.PACKET_CLASS.RECORD._fields
+            else:
+                raise TypeError("Invalid sample type, should be a Data object or a record")
+            if self.fields == None:
+                fields = [field for field in all_fields if field not in Aggregator.EXCLUDE]
+            else:
+                fields = [field for field in all_fields if field in self.fields]
+            self.layouts[sample_class] = (
+                tuple(fields), tuple(all_fields.index(field) for field in fields)
+            )
+        return self.layouts[sample_class]
+
+    def push(self, sample, timestamp, user_id = None):
+
+        # Add a sample, returning a list of WindowAggregates for any windows
+        # which have closed (usually none), in the order they closed
+        sample_class = sample.__class__
+        fields, indices = self.layout(sample_class)
+        if isinstance(sample, Record):
+            record = tuple(sample)
+            values = [record[i] for i in indices]
+        else:
+            values = [getattr(sample, field, None) for field in fields]
+        self.samples += 1
+
+        if timestamp - self.lateness > self.watermark:
+            self.watermark = timestamp - self.lateness
+        watermark = self.watermark
+
+        # Check for missing values (None or NaN, or infinite values which
+        # sum to NaN) once, rather than for each window
+        try:
+            total = sum(values)
+        except TypeError:
+            total = math.nan
+        if total != total:
+            present = [i for i, value in enumerate(values) if value != None and value == value]
+        else:
+            present = None
+
+        late = False
+        for window in self.windows:
+            start = timestamp - timestamp % window
+            if start + window <= watermark:
+                # Already closed
+                late = True
+                continue
+            key = (user_id, sample_class, window, start)
+            accumulator = self.open.get(key)
+            if accumulator == None:
+                accumulator = [[0, 0.0, math.inf, -math.inf] for _ in fields]
+                self.open[key] = accumulator
+                heapq.heappush(self.ends, (start + window, next(self.order), key))
+            if present == None:
+                updates = zip(values, accumulator)
+            else:
+                updates = [(values[i], accumulator[i]) for i in present]
+            for value, totals in updates:
+                totals[0] += 1
+                totals[1] += value
+                if value < totals[2]:
+                    totals[2] = value
+                if value > totals[3]:
+                    totals[3] = value
+        if late:
+            self.late += 1
+
+        return self.expire()
+
+    def expire(self, watermark = None):
+
+        # Close windows which end at or before the watermark (by default the
+        # latest timestamp less the lateness, or given explicitly to close
+        # windows of instruments which have gone quiet), and any beyond
+        # max_open, soonest first
+        if watermark != None and watermark > self.watermark:
+            self.watermark = watermark
+        watermark = self.watermark
+
+        ends = self.ends
+        closed = []
+        while ends and (ends[0][0] <= watermark or (self.max_open != None and len(ends) > self.max_open)):
+            _, _, key = heapq.heappop(ends)
+            closed.extend(self.close(key))
+        return closed
+
+    def flush(self):
+        # Close every open window, soonest first
+        closed = []
+        while self.ends:
+            _, _, key = heapq.heappop(self.ends)
+            closed.extend(self.close(key))
+        return closed
+
+    def close(self, key):
+        user_id, sample_class, window, start = key
+        fields = self.layouts[sample_class][0]
+        totals = self.open.pop(key)
+        self.closed += 1
+        return [
+            WindowAggregate(user_id, field, window, start, *field_totals)
+            for field, field_totals in zip(fields, totals) if field_totals[0] > 0
+        ]
+
+    def process(self, samples):
+        # Aggregate an iterable of (sample, timestamp, user_id), as taken by
+        # push(), yielding WindowAggregates as windows close, and the rest
+        # at the end
+        for sample, timestamp, user_id in samples:
+            yield from self.push(sample, timestamp, user_id)
+        yield from self.flush()
+
+    def __repr__(self):
+        return f"Aggregator: {len(self.open)} open windows, {self.closed} closed, {self.late} late samples"
@@ -0,0 +1,429 @@
+from cryodecoder import Packet, MBusPacket, SDSatellitePacket
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+##############################################################################
+# SD ARCHIVES
+##############################################################################
+# SD card dumps are back-to-back SDSatellitePacket records, each of which is
+# a fixed size header ending in a length byte, followed by that many bytes of
+# M-Bus frame. The archive is memory-mapped and record offsets are found by
+# hopping from one length byte to the next, only as far into the file as is
+# needed, and packets are decoded when they are accessed.
+
+class SDArchive(Sequence):
+
+    def __init__(self, path, index = False, lazy = False):
+
+        self.path = os.fspath(path)
+        # Decode packet fields on first access (see Packet)
+        self.lazy = lazy
+        self.file = open(self.path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+
+        # mmap can't map an empty file
+        if self.size > 0:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.buffer = b""
+        # Packets are views into the mapping, so nothing is copied unless
+        # Packet.copy() is used
+        self.view = memoryview(self.buffer)
+
+        # Location of the length field in each record header
+        self.header_size = SDSatellitePacket.MIN_SIZE
+        self.length_offset = \
+            Packet.CONFIG[SDSatellitePacket].fields["length"].offset
+
+        # Record offsets found so far, and where to continue looking from
+        self.offsets = array("Q")
+        self.scan_offset = 0
+        self.scan_complete = False
+
+        # Load (or build) the sidecar index, which also provides the offsets
+        self.index = None
+        if index:
+            self.index = SDArchiveIndex.open(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # Packets still hold views into the mapping, which will be
+                # unmapped once they have all been released
+                pass
+        self.file.close()
+
+    def scan(self, count = None):
+
+        # Walk the length fields until we know the offsets of (at least)
+        # count records, or until the end of the archive
+        offsets = self.offsets
+        buffer = self.buffer
+        offset = self.scan_offset
+        header_size = self.header_size
+        length_offset = self.length_offset
+        size = self.size
+
+        while not self.scan_complete and (count == None or len(offsets) < count):
+
+            if offset + header_size > size:
+                self.scan_complete = True
+                break
+
+            end = offset + header_size + buffer[offset + length_offset]
+            if end > size:
+                # Ignore a truncated record at the end of the archive
+                self.scan_complete = True
+                break
+
+            offsets.append(offset)
+            offset = end
+
+        self.scan_offset = offset
+
+    def split(self, chunk_size):
+
+        # Yield (start, end) offsets which split the archive into chunks of
+        # whole records, each of at least chunk_size bytes (apart from the
+        # last). Unlike scan(), record offsets are not kept.
+        buffer = self.buffer
+        header_size = self.header_size
+        length_offset = self.length_offset
+        size = self.size
+
+        start = offset = 0
+        while offset + header_size <= size:
+            end = offset + header_size + buffer[offset + length_offset]
+            if end > size:
+                # Ignore a truncated record at the end of the archive
+                break
+            offset = end
+            if offset - start >= chunk_size:
+                yield start, offset
+                start = offset
+
+        if offset > start:
+            yield start, offset
+
+    def record_range(self, index):
+
+        # Return the start and end offset of a record
+        offset = self.offsets[index]
+        return offset, offset + self.header_size + self.buffer[offset + self.length_offset]
+
+    def raw(self, index):
+        start, end = self.record_range(index)
+        return self.view[start:end]
+
+    def __len__(self):
+        self.scan()
+        return len(self.offsets)
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            return SDArchiveView(self, self.slice_range(key))
+
+        if key < 0:
+            key += len(self)
+        elif key >= len(self.offsets):
+            self.scan(key + 1)
+
+        if key < 0 or key >= len(self.offsets):
+            raise IndexError("SDArchive index out of range")
+
+        return SDSatellitePacket(self.raw(key), lazy = self.lazy)
+
+    def __iter__(self):
+
+        index = 0
+        while True:
+            if index >= len(self.offsets):
+                self.scan(index + 1)
+                if index >= len(self.offsets):
+                    return
+            yield SDSatellitePacket(self.raw(index), lazy = self.lazy)
+            index += 1
+
+    def select(self, user_id = None, start = None, end = None):
+
+        # Return the records for a user_id and/or timestamp range [start, end]
+        # using the sidecar index
+        if self.index == None:
+            raise ValueError("SDArchive must be opened with index = True to select records")
+
+        return SDArchiveView(self, self.index.select(user_id, start, end))
+
+    def slice_range(self, key):
+
+        # Avoid scanning the whole archive for slices that only need the
+        # first few records
+        step = key.step or 1
+        if step > 0 and key.stop != None and key.stop >= 0 \
+            and (key.start == None or key.start >= 0):
+            self.scan(key.stop)
+            return range(len(self.offsets))[key]
+
+        return range(len(self))[key]
+
+class SDArchiveView(Sequence):
+
+    # A lazily decoded sub-range (or slice) of an SDArchive
+    def __init__(self, archive, indices):
+        self.archive = archive
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return SDArchiveView(self.archive, self.indices[key])
+        return self.archive[self.indices[key]]
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.archive[index]
+
+##############################################################################
+# SIDECAR INDEX
+##############################################################################
+# For each record the index stores the offset, timestamp, channel and the
+# user_id of the embedded MBusPacket, so that queries can seek straight to
+# the records they need. The file is a header followed by blocks of columns;
+# when the archive has only grown, new records are appended as a new block.
+#
+# Whether the archive has changed is checked from the CRC of CHECK_BLOCKS
+# blocks of CHECK_SIZE bytes, spread evenly over the indexed part of the
+# archive, and the CHECK_SIZE bytes before the scan offset. Archives up to
+# CHECK_BLOCKS * CHECK_SIZE bytes are checked completely, but in larger
+# archives an edit which doesn't touch any of the sampled blocks isn't seen.
+# Delete the index to rebuild it after editing an archive in place.
+
+class SDArchiveIndex:
+
+    MAGIC = b"CRYOIDX2"
+    SUFFIX = ".idx"
+    # magic | scan offset | record count | CRC of sampled archive blocks
+    HEADER = struct.Struct("<8sQQI")
+    BLOCK_HEADER = struct.Struct("<Q")
+    # Number and size of the archive blocks used to detect changes
+    CHECK_BLOCKS = 16
+    CHECK_SIZE = 4096
+    # column name | array typecode
+    COLUMNS = (
+        ("offsets", "Q"),
+        ("timestamps", "I"),
+        ("channels", "B"),
+        ("user_ids", "I"),
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.scan_offset = 0
+        self.check = 0
+        for column, typecode in SDArchiveIndex.COLUMNS:
+            setattr(self, column, array(typecode))
+        # Per user_id record numbers, built on first use
+        self.user_records = None
+        self.timestamps_sorted = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def open(cls, archive, path = None):
+
+        index = cls(path or archive.path + SDArchiveIndex.SUFFIX)
+
+        # Start again if the index is missing, corrupt or the archive has
+        # changed other than by growing
+        if not index.load() or not index.matches(archive):
+            index = cls(index.path)
+
+        count = len(index)
+        index.update(archive)
+
+        if count == 0:
+            index.write()
+        elif len(index) > count:
+            index.append(count)
+
+        return index
+
+    @staticmethod
+    def archive_check(archive, scan_offset):
+
+        buffer = archive.buffer
+        check_size = SDArchiveIndex.CHECK_SIZE
+        if scan_offset <= SDArchiveIndex.CHECK_BLOCKS * check_size:
+            return zlib.crc32(buffer[:scan_offset])
+
+        check = 0
+        step = scan_offset // SDArchiveIndex.CHECK_BLOCKS
+        for start in range(0, SDArchiveIndex.CHECK_BLOCKS * step, step):
+            check = zlib.crc32(buffer[start : start + check_size], check)
+        return zlib.crc32(buffer[scan_offset - check_size : scan_offset], check)
+
+    def matches(self, archive):
+        return self.scan_offset <= archive.size \
+            and self.check == SDArchiveIndex.archive_check(archive, self.scan_offset)
+
+    def update(self, archive):
+
+        # Carry on walking the archive from the end of the indexed records
+        archive.offsets = self.offsets
+        archive.scan_offset = self.scan_offset
+        archive.scan_complete = False
+        archive.scan()
+
+        # Field positions within each record
+        timestamp_offset, timestamp_format = \
+            SDSatellitePacket.DECODER.formats["timestamp"]
+        channel_offset, channel_format = \
+            SDSatellitePacket.DECODER.formats["channel"]
+        user_id_offset, user_id_format = \
+            MBusPacket.DECODER.formats["user_id"]
+        timestamp = struct.Struct(timestamp_format)
+        channel = struct.Struct(channel_format)
+        user_id = struct.Struct(user_id_format)
+        user_id_offset += archive.header_size
+        user_id_end = user_id_offset + user_id.size
+
+        buffer = archive.buffer
+        for offset in self.offsets[len(self.timestamps):]:
+            self.timestamps.append(timestamp.unpack_from(buffer, offset + timestamp_offset)[0])
+            self.channels.append(channel.unpack_from(buffer, offset + channel_offset)[0])
+            # Records too short to hold a user_id are given an ID of zero
+            if archive.header_size + buffer[offset + archive.length_offset] >= user_id_end:
+                self.user_ids.append(user_id.unpack_from(buffer, offset + user_id_offset)[0])
+            else:
+                self.user_ids.append(0)
+
+        self.scan_offset = archive.scan_offset
+        self.check = SDArchiveIndex.archive_check(archive, self.scan_offset)
+        self.user_records = None
+        self.timestamps_sorted = None
+
+    def load(self):
+
+        try:
+            with open(self.path, "rb") as index_fh:
+                contents = index_fh.read()
+        except FileNotFoundError:
+            return False
+
+        if len(contents) < SDArchiveIndex.HEADER.size:
+            return False
+
+        magic, scan_offset, count, check = \
+            SDArchiveIndex.HEADER.unpack_from(contents)
+        if magic != SDArchiveIndex.MAGIC:
+            return False
+
+        position = SDArchiveIndex.HEADER.size
+        while position < len(contents):
+            block_count, = SDArchiveIndex.BLOCK_HEADER.unpack_from(contents, position)
+            position += SDArchiveIndex.BLOCK_HEADER.size
+            for column, typecode in SDArchiveIndex.COLUMNS:
+                values = array(typecode)
+                block_size = block_count * values.itemsize
+                if position + block_size > len(contents):
+                    return False
+                values.frombytes(contents[position : position + block_size])
+                if sys.byteorder == "big":
+                    values.byteswap()
+                getattr(self, column).extend(values)
+                position += block_size
+
+        # A partially written block leaves the header count behind
+        if len(self) != count:
+            return False
+
+        self.scan_offset = scan_offset
+        self.check = check
+        return True
+
+    def write_block(self, index_fh, start):
+
+        index_fh.write(SDArchiveIndex.BLOCK_HEADER.pack(len(self) - start))
+        for column, _ in SDArchiveIndex.COLUMNS:
+            values = getattr(self, column)[start:]
+            # Index files are always little endian
+            if sys.byteorder == "big":
+                values.byteswap()
+            index_fh.write(values.tobytes())
+
+    def write_header(self, index_fh):
+        index_fh.write(SDArchiveIndex.HEADER.pack(
+            SDArchiveIndex.MAGIC, self.scan_offset, len(self), self.check
+        ))
+
+    def write(self):
+
+        # Write to a temporary file and replace so that a reader never sees
+        # a half written index
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as index_fh:
+            self.write_header(index_fh)
+            self.write_block(index_fh, 0)
+        os.replace(temp_path, self.path)
+
+    def append(self, start):
+
+        # Add the records from start onwards as a new block, then update the
+        # header once the block has been written
+        with open(self.path, "r+b") as index_fh:
+            index_fh.seek(0, os.SEEK_END)
+            self.write_block(index_fh, start)
+            index_fh.flush()
+            index_fh.seek(0)
+            self.write_header(index_fh)
+
+    def select(self, user_id = None, start = None, end = None):
+
+        if user_id != None:
+            if self.user_records == None:
+                self.user_records = {}
+                for record, record_user_id in enumerate(self.user_ids):
+                    self.user_records.setdefault(record_user_id, array("Q")).append(record)
+            records = self.user_records.get(user_id, array("Q"))
+        else:
+            records = range(len(self))
+
+        if start == None and end == None:
+            return records
+
+        if self.timestamps_sorted == None:
+            self.timestamps_sorted = all(
+                a <= b for a, b in zip(self.timestamps, self.timestamps[1:])
+            )
+
+        timestamps = self.timestamps
+        if self.timestamps_sorted and user_id == None:
+            # Seek straight to the range for time ordered archives
+            first = 0 if start == None else bisect_left(timestamps, start)
+            last = len(timestamps) if end == None else bisect_right(timestamps, end)
+            return range(first, last)
+
+        return [
+            record for record in records
+            if (start == None or timestamps[record] >= start)
+                and (end == None or timestamps[record] <= end)
+        ]
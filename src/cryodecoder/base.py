@@ -1,19 +1,43 @@
 from abc import ABC, abstractmethod
 
+import enum
+import hashlib
+import marshal
+import math
+import mmap
+import numbers
+import operator
+import os
+import struct
 import sys
 
-if sys.version_info <= (3,11):
-    import toml as tomllib
-else:
-    import tomllib
-
 
 ##############################################################################
 # PACKETS
 ##############################################################################
 
-class InvalidPacketError(Exception):
-    pass
+class ErrorReason(enum.IntEnum):
+
+    # Why a packet (or frame) is invalid, see InvalidPacketError and
+    # cryodecoder.bulk
+    INVALID = 0
+    TOO_SHORT = 1
+    TOO_LONG = 2
+    TRUNCATED = 3
+    NOISE = 4
+    INVALID_C_FIELD = 5
+    INVALID_HEADER = 6
+    UNKNOWN_PAYLOAD = 7
+    INVALID_CHANNEL = 8
+    OUT_OF_RANGE = 9
+
+class InvalidPacketError(ValueError):
+
+    # Raised for invalid packet contents (as opposed to invalid arguments),
+    # with the reason as an ErrorReason
+    def __init__(self, message, reason = ErrorReason.INVALID):
+        super().__init__(message)
+        self.reason = reason
 
 class Packet:
 
@@ -21,31 +45,50 @@ class Packet:
     # Define magic word class variable
     MAIGC_WORD = b'\00'
 
-    def __init__(self, raw = None, encoding = "utf-8"):
+    def __init__(self, raw = None, encoding = "utf-8", lazy = False):
 
         # Define common instance variables for Packet
         if raw != None:
             self.set_raw_data(raw, encoding)
-            # and parse
-            self.parse()
+            # and parse, unless fields should be decoded when first accessed
+            if not lazy:
+                self.parse()
 
     def set_raw_data(self, raw = None, encoding = "utf-8"):
         # Validate packet
         Packet.__validate_raw(raw)
-        # and then assign data
+        # Forget any fields decoded from previous raw data
+        if "raw" in self.__dict__:
+            for field in self.__class__.DECODER.field_decoders:
+                self.__dict__.pop(field, None)
+        # and then assign data, without copying anything other than str
         if isinstance(raw, str):
             self.raw = bytearray(raw, encoding)
-        elif isinstance(raw, bytes): 
-            self.raw = bytearray(raw)
         elif isinstance(raw, bytearray):
+            # Used as-is, but as the caller may resize it, nested packets
+            # are copies rather than views into it (see PacketDecoder.decode)
             self.raw = raw
+        elif isinstance(raw, memoryview) and raw.format == "B" and raw.ndim == 1:
+            self.raw = raw
+        elif isinstance(raw, (bytes, memoryview, mmap.mmap)):
+            # View into the caller's buffer (see copy())
+            self.raw = memoryview(raw).cast("B")
         else:
             # TODO: fix with proper error message
-            raise TypeError("Raw data must be str, bytes or bytearray")
+            raise TypeError("Raw data must be str, bytes, bytearray, memoryview or mmap")
 
         # Validate length        
         if len(raw) < self.__class__.MIN_SIZE:
-            raise ValueError(f"Raw data should meet or exceed minimum size ({self.MIN_SIZE}) for packet type {self.__class__.__name__}")
+            raise InvalidPacketError(
+                f"Raw data should meet or exceed minimum size ({self.MIN_SIZE}) for packet type {self.__class__.__name__}",
+                ErrorReason.TOO_SHORT
+            )
+
+    def copy(self):
+        # Packets may be views into a shared buffer (e.g. an mmap), so take
+        # a copy of the raw data to keep a packet independent of it. The
+        # copy is immutable, so nested packets can still be views into it.
+        return self.__class__(bytes(self.raw))
 
     def __eq__(self, comparator):
         # Packets are equal if they are the same type,
@@ -59,58 +102,113 @@ class Packet:
     # All subclasses should implement the parse method to assign 
     # instance variables
     def parse(self):
-        
-        # Store length variable locally
-        length = len(self.raw)
-
-        # Iterate through fields
-        for field, field_config in Packet.CONFIG[self.__class__].fields.items():
-            
-            # Get start and end index
-            if isinstance(field_config.offset, list): 
-                offset_list = field_config.offset.copy()
-            else:
-                if field_config.length == None:
-                    raise ValueError("Length field cannot be NoneType")
-                # otherwise create a new list                
-                offset_list = [field_config.offset, field_config.offset + field_config.length - 1]
-
-
-            # Correct negative values
-            for i in range(len(offset_list)):
-                if offset_list[i] < 0:
-                    # Substract from length
-                    offset_list[i] = length + offset_list[i]
-
-            # unpack indices
-            start_idx, end_idx = offset_list
-
-            # parse value
-            parser = getattr(self.__class__, field_config.parser)
-            setattr(self, field, parser(self.raw[start_idx : end_idx + 1]))
+        # Run the decode plan compiled for this class in Packet.configure
+        self.__class__.DECODER.decode(self)
 
     def __len__(self):
         return len(self.raw)
 
     @classmethod
-    def configure(this_class, packet_class, config_obj):
+    def configure(this_class, packet_class, config_obj, lazy = False):
 
         # Check that a valid configuration exists
         if not packet_class.__name__ in config_obj:
             raise ValueError(f"Could not find class{config_obj} in the provided configuration file.")
         else:
-            # Assign configuration to class
-            this_class.CONFIG[packet_class] = \
-                PacketConfig(config_obj[packet_class.__name__], packet_class.__name__)
+            # Assign configuration to class, which may already be compiled
+            # (see load_compiled_packet_config)
+            packet_config = config_obj[packet_class.__name__]
+            if not isinstance(packet_config, PacketConfig):
+                packet_config = PacketConfig(packet_config, packet_class.__name__)
+            this_class.CONFIG[packet_class] = packet_config
 
-            packet_class.MIN_SIZE = this_class.CONFIG[packet_class].length
+            # Forget anything compiled from a previous configuration
+            for name in LazyCompile.ATTRIBUTES:
+                if name in packet_class.__dict__:
+                    delattr(packet_class, name)
+
+            # Unless lazy, in which case this happens when the class is
+            # first used (see LazyCompile)
+            if not lazy:
+                this_class.compile(packet_class)
+
+    @classmethod
+    def compile(this_class, packet_class):
+
+        packet_class.MIN_SIZE = this_class.CONFIG[packet_class].length
+        # Compile the field definitions into a decode plan once, rather
+        # than walking the configuration for every packet
+        packet_class.DECODER = \
+            PacketDecoder(packet_class, this_class.CONFIG[packet_class])
+
+        # Compact record type for converted values (see Data.to_record),
+        # holding the fields which are unpacked as numbers
+        record_name = packet_class.__name__
+        if record_name.endswith("Packet"):
+            record_name = record_name[:-len("Packet")]
+        packet_class.RECORD = Record.make_type(
+            record_name + "Record", 
+            packet_class.DECODER.formats,
+            packet_class
+        )
+
+        # Install a descriptor for each field so that packets created
+        # with lazy = True decode fields on first access
+        for field, decode in packet_class.DECODER.field_decoders.items():
+            existing = getattr(packet_class, field, None)
+            if existing != None and not isinstance(existing, LazyField):
+                raise ValueError(f"Field {field} clashes with an existing attribute of {packet_class.__name__}")
+            setattr(packet_class, field, LazyField(field, decode))
 
     @staticmethod
     def __validate_raw(raw):    
-        if not isinstance(raw, (str, bytes, bytearray)):
-            raise TypeError("Raw data should be of type 'str', 'bytes' or 'bytearray'")
+        if not isinstance(raw, (str, bytes, bytearray, memoryview, mmap.mmap)):
+            raise TypeError("Raw data should be of type 'str', 'bytes', 'bytearray', 'memoryview' or 'mmap'")
         
 
+class LazyCompile:
+
+    # Descriptor on Packet for the class attributes set by Packet.compile.
+    # Packet classes configured with lazy = True don't have these until
+    # the first time one of them is used (e.g. by creating a packet), when
+    # the class is compiled and its own attributes replace this descriptor.
+    ATTRIBUTES = ("MIN_SIZE", "DECODER", "RECORD")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, packet, owner = None):
+        if owner not in Packet.CONFIG:
+            raise AttributeError(f"{owner.__name__} has not been configured")
+        Packet.compile(owner)
+        return owner.__dict__[self.name]
+
+    def __repr__(self):
+        return f"LazyCompile: {self.name}"
+
+for name in LazyCompile.ATTRIBUTES:
+    setattr(Packet, name, LazyCompile(name))
+
+class LazyField:
+
+    # Non-data descriptor installed on each Packet class for every field.
+    # It is only reached when the field hasn't been decoded into the
+    # instance __dict__, so eager packets are unaffected, and lazy packets
+    # decode (and cache) each field the first time it is accessed.
+    def __init__(self, name, decode):
+        self.name = name
+        self.decode = decode
+
+    def __get__(self, packet, owner = None):
+        if packet is None:
+            return self
+        value = self.decode(packet)
+        packet.__dict__[self.name] = value
+        return value
+
+    def __repr__(self):
+        return f"LazyField: {self.name}"
+
 class PacketConfigParameters:
     
     OUTPUT_TYPE_MAP = {
@@ -126,14 +224,17 @@ class PacketConfigParameters:
         endianness = "little",
         output_type = "int",
         signed = False,
-        parser = None
+        parser = None,
+        arguments = None
     ):
         self.offset = offset
         self.length = length
         self.endianness = endianness
-        self.output_type = output_type,
-        self.signed = signed,
+        self.output_type = output_type
+        self.signed = signed
         self.parser = parser
+        # Other fields of the packet passed to the parser after the raw bytes
+        self.arguments = arguments
 
     def copy(self):
         return PacketConfigParameters(
@@ -143,6 +244,7 @@ class PacketConfigParameters:
             output_type = self.output_type,
             signed = self.signed,
             parser = self.parser,
+            arguments = self.arguments,
         )
     
     def __repr__(self):
@@ -159,7 +261,15 @@ class PacketConfig:
         "endianness"     : "little",
         "output_type"    : "int",
         "signed"         : False,
-        "parser"         : None
+        "parser"         : None,
+        "arguments"      : None
+    }
+
+    PACKET_PARAMETERS = {
+        # Parameter name | Default value
+        # -------------- | -------------
+        # CI byte(s) identifying this packet as an MBusPacket payload
+        "control_field"  : None
     }
 
     def __init__(self, config_obj, name):
@@ -170,6 +280,8 @@ class PacketConfig:
         self.fields = dict()
         self.length = 0
         self.name = name
+        # Packet level (rather than field level) parameters
+        self.control_field = []
         
         # Check that the config contains the current packet
         self.parse(config_obj)
@@ -188,6 +300,13 @@ class PacketConfig:
                 # assign updated default parameter
                 setattr(self.__default_parameters, field, config_obj[field])
 
+            elif field in PacketConfig.PACKET_PARAMETERS \
+                and not isinstance(config_obj[field], dict):
+
+                # Allow a single value or a list of values
+                value = config_obj[field]
+                setattr(self, field, value if isinstance(value, list) else [value])
+
             elif isinstance(config_obj[field], dict):    
                 pass# Ignore for now because we need to parse all default parameters first
             else:
@@ -215,27 +334,526 @@ class PacketConfig:
 
                 # Sum up the number of bytes we have - if a value has None length 
                 # (i.e. it's a variable field) then we leave this as zero.
-                self.length += temp_parameters.length or 0
+                if temp_parameters.length is None \
+                    and isinstance(temp_parameters.offset, list):
+                    # unless both offsets are counted from the same end of
+                    # the packet, in which case the field has a fixed width
+                    start_idx, end_idx = temp_parameters.offset
+                    if (start_idx < 0) == (end_idx < 0):
+                        self.length += end_idx - start_idx + 1
+                else:
+                    self.length += temp_parameters.length or 0
 
                 # Assign the field to the packet defintion
                 self.fields[field] = temp_parameters
 
+    def to_values(self):
+        # Plain values (see load_compiled_packet_config)
+        return {
+            "name" : self.name,
+            "length" : self.length,
+            "control_field" : self.control_field,
+            "fields" : {field : vars(parameters) for field, parameters in self.fields.items()},
+        }
+
+    @classmethod
+    def from_values(this_class, values):
+        # Rebuild a PacketConfig from to_values, without parsing again
+        packet_config = this_class.__new__(this_class)
+        packet_config.name = values["name"]
+        packet_config.length = values["length"]
+        packet_config.control_field = values["control_field"]
+        packet_config.fields = {}
+        for field, field_values in values["fields"].items():
+            packet_config.fields[field] = PacketConfigParameters(**field_values)
+        return packet_config
+
+class PacketDecoder:
+
+    # struct format characters for fixed width fields, indexed by length
+    INT_FORMATS = {1 : "b", 2 : "h", 4 : "i", 8 : "q"}
+    FLOAT_FORMATS = {4 : "f", 8 : "d"}
+    BYTE_ORDER = {"little" : "<", "big" : ">"}
+
+    def __init__(self, packet_class, packet_config):
+
+        self.packet_class = packet_class
+        # Fields are unpacked with one struct.Struct per byte order, either
+        # from the start of the packet (head) or from the end (tail)
+        self.head = []
+        self.tail = []
+        # and anything else is sliced out and passed to the field's parser
+        self.sliced = []
+        # Keep the struct format and offset of each unpacked field so that
+        # other decoders (e.g. batch) can reuse the verified layout
+        self.formats = {}
+
+        self.compile(packet_config)
+
+    def compile(self, packet_config):
+
+        # Collect struct-compatible fields by (from_end, byte_order)
+        groups = {}
+
+        for field, field_config in packet_config.fields.items():
+
+            # Resolve the parser once here instead of for every packet
+            parser = getattr(self.packet_class, field_config.parser)
+
+            # Get start and end index
+            if isinstance(field_config.offset, list):
+                start_idx, end_idx = field_config.offset
+            else:
+                if field_config.length == None:
+                    raise ValueError("Length field cannot be NoneType")
+                start_idx = field_config.offset
+                end_idx = field_config.offset + field_config.length - 1
+
+            field_format = None
+            if (start_idx < 0) == (end_idx < 0) and not field_config.arguments:
+                field_format = PacketDecoder.struct_format(
+                    field_config, end_idx - start_idx + 1, parser
+                )
+
+            if field_format == None:
+                # Variable length (or otherwise unstructured) field, where
+                # the end index is inclusive and -1 refers to the last byte
+                self.sliced.append((
+                    field, 
+                    slice(start_idx, end_idx + 1 or None), 
+                    parser,
+                    PacketDecoder.field_arguments(field_config, packet_config)
+                ))
+            else:
+                byte_order, format_char = field_format
+                groups.setdefault((start_idx < 0, byte_order), []).append(
+                    (start_idx, end_idx, format_char, field, parser)
+                )
+
+        # Build a single format string for each group, padding any gaps
+        for (from_end, byte_order), group_fields in groups.items():
+
+            group_fields.sort()
+            base_idx = group_fields[0][0]
+            cursor = base_idx
+            fmt = byte_order
+            names = []
+
+            for start_idx, end_idx, format_char, field, parser in group_fields:
+                if start_idx < cursor:
+                    # Overlapping fields can't share a struct, so fall back
+                    # to slicing for this one
+                    self.sliced.append(
+                        (field, slice(start_idx, end_idx + 1 or None), parser, ())
+                    )
+                    continue
+                if start_idx > cursor:
+                    fmt += f"{start_idx - cursor}x"
+                fmt += format_char
+                names.append(field)
+                self.formats[field] = (start_idx, byte_order + format_char)
+                cursor = end_idx + 1
+
+            if from_end:
+                self.tail.append((struct.Struct(fmt), base_idx, tuple(names)))
+            else:
+                self.head.append((struct.Struct(fmt), base_idx, tuple(names)))
+
+        # Single field decoders, used when fields are decoded on first access
+        sliced = {
+            field : (field_slice, parser, arguments) 
+            for field, field_slice, parser, arguments in self.sliced
+        }
+        self.field_decoders = {}
+        for field in packet_config.fields:
+            if field in self.formats:
+                offset, field_format = self.formats[field]
+                self.field_decoders[field] = \
+                    PacketDecoder.struct_field(struct.Struct(field_format), offset)
+            else:
+                self.field_decoders[field] = \
+                    PacketDecoder.sliced_field(*sliced[field])
+
+    @staticmethod
+    def field_arguments(field_config, packet_config):
+
+        # Names of other fields to pass to the parser of this field
+        arguments = tuple(field_config.arguments or ())
+        for argument in arguments:
+            if argument not in packet_config.fields:
+                raise ValueError(f"Argument {argument} is not a field of {packet_config.name}")
+        return arguments
+
+    @staticmethod
+    def struct_field(unpacker, offset):
+        unpack_from = unpacker.unpack_from
+        if offset < 0:
+            return lambda packet: unpack_from(packet.raw, len(packet.raw) + offset)[0]
+        else:
+            return lambda packet: unpack_from(packet.raw, offset)[0]
+
+    @staticmethod
+    def sliced_field(field_slice, parser, arguments):
+        # Parsers that build nested packets take a lazy argument, so that
+        # nested packets of a lazy packet are lazy too
+        kwargs = {}
+        code = getattr(parser, "__code__", None)
+        if code != None and "lazy" in code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]:
+            kwargs["lazy"] = True
+        return lambda packet: parser(
+            packet.raw[field_slice],
+            *[getattr(packet, argument) for argument in arguments],
+            **kwargs
+        )
+
+    def set_parser(self, field, parser):
+
+        # Replace the parser of a sliced field in place (e.g. to instrument
+        # it), keeping this decoder and the packet class as they are
+        for i, (name, field_slice, _, arguments) in enumerate(self.sliced):
+            if name == field:
+                self.sliced[i] = (name, field_slice, parser, arguments)
+                decode = self.field_decoders[field] = \
+                    PacketDecoder.sliced_field(field_slice, parser, arguments)
+                lazy_field = self.packet_class.__dict__.get(field)
+                if isinstance(lazy_field, LazyField):
+                    lazy_field.decode = decode
+                return
+        raise ValueError(f"Field {field} of {self.packet_class.__name__} isn't decoded by a parser")
+
+    def decode(self, packet):
+
+        raw = packet.raw
+        values = packet.__dict__
+
+        for unpacker, offset, names in self.head:
+            values.update(zip(names, unpacker.unpack_from(raw, offset)))
+
+        if self.tail:
+            # Negative offsets are relative to the packet length
+            length = len(raw)
+            for unpacker, offset, names in self.tail:
+                values.update(
+                    zip(names, unpacker.unpack_from(raw, length + offset))
+                )
+
+        if self.sliced:
+            # Nested packets are views into this packet's buffer when it's
+            # a memoryview, and copies when it's a bytearray, which would
+            # otherwise be locked against resizing while they're alive
+            for field, field_slice, parser, arguments in self.sliced:
+                if arguments:
+                    # Arguments not decoded yet are decoded by their LazyField
+                    values[field] = parser(
+                        raw[field_slice], 
+                        *[getattr(packet, argument) for argument in arguments]
+                    )
+                else:
+                    values[field] = parser(raw[field_slice])
+
+    @staticmethod
+    def struct_format(field_config, length, parser):
+
+        byte_order = PacketDecoder.BYTE_ORDER.get(field_config.endianness)
+        if byte_order == None:
+            return None
+
+        # Integers take their signedness from the configuration, but some
+        # fields are stored as IEEE floats so try those as well
+        candidates = []
+        if length in PacketDecoder.INT_FORMATS:
+            format_char = PacketDecoder.INT_FORMATS[length]
+            candidates.append(
+                format_char if field_config.signed else format_char.upper()
+            )
+        if length in PacketDecoder.FLOAT_FORMATS:
+            candidates.append(PacketDecoder.FLOAT_FORMATS[length])
+
+        # The parse_* methods remain the reference for each field, so only
+        # use a format if it gives the same values as the parser
+        for format_char in candidates:
+            if PacketDecoder.parser_matches(
+                parser, struct.Struct(byte_order + format_char)
+            ):
+                return byte_order, format_char
+
+        return None
+
+    @staticmethod
+    def parser_matches(parser, unpacker):
+
+        size = unpacker.size
+        probes = (
+            bytes(range(1, size + 1)),
+            b'\xff' * size,
+            b'\x80' + bytes(size - 1),
+            bytes(size - 1) + b'\x80',
+        )
+
+        for probe in probes:
+            expected, = unpacker.unpack(probe)
+            try:
+                result = parser(bytearray(probe))
+            except Exception:
+                return False
+            if type(result) is not type(expected):
+                return False
+            # NaN never compares equal, so only check it's NaN in both
+            if result != expected and (expected == expected or result == result):
+                return False
+
+        return True
+
+    def __repr__(self):
+        return f"PacketDecoder: {self.packet_class.__name__} (head={self.head}, tail={self.tail}, sliced={[sliced[0] for sliced in self.sliced]})"
+
 def load_packet_config(path):
-        if sys.version_info <= (3,11):
-            # Load string
-            with open(path, "r") as config_fh:
-                toml_file = config_fh.read()
-                return tomllib.loads(toml_file)
-        else:  
-            with open(path, "rb") as config_fh:
-                return tomllib.load(config_fh)
+    with open(path, "rb") as config_fh:
+        return parse_packet_config(config_fh.read())
+
+def parse_packet_config(source):
+    # The TOML parser is imported here, as it's only needed when the
+    # compiled configuration isn't cached (see load_compiled_packet_config)
+    if sys.version_info <= (3,11):
+        import toml
+        return toml.loads(source.decode("utf-8"))
+    else:
+        import tomllib
+        return tomllib.loads(source.decode("utf-8"))
+
+def compile_packet_config(config_obj):
+    # Parse and validate the configuration of every packet type
+    return {name : PacketConfig(config_obj[name], name) for name in config_obj}
+
+##############################################################################
+# COMPILED CONFIGURATION CACHE
+##############################################################################
+# Parsing packets.toml (and importing a TOML parser) is a large part of the
+# time taken to import cryodecoder, so the compiled configuration is cached
+# as plain values with marshal, keyed by a hash of the file contents. The
+# cache directory is $CRYODECODER_CACHE_DIR if set (an empty value disables
+# the cache), otherwise $XDG_CACHE_HOME/cryodecoder or ~/.cache/cryodecoder.
+
+# Change this whenever PacketConfig or PacketConfigParameters change
+CONFIG_CACHE_VERSION = 1
+
+def packet_config_cache_dir():
+    cache_dir = os.environ.get("CRYODECODER_CACHE_DIR")
+    if cache_dir != None:
+        return cache_dir or None
+    cache_home = os.environ.get("XDG_CACHE_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "cryodecoder")
+
+def packet_config_cache_path(source, cache_dir):
+    # marshal is specific to the Python version, so include it in the key
+    key = hashlib.sha256(source)
+    key.update(f"{CONFIG_CACHE_VERSION}:{sys.version_info[0]}.{sys.version_info[1]}".encode())
+    return os.path.join(cache_dir, f"packets-{key.hexdigest()}.marshal")
+
+def load_compiled_packet_config(path, cache_dir = None):
+
+    # Return the compiled configuration of every packet type in a packet
+    # config file, as {name : PacketConfig}, from the cache if possible
+    with open(path, "rb") as config_fh:
+        source = config_fh.read()
+
+    if cache_dir == None:
+        cache_dir = packet_config_cache_dir()
+    cache_path = None
+    if cache_dir:
+        cache_path = packet_config_cache_path(source, cache_dir)
+        try:
+            with open(cache_path, "rb") as cache_fh:
+                compiled = marshal.load(cache_fh)
+            return {name : PacketConfig.from_values(values) for name, values in compiled.items()}
+        except (OSError, EOFError, ValueError, TypeError, KeyError, AttributeError):
+            # Missing, unreadable or out of date, so rebuild it
+            pass
+
+    config = compile_packet_config(parse_packet_config(source))
+
+    if cache_path != None:
+        # Write to a temporary file and rename, so that a partially written
+        # cache is never read. The cache is optional, so carry on if the
+        # directory isn't writable.
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            with open(temp_path, "wb") as cache_fh:
+                marshal.dump({name : packet_config.to_values() for name, packet_config in config.items()}, cache_fh)
+            os.replace(temp_path, cache_path)
+        except (OSError, ValueError):
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    return config
+
+##############################################################################
+# RECORDS
+##############################################################################
+class RecordLayout:
+
+    # How the values of a record are packed: each value takes 8 bytes, as
+    # a float64 ("d"), int64 ("q"), uint64 ("Q") or padding for None ("n"),
+    # so that values keep their type. Layouts are shared by all records
+    # with the same kinds of values (see Record.layout).
+    __slots__ = ("kinds", "struct", "missing")
+
+    FORMATS = {"d" : "d", "q" : "q", "Q" : "Q", "n" : "8x"}
+
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.struct = struct.Struct("<" + "".join(RecordLayout.FORMATS[kind] for kind in kinds))
+        # Positions of None values, which aren't packed
+        self.missing = tuple(i for i, kind in enumerate(kinds) if kind == "n")
+
+    def pack(self, values):
+        if self.missing:
+            values = [value for value in values if value is not None]
+        return self.struct.pack(*values)
+
+    def unpack(self, packed):
+        values = self.struct.unpack(packed)
+        if self.missing:
+            values = list(values)
+            for i in self.missing:
+                values.insert(i, None)
+            values = tuple(values)
+        return values
+
+class Record:
+
+    # Immutable record of converted values, generated for each packet type
+    # by Packet.configure. Values are packed into a single bytes object
+    # rather than kept as separate objects, which makes each record several
+    # times smaller than a tuple or a Data object. Integers are packed as
+    # integers and floats as floats, and None is kept as None, so values
+    # come back as they went in (see RecordLayout).
+    __slots__ = ("_values", "_layout")
+
+    _fields = ()
+    # Layout of each combination of kinds of values, and record type of
+    # each packet type and field layout, so that records still compare
+    # equal and unpickle after a packet type is compiled again
+    LAYOUTS = {}
+    TYPES = {}
+    UNPACKERS = {
+        kind : struct.Struct("<" + kind).unpack_from for kind in ("d", "q", "Q")
+    }
+    INT64_MIN = -(1 << 63)
+    INT64_MAX = (1 << 63) - 1
+
+    def __init__(self, *values):
+        layout = Record.layout("".join([Record.kind(value) for value in values]))
+        self._values = layout.pack(values)
+        self._layout = layout
+
+    @staticmethod
+    def kind(value):
+        if value.__class__ is float:
+            return "d"
+        if value is None:
+            return "n"
+        if isinstance(value, numbers.Integral):
+            return "q" if Record.INT64_MIN <= value <= Record.INT64_MAX else "Q"
+        return "d"
+
+    @staticmethod
+    def layout(kinds):
+        layout = Record.LAYOUTS.get(kinds)
+        if layout == None:
+            layout = Record.LAYOUTS[kinds] = RecordLayout(kinds)
+        return layout
+
+    @classmethod
+    def _make(cls, values):
+        return cls(*values)
+
+    @classmethod
+    def _frombytes(cls, values, kinds):
+        # Record from already packed values (e.g. a row of an array)
+        record = cls.__new__(cls)
+        record._values = values
+        record._layout = Record.layout(kinds)
+        return record
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __iter__(self):
+        return iter(self._layout.unpack(self._values))
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return self._layout.unpack(self._values)[index]
+
+    def __eq__(self, comparator):
+        if isinstance(comparator, self.__class__):
+            return self._values == comparator._values and self._layout is comparator._layout
+        else:
+            return False
+
+    def __hash__(self):
+        return hash((self._values, self._layout.kinds))
+
+    def __reduce__(self):
+        return (self.__class__, tuple(self))
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={value!r}" for field, value in zip(self._fields, self))
+        return f"{self.__class__.__name__}({values})"
+
+    @staticmethod
+    def field_getter(index):
+        offset = 8 * index
+        unpackers = Record.UNPACKERS
+        def getter(record):
+            kind = record._layout.kinds[index]
+            if kind == "n":
+                return None
+            return unpackers[kind](record._values, offset)[0]
+        return getter
+
+    @staticmethod
+    def make_type(name, fields, packet_class):
+
+        fields = tuple(fields)
+        # Reachable from the packet class, so records can be pickled
+        qualname = packet_class.__qualname__ + ".RECORD"
+        key = (packet_class.__module__, qualname, name, fields)
+        record_type = Record.TYPES.get(key)
+        if record_type != None:
+            return record_type
+
+        namespace = {
+            "__slots__" : (),
+            "__module__" : packet_class.__module__,
+            "__qualname__" : qualname,
+            "_fields" : fields,
+        }
+        for i, field in enumerate(fields):
+            namespace[field] = property(Record.field_getter(i))
+
+        record_type = Record.TYPES[key] = type(name, (Record,), namespace)
+        return record_type
 
 ##############################################################################
 # DATA
 ##############################################################################
 class Data:
+
+    # Packet type converted by this Data type
+    PACKET_CLASS = Packet
+
     def __init__(self, packet):
-        if not isinstance(packet, Packet):
+        # A Data object without a packet only holds the conversion settings,
+        # e.g. for converting columns of raw values
+        if packet != None and not isinstance(packet, Packet):
             raise TypeError("Invalid type, should be of type Packet")
         self.packet = packet
 
@@ -266,4 +884,213 @@ class Data:
             # perform the conversion on the raw value and assign
             setattr(self, field, converter_function(raw_value))
 
-##############################################################################
\ No newline at end of file
+    def to_record(self):
+        # Return the converted values as a compact record (see Record),
+        # without the packet or conversion settings
+        record = self.PACKET_CLASS.RECORD
+        return record(*[getattr(self, field) for field in record._fields])
+
+    @classmethod
+    def converter(this_class, **kwargs):
+        # Converter for any number of packets with the same settings (see
+        # DataConverter)
+        return DataConverter(this_class, **kwargs)
+
+    def convert_columns(self, columns):
+
+        # Apply the same conversions as convert() to whole arrays of raw
+        # values (e.g. from cryodecoder.batch.decode_batch), returning a
+        # dictionary of converted columns
+        packet_config = Packet.CONFIG[self.PACKET_CLASS]
+        converted = {}
+
+        for field, field_config in packet_config.fields.items():
+
+            if field not in columns:
+                continue
+
+            raw_column = columns[field]
+            # Promote integer columns so that the arithmetic in the parse_*
+            # methods can't wrap around (e.g. uint16 - 16384)
+            if getattr(raw_column, "dtype", None) != None \
+                and raw_column.dtype.kind in "iu":
+                raw_column = raw_column.astype("int64")
+
+            converter_function = getattr(self, field_config.parser)
+            converted[field] = converter_function(raw_column)
+
+        return converted
+
+##############################################################################
+
+class DataConverter:
+
+    # Converts packets with fixed conversion settings, e.g. the calibration
+    # of one instrument. Constructing a Data object for every packet runs
+    # the __init__ of each of its sensor classes and looks up the parse_*
+    # method for every field, so here the settings are held by a single
+    # Data object (without a packet) and its parse_* methods are bound once.
+    # Batches of packets are converted a field at a time with NumPy, if it's
+    # installed, as the parse_* methods also accept arrays of raw values.
+
+    # Smallest batch worth converting with NumPy
+    BATCH_SIZE_MIN = 32
+
+    def __init__(self, data_class, **kwargs):
+
+        self.data_class = data_class
+        self.packet_class = data_class.PACKET_CLASS
+        # Validates the settings once, as for data_class(packet, **kwargs)
+        self.settings = data_class(None, **kwargs)
+
+        packet_config = Packet.CONFIG[self.packet_class]
+        self.fields = tuple(packet_config.fields)
+        self.converters = tuple(
+            getattr(self.settings, packet_config.fields[field].parser)
+            for field in self.fields
+        )
+        self.getter = DataConverter.fields_getter(self.fields)
+
+        # The same for the fields of records (see Data.to_record)
+        self.record = self.packet_class.RECORD
+        self.record_converters = tuple(
+            getattr(self.settings, packet_config.fields[field].parser)
+            for field in self.record._fields
+        )
+        self.record_getter = DataConverter.fields_getter(self.record._fields)
+
+        # Only numeric fields can be converted as arrays
+        self.vectorise = len(self.record._fields) == len(self.fields)
+
+    @staticmethod
+    def fields_getter(fields):
+        # Get all fields in one call, always returning a tuple
+        if len(fields) == 1:
+            return lambda packet, getter = operator.attrgetter(fields[0]) : (getter(packet),)
+        else:
+            return operator.attrgetter(*fields)
+
+    def check_packet(self, packet):
+        if not isinstance(packet, self.packet_class):
+            raise TypeError(f"Invalid packet type, packet should be of type {self.packet_class.__name__}")
+
+    def convert(self, packet):
+
+        # Return a Data object, equal to data_class(packet, **kwargs)
+        if packet.__class__ is not self.packet_class:
+            self.check_packet(packet)
+
+        # Attributes are set in the same order as data_class(packet) sets
+        # them, so that instances still share the keys of their __dict__
+        data = self.data_class.__new__(self.data_class)
+        for name, value in self.settings.__dict__.items():
+            setattr(data, name, value)
+        data.packet = packet
+        for field, converter, raw in zip(self.fields, self.converters, self.getter(packet)):
+            setattr(data, field, converter(raw))
+        return data
+
+    def convert_record(self, packet):
+
+        # Return the converted values as a record, equal to
+        # data_class(packet, **kwargs).to_record(), without a Data object
+        if packet.__class__ is not self.packet_class:
+            self.check_packet(packet)
+
+        return self.record(*[
+            converter(raw) for converter, raw
+            in zip(self.record_converters, self.record_getter(packet))
+        ])
+
+    def convert_batch(self, packets):
+
+        # Convert a sequence of packets to a list of Data objects
+        packets = list(packets)
+        columns = self.convert_packet_columns(packets, self.getter, self.converters)
+        if columns == None:
+            return [self.convert(packet) for packet in packets]
+
+        data_class = self.data_class
+        settings = tuple(self.settings.__dict__.items())
+        fields = self.fields
+        batch = []
+        for packet, row in zip(packets, zip(*[column.tolist() for column in columns])):
+            # As for convert()
+            data = data_class.__new__(data_class)
+            for name, value in settings:
+                setattr(data, name, value)
+            data.packet = packet
+            for field, value in zip(fields, row):
+                setattr(data, field, value)
+            batch.append(data)
+        return batch
+
+    def convert_records(self, packets):
+
+        # Convert a sequence of packets to a list of records
+        packets = list(packets)
+        columns = self.convert_packet_columns(packets, self.record_getter, self.record_converters)
+        if columns == None:
+            return [self.convert_record(packet) for packet in packets]
+
+        # Records are rows of 8 byte values, so slice them out of one
+        # array, with integer columns packed as integers (see RecordLayout)
+        import numpy
+        rows = numpy.empty((len(packets), len(columns)), dtype = "<f8")
+        kinds = []
+        for i, column in enumerate(columns):
+            if column.dtype.kind == "u" and column.size and column.max() > Record.INT64_MAX:
+                rows.view("<u8")[:, i] = column
+                kinds.append("Q")
+            elif column.dtype.kind in "iub":
+                rows.view("<i8")[:, i] = column
+                kinds.append("q")
+            else:
+                rows[:, i] = column
+                kinds.append("d")
+        kinds = "".join(kinds)
+        values = rows.tobytes()
+        size = 8 * len(columns)
+        frombytes = self.record._frombytes
+        return [frombytes(values[i : i + size], kinds) for i in range(0, len(values), size)]
+
+    def convert_packet_columns(self, packets, getter, converters):
+
+        # Convert each field for all packets at once, returning a list of
+        # arrays of converted values, or None if the packets should be
+        # converted one at a time
+        if not self.vectorise or len(packets) < DataConverter.BATCH_SIZE_MIN:
+            return None
+        try:
+            import numpy
+        except ImportError:
+            return None
+
+        packet_class = self.packet_class
+        for packet in packets:
+            if packet.__class__ is not packet_class:
+                self.check_packet(packet)
+
+        try:
+            columns = []
+            for converter, raw_column in zip(converters, zip(*[getter(packet) for packet in packets])):
+                raw_column = numpy.array(raw_column)
+                # Promote integer columns so that the arithmetic in the
+                # parse_* methods can't wrap around (see Data.convert_columns)
+                if raw_column.dtype.kind in "iu":
+                    raw_column = raw_column.astype("int64")
+                elif raw_column.dtype.kind != "f":
+                    return None
+                columns.append(numpy.broadcast_to(converter(raw_column), raw_column.shape))
+            return columns
+        except (ValueError, TypeError):
+            # e.g. a calibration which only accepts single values, or an
+            # invalid value, which converting one at a time will report
+            return None
+
+    def convert_columns(self, columns):
+        # Convert columns of raw values (see Data.convert_columns)
+        return self.settings.convert_columns(columns)
+
+    def __repr__(self):
+        return f"DataConverter: {self.data_class.__name__}"
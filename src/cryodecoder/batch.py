@@ -0,0 +1,64 @@
+from cryodecoder import Packet
+
+import numpy as np
+
+##############################################################################
+# BATCH DECODING
+##############################################################################
+# Decode many fixed size packets at once into NumPy columns, rather than
+# constructing one Packet object per payload. The structured dtype is built
+# from the same (parser verified) layout as PacketDecoder, so each column
+# matches the values returned by the parse_* staticmethods.
+
+def packet_dtype(packet_class):
+
+    decoder = packet_class.DECODER
+
+    # Only packets where every field sits at a fixed offset from the start
+    # can be viewed as an array of records
+    if decoder.tail or decoder.sliced:
+        raise ValueError(f"Packet type {packet_class.__name__} is not a fixed size packet and cannot be batch decoded")
+
+    names = []
+    formats = []
+    offsets = []
+
+    # Keep fields in the order they are defined in the configuration
+    for field in Packet.CONFIG[packet_class].fields:
+        offset, field_format = decoder.formats[field]
+        names.append(field)
+        formats.append(np.dtype(field_format))
+        offsets.append(offset)
+
+    return np.dtype({
+        "names" : names,
+        "formats" : formats,
+        "offsets" : offsets,
+        "itemsize" : packet_class.MIN_SIZE
+    })
+
+def decode_batch(packet_class, data):
+
+    dtype = packet_dtype(packet_class)
+
+    if isinstance(data, (list, tuple)):
+        # Join individual frames (or packets) into a single contiguous buffer
+        frames = [
+            frame.raw if isinstance(frame, Packet) else frame for frame in data
+        ]
+        for i, frame in enumerate(frames):
+            if len(frame) != dtype.itemsize:
+                raise ValueError(f"Invalid packet length ({len(frame)}) for frame {i}, expecting {dtype.itemsize}")
+        data = b"".join(frames)
+
+    buffer = memoryview(data).cast("B")
+    if len(buffer) % dtype.itemsize != 0:
+        raise ValueError(f"Buffer length ({len(buffer)}) is not a multiple of the {packet_class.__name__} size ({dtype.itemsize})")
+
+    records = np.frombuffer(buffer, dtype = dtype)
+
+    # Return one contiguous, native byte order column per field
+    return {
+        field : records[field].astype(dtype.fields[field][0].newbyteorder("="))
+        for field in dtype.names
+    }
@@ -0,0 +1,279 @@
+from cryodecoder import Packet, MBusPacket, CryoReceiverPacket, SDSatellitePacket, \
+    CryoReceiverData, DATA_CLASSES, ErrorReason, InvalidPacketError, PacketReader
+
+import collections
+import mmap
+import os
+
+##############################################################################
+# BULK DECODING
+##############################################################################
+# Decodes a whole SD archive or receiver stream into converted records
+# without raising for bad frames. Each frame is checked from its raw bytes
+# before any packet is built (lengths, C field, header, payload type and
+# the RAW_LIMITS of its Data type), so that corrupt frames cost about as
+# much as clean ones rather than raising and catching an exception. Bad
+# frames are returned as ErrorRecords with an ErrorReason instead.
+#
+# Payloads without a Data type (e.g. HydrobeanPacket) give records of their
+# raw values, as in cryodecoder.parallel.packet_records.
+
+# Converted record of a payload, with the offset of its frame, the user_id
+# of the instrument and the SD card timestamp (None for receiver streams)
+DecodedRecord = collections.namedtuple("DecodedRecord", ("offset", "user_id", "timestamp", "record"))
+
+# Offset of a bad frame, the packet or Data type which was being decoded
+# and an ErrorReason
+ErrorRecord = collections.namedtuple("ErrorRecord", ("offset", "packet_class", "reason"))
+
+BulkResult = collections.namedtuple("BulkResult", ("records", "errors"))
+
+class BulkDecoder:
+
+    def __init__(self, packet_class = SDSatellitePacket, catalogue = None, c_field = PacketReader.C_FIELD_DEFAULT):
+
+        if packet_class not in (SDSatellitePacket, CryoReceiverPacket):
+            raise ValueError("Bulk decoding is only supported for SDSatellitePacket archives and CryoReceiverPacket streams")
+        self.packet_class = packet_class
+        # Converters with the calibration of each instrument (see
+        # CalibrationCatalogue), or the defaults of each Data type
+        self.catalogue = catalogue
+        # Set c_field to None to skip checking the C field
+        self.c_field = c_field
+
+        # Layout of the M-Bus frame, from the packet configuration
+        mbus_fields = Packet.CONFIG[MBusPacket].fields
+        self.control_field_offset = mbus_fields["control_field"].offset
+        payload_start, payload_end = mbus_fields["payload"].offset
+        # Bytes of the frame other than the payload
+        self.mbus_overhead = payload_start - payload_end - 1
+        self.mbus_min = MBusPacket.MIN_SIZE
+
+        # Record frames are length-framed as for PacketReader
+        self.receiver_min = MBusPacket.MIN_SIZE + CryoReceiverPacket.MIN_SIZE
+        self.receiver_max = PacketReader.CRYORECEIVER_LENGTH_MAX
+
+        # SD record headers
+        sd_fields = Packet.CONFIG[SDSatellitePacket].fields
+        self.sd_header_size = SDSatellitePacket.MIN_SIZE
+        self.sd_length_offset = sd_fields["length"].offset
+        self.sd_text = slice(sd_fields["header"].offset, sd_fields["header"].offset + sd_fields["header"].length)
+
+        # (converter, limits) of each payload type
+        self.payload_converters = {}
+        self.receiver_limits = BulkDecoder.raw_limits(CryoReceiverData)
+
+        # Statistics
+        self.frames = 0
+        self.errors = collections.Counter()
+
+    @staticmethod
+    def raw_limits(data_class):
+        # RAW_LIMITS of a Data type and its bases, as (field, low, high, reason)
+        limits = {}
+        for base in reversed(data_class.__mro__):
+            limits.update(base.__dict__.get("RAW_LIMITS", {}))
+        return tuple((field, *limit) for field, limit in limits.items())
+
+    @staticmethod
+    def check_limits(packet, limits):
+        # First ErrorReason for raw values of a packet outside limits, or None
+        for field, low, high, reason in limits:
+            value = getattr(packet, field)
+            if value < low or value > high:
+                return reason
+        return None
+
+    def payload_converter(self, payload_class, user_id):
+
+        # (converter, limits) for a payload type, where converter is None
+        # for types without a Data type
+        entry = self.payload_converters.get(payload_class)
+        if entry == None:
+            data_class = DATA_CLASSES.get(payload_class)
+            if data_class == None:
+                entry = (None, None, ())
+            else:
+                entry = (data_class, data_class.converter(), BulkDecoder.raw_limits(data_class))
+            self.payload_converters[payload_class] = entry
+        data_class, converter, limits = entry
+        if self.catalogue != None and data_class != None:
+            converter = self.catalogue.converter(data_class, user_id)
+        return data_class, converter, limits
+
+    def decode(self, data):
+
+        # Decode a bytes-like object (or mmap) of back-to-back frames,
+        # returning a BulkResult
+        records = []
+        errors = []
+        view = memoryview(data).cast("B")
+        try:
+            if self.packet_class is SDSatellitePacket:
+                self.decode_archive(view, records, errors)
+            else:
+                self.decode_stream(view, records, errors)
+        finally:
+            view.release()
+
+        self.frames += len(records)
+        for error in errors:
+            self.errors[error.reason] += 1
+        return BulkResult(records, errors)
+
+    def decode_file(self, path):
+
+        # Decode a file, memory-mapped so that it isn't read into memory
+        with open(path, "rb") as data_fh:
+            if os.fstat(data_fh.fileno()).st_size == 0:
+                return BulkResult([], [])
+            buffer = mmap.mmap(data_fh.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            # Records don't refer to the buffer, so it can be closed after
+            return self.decode(buffer)
+        finally:
+            buffer.close()
+
+    def decode_archive(self, view, records, errors):
+
+        size = len(view)
+        header_size = self.sd_header_size
+        length_offset = self.sd_length_offset
+        text = self.sd_text
+        offset = 0
+
+        while offset + header_size <= size:
+
+            end = offset + header_size + view[length_offset + offset]
+            if end > size:
+                errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.TRUNCATED))
+                break
+
+            header = view[text.start + offset : text.stop + offset]
+            if max(header, default = 0) >= 0x80:
+                # Not ASCII (see SDSatellitePacket.parse_header)
+                errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.INVALID_HEADER))
+            else:
+                reason, error_class = self.check_mbus(view[offset + header_size : end])
+                if reason != None:
+                    errors.append(ErrorRecord(offset, error_class, reason))
+                else:
+                    self.decode_frame(SDSatellitePacket(view[offset : end]), offset, records, errors)
+            offset = end
+
+        if 0 < size - offset < header_size:
+            errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.TRUNCATED))
+
+    def decode_stream(self, view, records, errors):
+
+        # Receiver streams have no record boundaries, so as for PacketReader,
+        # anything which doesn't pass the frame checks is part of a run of
+        # noise and the next frame is looked for from the following byte
+        size = len(view)
+        min_length = self.receiver_min
+        max_length = self.receiver_max
+        c_field = self.c_field
+        trailer = CryoReceiverPacket.MIN_SIZE
+        # Start of the current run of bytes which aren't frames
+        noise = None
+        offset = 0
+
+        while offset < size:
+
+            length = view[offset]
+            if length < min_length or length > max_length or offset + 1 >= size \
+                or (c_field != None and view[offset + 1] != c_field):
+                reason = ErrorReason.NOISE
+            else:
+                end = offset + 1 + length
+                if end > size:
+                    # Only the CI byte and length can be checked
+                    control_field = offset + 1 + self.control_field_offset
+                    if control_field < size and (
+                        view[control_field], length - trailer - self.mbus_overhead
+                    ) not in MBusPacket.PAYLOAD_TYPES:
+                        reason = ErrorReason.UNKNOWN_PAYLOAD
+                    else:
+                        reason = ErrorReason.TRUNCATED
+                else:
+                    frame = view[offset + 1 : end]
+                    reason, _ = self.check_mbus(frame[:-trailer])
+
+            if reason == ErrorReason.TRUNCATED:
+                if noise != None:
+                    errors.append(ErrorRecord(noise, CryoReceiverPacket, ErrorReason.NOISE))
+                errors.append(ErrorRecord(offset, CryoReceiverPacket, ErrorReason.TRUNCATED))
+                return
+            if reason != None:
+                if noise == None:
+                    noise = offset
+                offset += 1
+                continue
+            if noise != None:
+                errors.append(ErrorRecord(noise, CryoReceiverPacket, ErrorReason.NOISE))
+                noise = None
+
+            self.decode_frame(CryoReceiverPacket(frame), offset, records, errors)
+            offset = end
+
+        if noise != None:
+            errors.append(ErrorRecord(noise, CryoReceiverPacket, ErrorReason.NOISE))
+
+    def check_mbus(self, frame):
+
+        # (ErrorReason, packet type) for an M-Bus frame which can't be
+        # decoded, or (None, None)
+        length = len(frame)
+        if length < self.mbus_min:
+            return ErrorReason.TOO_SHORT, MBusPacket
+        if self.c_field != None and frame[0] != self.c_field:
+            return ErrorReason.INVALID_C_FIELD, MBusPacket
+        key = (frame[self.control_field_offset], length - self.mbus_overhead)
+        if key not in MBusPacket.PAYLOAD_TYPES:
+            return ErrorReason.UNKNOWN_PAYLOAD, MBusPacket
+        return None, None
+
+    def decode_frame(self, packet, offset, records, errors):
+
+        # Convert the payload of a checked frame
+        try:
+            if packet.__class__ is CryoReceiverPacket:
+                reason = BulkDecoder.check_limits(packet, self.receiver_limits)
+                if reason != None:
+                    errors.append(ErrorRecord(offset, CryoReceiverData, reason))
+                    return
+                timestamp = None
+            else:
+                timestamp = packet.timestamp
+
+            mbus_packet = packet.mbus_packet
+            payload = mbus_packet.payload
+            user_id = mbus_packet.user_id
+            data_class, converter, limits = self.payload_converter(payload.__class__, user_id)
+
+            if converter == None:
+                record = payload.RECORD(*[getattr(payload, field) for field in payload.RECORD._fields])
+            else:
+                reason = BulkDecoder.check_limits(payload, limits)
+                if reason != None:
+                    errors.append(ErrorRecord(offset, data_class, reason))
+                    return
+                record = converter.convert_record(payload)
+
+        except InvalidPacketError as error:
+            # Anything the checks above don't cover
+            errors.append(ErrorRecord(offset, packet.__class__, error.reason))
+            return
+        except (ValueError, TypeError, ArithmeticError):
+            errors.append(ErrorRecord(offset, packet.__class__, ErrorReason.INVALID))
+            return
+
+        records.append(DecodedRecord(offset, user_id, timestamp, record))
+
+def decode_bulk(data, packet_class = SDSatellitePacket, catalogue = None):
+    # Decode an SD archive (or receiver stream) from a path or bytes-like
+    # object, returning a BulkResult (see BulkDecoder)
+    decoder = BulkDecoder(packet_class, catalogue)
+    if isinstance(data, (str, os.PathLike)):
+        return decoder.decode_file(data)
+    return decoder.decode(data)
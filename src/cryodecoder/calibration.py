@@ -0,0 +1,262 @@
+from cryodecoder import DataConverter, LinearCalibration, KellerPressureData, DATA_CLASSES, parse_packet_config
+
+import collections
+import csv
+import io
+import os
+import time
+
+##############################################################################
+# CALIBRATION CATALOGUE
+##############################################################################
+# Calibration settings for each instrument, keyed by the user_id of its
+# MBusPacket, loaded from a TOML or CSV file. In TOML:
+#
+#       [instruments.0xCE220001]
+#       keller_sensor_id = "PA7LD30-2409"
+#       conductivity_gain = 0.0025
+#       conductivity_offset = 0.1
+#
+#       # Calibrated range of an individual pressure sensor
+#       [sensors.PA7LD30-2409]
+#       pressure_keller_min = 0.0
+#       pressure_keller_max = 30.2
+#
+# or as CSV, with a user_id column followed by any of the parameters:
+#
+#       user_id,keller_sensor_id,conductivity_gain,conductivity_offset
+#       0xCE220001,PA7LD30-2409,0.0025,0.1
+#
+# A DataConverter is built the first time each instrument is seen and kept
+# in an LRU cache, so converting a packet only needs a dictionary lookup.
+# The file is checked for changes at most every check_interval seconds, and
+# the cache is cleared when it's reloaded.
+
+class CalibrationCatalogue:
+
+    CACHE_SIZE_DEFAULT = 1024 # converters
+    CHECK_INTERVAL_DEFAULT = 1.0 # seconds
+
+    # Parameter | type, passed to the Data type as keyword arguments
+    PARAMETERS = {
+        "keller_sensor_id" : str,
+        "pressure_keller_min" : float,
+        "pressure_keller_max" : float,
+        "pressure_type" : str,
+        "atmospheric_pressure" : float,
+        "magnetometer_full_scale" : float,
+        "accelerometer_full_scale" : float,
+        # Combined into conductivity_calibration (see LinearCalibration)
+        "conductivity_gain" : float,
+        "conductivity_offset" : float,
+    }
+    # Parameters for people rather than the Data types
+    DESCRIPTIVE = ("name", "notes")
+    # Parameters of individual pressure sensors
+    SENSOR_PARAMETERS = ("pressure_keller_min", "pressure_keller_max", "pressure_type")
+
+    def __init__(self, path, cache_size = None, check_interval = None):
+
+        self.path = path
+        self.cache_size = cache_size or CalibrationCatalogue.CACHE_SIZE_DEFAULT
+        self.check_interval = CalibrationCatalogue.CHECK_INTERVAL_DEFAULT \
+            if check_interval == None else check_interval
+
+        # Settings for each user_id and Keller sensor ID
+        self.instruments = {}
+        self.sensors = {}
+        # Converters indexed by (Data type, user_id), least recently used first
+        self.converters = collections.OrderedDict()
+
+        # File state when last loaded, and when it was last checked
+        self.file_state = None
+        self.next_check = 0.0
+        # Statistics
+        self.reloads = 0
+        self.last_error = None
+
+        # Errors loading the file are raised here, whereas errors reloading
+        # it keep the previous calibrations (see check)
+        self.load()
+
+    def load(self):
+
+        with open(self.path, "rb") as catalogue_fh:
+            state = os.fstat(catalogue_fh.fileno())
+            source = catalogue_fh.read()
+
+        if os.path.splitext(self.path)[1].lower() == ".csv":
+            instruments, sensors = CalibrationCatalogue.parse_csv(source)
+        else:
+            instruments, sensors = CalibrationCatalogue.parse_toml(source)
+
+        self.instruments = instruments
+        self.sensors = sensors
+        self.converters.clear()
+        self.file_state = (state.st_mtime_ns, state.st_size)
+        self.next_check = time.monotonic() + self.check_interval
+
+    def check(self):
+
+        # Reload the file if it has changed since it was loaded
+        self.next_check = time.monotonic() + self.check_interval
+        try:
+            state = os.stat(self.path)
+            if (state.st_mtime_ns, state.st_size) == self.file_state:
+                return False
+            self.load()
+        except (OSError, ValueError, TypeError) as error:
+            # e.g. the file is being replaced, or is invalid, so keep using
+            # the previous calibrations and try again later
+            self.last_error = error
+            return False
+        self.reloads += 1
+        return True
+
+    ##########################################################################
+    # Parsing
+    ##########################################################################
+
+    @staticmethod
+    def parse_toml(source):
+
+        config = parse_packet_config(source)
+        for key in config:
+            if key not in ("instruments", "sensors"):
+                raise ValueError(f"Invalid section {key} in calibration catalogue, should be instruments or sensors")
+
+        instruments = {
+            CalibrationCatalogue.parse_user_id(user_id) : CalibrationCatalogue.parse_parameters(parameters, user_id)
+            for user_id, parameters in config.get("instruments", {}).items()
+        }
+        sensors = {
+            CalibrationCatalogue.sensor_key(sensor_id) : CalibrationCatalogue.parse_parameters(
+                parameters, sensor_id, CalibrationCatalogue.SENSOR_PARAMETERS
+            )
+            for sensor_id, parameters in config.get("sensors", {}).items()
+        }
+        return instruments, sensors
+
+    @staticmethod
+    def parse_csv(source):
+
+        reader = csv.DictReader(io.StringIO(source.decode("utf-8-sig")))
+        if reader.fieldnames == None or "user_id" not in reader.fieldnames:
+            raise ValueError("Calibration catalogue CSV should have a user_id column")
+
+        instruments = {}
+        for row in reader:
+            user_id = row.pop("user_id")
+            # Empty cells are left as defaults
+            parameters = {
+                parameter : value.strip() for parameter, value in row.items()
+                if value != None and value.strip() != ""
+            }
+            instruments[CalibrationCatalogue.parse_user_id(user_id)] = \
+                CalibrationCatalogue.parse_parameters(parameters, user_id)
+
+        # Sensor ranges can only be given in TOML
+        return instruments, {}
+
+    @staticmethod
+    def parse_user_id(user_id):
+        # Hex (0xCE220001) or decimal
+        try:
+            return int(str(user_id).strip(), 0)
+        except ValueError:
+            raise ValueError(f"Invalid user_id {user_id} in calibration catalogue")
+
+    @staticmethod
+    def sensor_key(sensor_id):
+        return sensor_id.strip().upper()
+
+    @staticmethod
+    def parse_parameters(parameters, name, allowed = None):
+
+        settings = {}
+        for parameter, value in parameters.items():
+            if parameter in CalibrationCatalogue.DESCRIPTIVE:
+                continue
+            parameter_type = CalibrationCatalogue.PARAMETERS.get(parameter)
+            if parameter_type == None or (allowed != None and parameter not in allowed):
+                raise ValueError(f"Invalid parameter {parameter} for {name} in calibration catalogue")
+            try:
+                settings[parameter] = parameter_type(value)
+            except ValueError:
+                raise ValueError(f"Invalid value {value} of {parameter} for {name} in calibration catalogue")
+
+        # Check sensor IDs now, rather than when the instrument is first seen
+        sensor_id = settings.get("keller_sensor_id")
+        if sensor_id != None and KellerPressureData.SENSOR_ID_PATTERN.match(CalibrationCatalogue.sensor_key(sensor_id)) == None:
+            raise ValueError(f"Invalid Keller sensor ID {sensor_id} for {name} in calibration catalogue")
+
+        return settings
+
+    ##########################################################################
+    # Lookup
+    ##########################################################################
+
+    def settings(self, user_id):
+
+        # Keyword arguments for the Data type of an instrument, which are
+        # empty (i.e. the defaults) for instruments not in the catalogue
+        parameters = dict(self.instruments.get(user_id, {}))
+
+        # Range of an individual pressure sensor, unless given explicitly
+        sensor_id = parameters.get("keller_sensor_id")
+        if sensor_id != None:
+            for parameter, value in self.sensors.get(CalibrationCatalogue.sensor_key(sensor_id), {}).items():
+                parameters.setdefault(parameter, value)
+
+        gain = parameters.pop("conductivity_gain", None)
+        offset = parameters.pop("conductivity_offset", None)
+        if gain != None or offset != None:
+            parameters["conductivity_calibration"] = LinearCalibration(
+                1.0 if gain == None else gain,
+                0.0 if offset == None else offset
+            )
+
+        return parameters
+
+    def converter(self, data_class, user_id):
+
+        # DataConverter for an instrument, from the cache if possible
+        if time.monotonic() >= self.next_check:
+            self.check()
+
+        key = (data_class, user_id)
+        converter = self.converters.get(key)
+        if converter != None:
+            self.converters.move_to_end(key)
+            return converter
+
+        converter = DataConverter(data_class, **self.settings(user_id))
+        self.converters[key] = converter
+        if len(self.converters) > self.cache_size:
+            self.converters.popitem(last = False)
+        return converter
+
+    def payload_converter(self, mbus_packet):
+        # DataConverter for the payload of an MBusPacket, or None if there's
+        # no Data type for it
+        data_class = DATA_CLASSES.get(mbus_packet.payload.__class__)
+        if data_class == None:
+            return None
+        return self.converter(data_class, mbus_packet.user_id)
+
+    def convert(self, mbus_packet):
+        # Convert the payload of an MBusPacket with the calibration of its
+        # instrument, returning None if there's no Data type for it
+        converter = self.payload_converter(mbus_packet)
+        if converter == None:
+            return None
+        return converter.convert(mbus_packet.payload)
+
+    def __contains__(self, user_id):
+        return user_id in self.instruments
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __repr__(self):
+        return f"CalibrationCatalogue: {self.path} ({len(self.instruments)} instruments, {len(self.sensors)} sensors)"
@@ -0,0 +1,345 @@
+from cryodecoder import (
+    Packet,
+    MBusPacket,
+    CryoReceiverPacket,
+    CryoReceiverData,
+    SDSatelliteData,
+    DATA_CLASSES,
+    PacketReader,
+    SDArchive,
+    CalibrationCatalogue
+)
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+##############################################################################
+# CSV CONVERSION
+##############################################################################
+# Streams an SD archive, receiver or M-Bus file and writes one CSV per
+# instrument type, with the fields of the receiver (or SD record) and M-Bus
+# packet followed by the converted payload fields. Rows are collected per
+# instrument and written in batches, so memory use is bounded by the batch
+# size.
+
+# Fields taken from the M-Bus packet for every row
+MBUS_FIELDS = ("user_id", "control_field", "rssi")
+
+# Fields of the receiver packet (or SD record) written for every row, in
+# the same units for both (see CryoReceiverData and SDSatelliteData)
+SOURCE_FIELDS = {
+    "sd" : ("timestamp", "channel", "temperature_logger", "pressure_logger", "solar_voltage"),
+    "receiver" : ("channel", "temperature_logger", "pressure_logger", "solar_voltage"),
+    "mbus" : (),
+}
+
+class CSVConverter:
+
+    BATCH_SIZE_DEFAULT = 10000 # rows per instrument
+    BUFFER_SIZE = 1 << 20 # bytes
+
+    def __init__(self, output_dir, prefix, source_fields, batch_size = None, catalogue = None):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        # Fields of the receiver packet (or SD record) written for every row
+        self.source_fields = tuple(source_fields)
+        self.batch_size = batch_size or CSVConverter.BATCH_SIZE_DEFAULT
+        # Calibrations for each instrument (see CalibrationCatalogue),
+        # otherwise the defaults of each Data type are used
+        self.catalogue = catalogue
+
+        # Per payload type: file, csv writer, pending rows, payload fields and
+        # converter (see DataConverter)
+        self.outputs = {}
+        # Statistics
+        self.rows_written = 0
+        self.packets_skipped = 0
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def output(self, payload_class):
+
+        # Open the CSV for a payload type when its first row is written
+        output = self.outputs.get(payload_class)
+        if output != None:
+            return output
+
+        name = payload_class.__name__
+        if name.endswith("Packet"):
+            name = name[:-len("Packet")]
+        path = os.path.join(self.output_dir, f"{self.prefix}_{name.lower()}.csv")
+
+        # Converted fields, as listed in the configuration. Payloads without a
+        # Data type are written as raw values.
+        payload_fields = tuple(Packet.CONFIG[payload_class].fields)
+        data_class = DATA_CLASSES.get(payload_class)
+        converter = None if data_class == None else data_class.converter()
+
+        output_fh = open(path, "w", newline = "", buffering = CSVConverter.BUFFER_SIZE)
+        writer = csv.writer(output_fh)
+        writer.writerow(self.source_fields + MBUS_FIELDS + payload_fields)
+
+        output = (output_fh, writer, [], payload_fields, converter)
+        self.outputs[payload_class] = output
+        self.paths.append(path)
+        return output
+
+    def write(self, source_values, mbus_packet):
+
+        payload = mbus_packet.payload
+        if not isinstance(payload, Packet):
+            # Unknown payload type
+            self.packets_skipped += 1
+            return
+
+        _, writer, rows, payload_fields, converter = self.output(payload.__class__)
+
+        if converter != None and self.catalogue != None:
+            converter = self.catalogue.converter(converter.data_class, mbus_packet.user_id)
+
+        try:
+            values = payload if converter == None else converter.convert(payload)
+            rows.append(
+                tuple(source_values)
+                + tuple(getattr(mbus_packet, field) for field in MBUS_FIELDS)
+                + tuple(getattr(values, field) for field in payload_fields)
+            )
+        except ValueError:
+            # Values which can't be converted (e.g. out of range)
+            self.packets_skipped += 1
+            return
+
+        if len(rows) >= self.batch_size:
+            self.flush_rows(writer, rows)
+
+    def flush_rows(self, writer, rows):
+        writer.writerows(rows)
+        self.rows_written += len(rows)
+        rows.clear()
+
+    def close(self):
+        for output_fh, writer, rows, _, _ in self.outputs.values():
+            self.flush_rows(writer, rows)
+            output_fh.close()
+        self.outputs = {}
+
+class Progress:
+
+    # Progress and throughput report, written to stderr at most once every
+    # interval seconds
+    def __init__(self, path, size, interval = 1.0, stream = None):
+        self.name = os.path.basename(path)
+        self.size = size
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.start = time.perf_counter()
+        self.next_report = self.start + interval
+        self.packets = 0
+
+    def update(self, packets, position):
+        self.packets = packets
+        now = time.perf_counter()
+        if now >= self.next_report:
+            self.next_report = now + self.interval
+            self.report(position, now, end = "\r")
+
+    def report(self, position, now = None, end = "\n"):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.packets / elapsed if elapsed > 0 else 0.0
+        percent = 100 * position / self.size if self.size > 0 else 100.0
+        self.stream.write(
+            f"{self.name}: {self.packets} packets ({percent:5.1f}%), "
+            f"{rate:.0f} packets/s, {position / elapsed / 1e6 if elapsed > 0 else 0:.1f} MB/s{end}"
+        )
+        self.stream.flush()
+
+def detect_format(path):
+
+    # SD records start with an ASCII header, whereas receiver and M-Bus
+    # streams start with a length byte followed by the M-Bus C field
+    with open(path, "rb") as input_fh:
+        start = input_fh.read(256)
+    if len(start) < 2 or start[1] != PacketReader.C_FIELD_DEFAULT:
+        return "sd"
+
+    # Receiver frames end with the receiver fields, so the payload of the
+    # first frame is only recognised if it's read as the right type
+    frame = start[1 : 1 + start[0]]
+    try:
+        if isinstance(MBusPacket(frame).payload, Packet):
+            return "mbus"
+    except (ValueError, TypeError):
+        pass
+    return "receiver"
+
+def read_sd(path, source_fields):
+
+    # Yield the SD record values (converted with SDSatelliteData), M-Bus
+    # packet and position of each record, or None for the values of
+    # records which can't be decoded (e.g. a corrupt header)
+    with SDArchive(path) as archive:
+        index = 0
+        while True:
+            try:
+                packet = archive[index]
+                data = SDSatelliteData(packet)
+                values = [getattr(data, field) for field in source_fields]
+            except IndexError:
+                break
+            except ValueError:
+                packet = data = None
+                yield None, None, archive.scan_offset
+            else:
+                yield values, packet.mbus_packet, archive.scan_offset
+            index += 1
+        # Don't hold on to views into the archive
+        packet = data = None
+
+def read_stream(path, packet_class, source_fields):
+
+    # Yield the receiver values (converted with CryoReceiverData), M-Bus
+    # packet and position of each frame of a receiver or M-Bus stream
+    with PacketReader(path, packet_class) as reader:
+        for packet in reader:
+            if packet_class == MBusPacket:
+                yield (), packet, reader.position
+                continue
+            try:
+                data = CryoReceiverData(packet)
+            except ValueError:
+                # e.g. invalid channel, so skip the frame
+                yield None, packet.mbus_packet, reader.position
+                continue
+            yield (
+                [getattr(data, field) for field in source_fields],
+                packet.mbus_packet,
+                reader.position
+            )
+
+def convert(
+    path,
+    output_dir = None,
+    file_format = None,
+    batch_size = None,
+    progress = True,
+    progress_interval = 1.0,
+    catalogue = None
+):
+
+    # Convert an SD archive, receiver or M-Bus stream to CSV files in
+    # output_dir (by default alongside the input), returning the CSVConverter
+    output_dir = output_dir or os.path.dirname(os.path.abspath(path))
+    prefix = os.path.splitext(os.path.basename(path))[0]
+    file_format = file_format or detect_format(path)
+    size = os.path.getsize(path)
+
+    if file_format not in SOURCE_FIELDS:
+        raise ValueError(f"Unknown file format {file_format}, should be one of {', '.join(SOURCE_FIELDS)}")
+
+    source_fields = SOURCE_FIELDS[file_format]
+    if file_format == "sd":
+        packets = read_sd(path, source_fields)
+    elif file_format == "receiver":
+        packets = read_stream(path, CryoReceiverPacket, source_fields)
+    else:
+        packets = read_stream(path, MBusPacket, source_fields)
+
+    report = None
+    if progress:
+        report = Progress(path, size, progress_interval)
+
+    with CSVConverter(output_dir, prefix, source_fields, batch_size, catalogue) as converter:
+
+        count = 0
+        for source_values, mbus_packet, position in packets:
+            if source_values == None:
+                converter.packets_skipped += 1
+            else:
+                converter.write(source_values, mbus_packet)
+            count += 1
+            if report != None and count % 1000 == 0:
+                report.update(count, position)
+
+        if report != None:
+            report.update(count, size)
+            report.report(size)
+
+    return converter
+
+##############################################################################
+# COMMAND LINE
+##############################################################################
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(
+        prog = "cryodecoder",
+        description = "Decode packets from Cryo* instruments and receivers."
+    )
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    convert_parser = commands.add_parser(
+        "convert",
+        help = "Convert SD, receiver or M-Bus files to one CSV per instrument type."
+    )
+    convert_parser.add_argument("inputs", nargs = "+", metavar = "INPUT",
+        help = "SD archive, receiver or M-Bus file(s) to convert")
+    convert_parser.add_argument("-o", "--output-dir",
+        help = "Directory for CSV files (default: alongside each input)")
+    convert_parser.add_argument("-f", "--format", choices = ("auto",) + tuple(SOURCE_FIELDS), default = "auto",
+        help = "Input file format (default: auto)")
+    convert_parser.add_argument("-b", "--batch-size", type = int, default = CSVConverter.BATCH_SIZE_DEFAULT,
+        help = "Rows per instrument to collect before writing (default: %(default)s)")
+    convert_parser.add_argument("-q", "--quiet", action = "store_true",
+        help = "Don't report progress on stderr")
+    convert_parser.add_argument("-c", "--calibration", metavar = "CATALOGUE",
+        help = "Calibration catalogue (TOML or CSV) of each instrument's settings")
+
+    args = parser.parse_args(argv)
+
+    if args.batch_size < 1:
+        parser.error("Batch size should be at least 1")
+    if args.output_dir != None:
+        os.makedirs(args.output_dir, exist_ok = True)
+
+    # Each input writes {prefix}_{type}.csv, so inputs with the same name
+    # would overwrite each other's CSVs in the same directory
+    outputs = {}
+    for path in args.inputs:
+        output_dir = args.output_dir or os.path.dirname(os.path.abspath(path))
+        key = (os.path.abspath(output_dir), os.path.splitext(os.path.basename(path))[0])
+        if key in outputs:
+            parser.error(f"{outputs[key]} and {path} would write to the same CSV files, use separate output directories")
+        outputs[key] = path
+
+    catalogue = None
+    if args.calibration != None:
+        catalogue = CalibrationCatalogue(args.calibration)
+
+    for path in args.inputs:
+        converter = convert(
+            path,
+            output_dir = args.output_dir,
+            file_format = None if args.format == "auto" else args.format,
+            batch_size = args.batch_size,
+            progress = not args.quiet,
+            catalogue = catalogue
+        )
+        if not args.quiet:
+            for output_path in converter.paths:
+                sys.stderr.write(f"  -> {output_path}\n")
+            if converter.packets_skipped > 0:
+                sys.stderr.write(f"  {converter.packets_skipped} packets skipped\n")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
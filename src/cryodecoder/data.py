@@ -1,31 +1,53 @@
-from cryodecoder import Data, CryoeggPacket, CryowurstPacket
+from cryodecoder import Data, CryoeggPacket, CryowurstPacket, CryoReceiverPacket, SDSatellitePacket, InvalidPacketError, ErrorReason
+
+import re
+
+# The parse_* methods below are written so that they accept either a single
+# raw value or a NumPy array of raw values (see Data.convert_columns)
 
 class KellerPressureData:
     # Define default min/max pressure values
     PRESSURE_MAX_DEFAULT  = 100.00 #bar
     PRESSURE_MIN_DEFAULT  =    0.0 #bar
     PRESSURE_TYPE_DEFAULT =    "PA" #absolute pressure + 1bar
+    # Sensor ID, e.g. PA7LD30-2409, as pressure type, model, full scale
+    # (bar) and an optional suffix (e.g. batch or date)
+    SENSOR_ID_PATTERN = re.compile(r"^(PAA|PA|PR)(\d+[A-Z]+?)(\d+(?:\.\d+)?)(?:-(\w+))?$")
     #
     def __init__(self, pressure_keller_min = None, pressure_keller_max = None, keller_sensor_id = None, pressure_type = None, atmospheric_pressure = None, **kwargs):
 
         # Assign defaults in case of no info provided
-        self.pressure_keller_max = pressure_keller_max or KellerPressureData.PRESSURE_MAX_DEFAULT
-        self.pressure_keller_min = pressure_keller_min or KellerPressureData.PRESSURE_MIN_DEFAULT
-        self.pressure_type = pressure_type or KellerPressureData.PRESSURE_TYPE_DEFAULT
+        self.pressure_keller_max = KellerPressureData.PRESSURE_MAX_DEFAULT
+        self.pressure_keller_min = KellerPressureData.PRESSURE_MIN_DEFAULT
+        self.pressure_type = KellerPressureData.PRESSURE_TYPE_DEFAULT
         self.atmospheric_pressure = atmospheric_pressure or None 
         
-        # then fallback to sensor ID (i.e. label provided by Cardiff)
+        # then from sensor ID (i.e. label provided by Cardiff)
         # in format:
         #   
         #       PA7LD30-2409        30bar  - 0 to 30
         #       PA7LHPD250-2410     250bar - 0 to 250
-        if (pressure_keller_min == None and pressure_keller_max == None) and keller_sensor_id != None:
+        if keller_sensor_id != None:
             # Assign sensor ID
             self.set_keller_sensor_id(keller_sensor_id)
 
+        # with anything given explicitly (e.g. a calibrated range) taking
+        # precedence
+        self.pressure_keller_max = pressure_keller_max or self.pressure_keller_max
+        self.pressure_keller_min = pressure_keller_min or self.pressure_keller_min
+        self.pressure_type = pressure_type or self.pressure_type
+
     def set_keller_sensor_id(self, sensor_id):
-        # TODO: Lookup sensor from catalogue
-        raise NotImplementedError
+        # Take the pressure type and range from the sensor ID (calibrated
+        # ranges for individual sensors can be given by a calibration
+        # catalogue, see cryodecoder.calibration)
+        match = KellerPressureData.SENSOR_ID_PATTERN.match(sensor_id.strip().upper())
+        if match == None:
+            raise ValueError(f"Invalid Keller sensor ID {sensor_id}, expecting e.g. PA7LD30-2409")
+        pressure_type, _, full_scale, _ = match.groups()
+        self.pressure_type = pressure_type
+        self.pressure_keller_min = 0.0
+        self.pressure_keller_max = float(full_scale)
 
     def parse_pressure_keller(self, raw):
         
@@ -59,7 +81,7 @@ class BatteryVoltageData:
 
     def parse_battery_voltage(self, raw):
         # Convert mV to V
-        return float(raw) / 1000
+        return raw / 1000
 
 class SequenceNumberData:
 
@@ -72,7 +94,7 @@ class SequenceNumberData:
 class ConductivityData:
 
     # Define default conductivity calibration value
-    CONDUCTIVITY_CALIBRATION_DEFAULT = lambda x : float(x) / 1000 
+    CONDUCTIVITY_CALIBRATION_DEFAULT = lambda x : x / 1000 
     # use a mV to V mapping as a default for now 
     # (i.e. return an invalid value in V, rather than Siemens?)
     # - we might be able to improve this by taking a set of conductivity
@@ -90,6 +112,20 @@ class ConductivityData:
         # Return calibration conductivity from voltage
         return self.conductivity_calibration(raw)
 
+class LinearCalibration:
+
+    # Callable calibration of the form gain * raw + offset, which (unlike a
+    # lambda using float()) can be applied to arrays of raw values
+    def __init__(self, gain = 1.0, offset = 0.0):
+        self.gain = gain
+        self.offset = offset
+
+    def __call__(self, raw):
+        return raw * self.gain + self.offset
+
+    def __repr__(self):
+        return f"LinearCalibration: gain={self.gain}, offset={self.offset}"
+
 ##############################################################################
 # CRYOWURST SPECIFIC SENSORS
 ##############################################################################
@@ -101,12 +137,20 @@ class TMP117TemperatureData:
 
     def parse_temperature_tmp117(_, raw):
         # For TMP117 sensor, multiple returned value by 7.8125mC
-        return float(raw) * 0.0078125 # degC
+        return raw * 0.0078125 # degC
     
 class ICM20948MagnetometerData:
     
     MAGNETOMETER_FULL_SCALE_DEFAULT = 4912 # uT
-        
+    MAGNETOMETER_RAW_MAX = 32752
+    # Valid raw values (low, high, reason), checked by cryodecoder.bulk
+    # before converting
+    RAW_LIMITS = {
+        "magnetometer_x" : (-MAGNETOMETER_RAW_MAX, MAGNETOMETER_RAW_MAX, ErrorReason.OUT_OF_RANGE),
+        "magnetometer_y" : (-MAGNETOMETER_RAW_MAX, MAGNETOMETER_RAW_MAX, ErrorReason.OUT_OF_RANGE),
+        "magnetometer_z" : (-MAGNETOMETER_RAW_MAX, MAGNETOMETER_RAW_MAX, ErrorReason.OUT_OF_RANGE),
+    }
+
     def __init__(self, magnetometer_full_scale = None, **kwargs):
         # Assign default magnetometer full scale
         self.magnetometer_full_scale = \
@@ -114,10 +158,14 @@ class ICM20948MagnetometerData:
             or ICM20948MagnetometerData.MAGNETOMETER_FULL_SCALE_DEFAULT
     
     def __magnetometer_icm_20948(self, raw):
-        if raw > 32752 or raw < -32752:
-            raise ValueError("Invalid raw magnetometer value outside [-32752,32752] range.")
+        out_of_range = abs(raw) > ICM20948MagnetometerData.MAGNETOMETER_RAW_MAX
+        # Reduce the element-wise comparison for arrays of raw values
+        if hasattr(out_of_range, "any"):
+            out_of_range = out_of_range.any()
+        if out_of_range:
+            raise InvalidPacketError("Invalid raw magnetometer value outside [-32752,32752] range.", ErrorReason.OUT_OF_RANGE)
         else:
-            return float(raw) / 32752 * self.magnetometer_full_scale # uT
+            return raw / 32752 * self.magnetometer_full_scale # uT
     
     def parse_magnetometer_x(self, raw):
         return self.__magnetometer_icm_20948(raw)
@@ -137,7 +185,7 @@ class CTiTilt05AccelerometerData:
         
     def __accelerometer_tilt05(_, raw):
         # For TILT-05 convert the accelerometer data from mg to g
-        return float(raw) / 1000
+        return raw / 1000
     
     def parse_accelerometer_x(self, raw):
         return self.__accelerometer_tilt05(raw)
@@ -155,11 +203,11 @@ class CTiTilt05OrientationData:
 
     def parse_pitch_x(self, raw):
         # convert back from 10*degrees to degrees
-        return float(raw) / 10
+        return raw / 10
 
     def parse_roll_y(self, raw):
         # convert back from 10*degrees to degrees
-        return float(raw) / 10
+        return raw / 10
     
 ##############################################################################
 # CRYOEGG
@@ -173,8 +221,10 @@ class CryoeggData(
     BatteryVoltageData,
     SequenceNumberData
 ):
+    PACKET_CLASS = CryoeggPacket
+
     # Requires knowledge of pressure sensor to correctly define packet data
-    def __init__(self, packet, **kwargs):
+    def __init__(self, packet = None, **kwargs):
         
         Data.__init__(self, packet) 
         KellerPressureData.__init__(self, **kwargs) 
@@ -183,6 +233,10 @@ class CryoeggData(
         BatteryVoltageData.__init__(self, **kwargs)
         SequenceNumberData.__init__(self, **kwargs)
 
+        # Without a packet, only keep the settings (see Data.convert_columns)
+        if packet == None:
+            return
+
         # Check we've been passed a CryoeggPacket
         if not isinstance(packet, CryoeggPacket):
             raise TypeError("Invalid packet type, packet should be of type CryoeggPacket")
@@ -210,7 +264,9 @@ class CryowurstData(
     SequenceNumberData
     ):
 
-    def __init__(self, packet, **kwargs):
+    PACKET_CLASS = CryowurstPacket
+
+    def __init__(self, packet = None, **kwargs):
 
         # Call constructors of subclasses
         # TODO: add logic here for sensor_ids
@@ -224,11 +280,15 @@ class CryowurstData(
         ConductivityData.__init__(self, **kwargs)
 
         # Check we've been passed a CryoeggPacket
-        if not isinstance(packet, CryowurstPacket):
+        if packet != None and not isinstance(packet, CryowurstPacket):
             raise TypeError("Invalid packet type, packet should be of type CryoeggPacket")
         # otherwise okay to assign the packet
         self.packet = packet
 
+        # Without a packet, only keep the settings (see Data.convert_columns)
+        if packet == None:
+            return
+
         # convert values
         self.convert()
         
@@ -237,19 +297,23 @@ class CryowurstData(
 ##############################################################################    
 
 class CryoReceiverData(Data):
-    
-    def __init__(self, packet):
+
+    PACKET_CLASS = CryoReceiverPacket
+    RAW_LIMITS = {"channel" : (1, 2, ErrorReason.INVALID_CHANNEL)}
+
+    def __init__(self, packet = None):
         # Initialise object
         super().__init__(packet)
         # Convert packet fields to values
-        self.convert()
+        if packet != None:
+            self.convert()
 
     def parse_mbus_packet(self, raw):
         return raw
 
     def parse_channel(_, raw):
         if raw not in [1,2]:
-            raise ValueError("Channel can only be 1 or 2")
+            raise InvalidPacketError("Channel can only be 1 or 2", ErrorReason.INVALID_CHANNEL)
         return raw
     
     def parse_temperature_logger(_, raw):
@@ -261,4 +325,53 @@ class CryoReceiverData(Data):
     
     def parse_solar_voltage(_, raw):
         # returns units in volts
-        return raw / 1000 
\ No newline at end of file
+        return raw / 1000
+
+class SDSatelliteData(Data):
+
+    # Converts the receiver fields of an SD record to the same units as
+    # CryoReceiverData, so that both can be written to the same columns
+    PACKET_CLASS = SDSatellitePacket
+
+    def __init__(self, packet = None):
+        # Initialise object
+        super().__init__(packet)
+        # Convert packet fields to values
+        if packet != None:
+            self.convert()
+
+    def parse_header(_, raw):
+        return raw
+
+    def parse_timestamp(_, raw):
+        return raw
+
+    def parse_temperature_logger(_, raw):
+        return raw
+
+    def parse_pressure_logger(_, raw):
+        # logged in mbar, returns units in bar
+        return raw / 1000
+
+    def parse_solar_voltage(_, raw):
+        # logged in millivolts, returns units in volts
+        return raw / 1000
+
+    def parse_channel(_, raw):
+        return raw
+
+    def parse_length(_, raw):
+        return raw
+
+    def parse_mbus_packet(self, raw):
+        return raw
+
+##############################################################################
+# PAYLOAD TYPES
+##############################################################################
+
+# Data type used to convert each payload packet type
+DATA_CLASSES = {
+    data_class.PACKET_CLASS : data_class
+    for data_class in (CryoeggData, CryowurstData)
+}
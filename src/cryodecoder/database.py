@@ -0,0 +1,282 @@
+from cryodecoder import Packet, Data, Record, DATA_CLASSES
+
+import operator
+import sqlite3
+import time
+
+##############################################################################
+# DATABASE WRITER
+##############################################################################
+# Writes packets, Data objects and records to an SQLite database, with one
+# table per type named after the class (e.g. CryoeggPacket, CryoeggData,
+# CryoeggRecord). The columns of each table are the user_id and timestamp of
+# the packet (where these aren't already fields, e.g. for SD records),
+# followed by the fields listed in the packet configuration.
+# Rows are queued per table and inserted with executemany in a single
+# transaction once batch_size rows are queued or flush_interval seconds have
+# passed since the last flush.
+#
+# If a batch fails because of the rows themselves (e.g. a constraint
+# violation or a value SQLite can't store), it's inserted again one row at a
+# time, and rows which still fail are moved to rejected rather than being
+# retried by every later flush. Other errors (e.g. a full disk) keep the
+# rows queued and are raised.
+
+class DatabaseWriter:
+
+    BATCH_SIZE_DEFAULT = 50000 # rows
+    FLUSH_INTERVAL_DEFAULT = 1.0 # seconds
+    CACHE_SIZE = 64 << 20 # bytes
+    # Errors caused by the rows of a batch rather than the database
+    ROW_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError, OverflowError)
+
+    # Columns for the user_id and timestamp arguments of write(), unless the
+    # type has fields of the same name, and how to build them for each row
+    CONTEXT_COLUMNS = (("user_id", "INTEGER"), ("timestamp", "REAL"))
+    CONTEXT = {
+        ("user_id", "timestamp") : lambda user_id, timestamp : (user_id, timestamp),
+        ("user_id",) : lambda user_id, timestamp : (user_id,),
+        ("timestamp",) : lambda user_id, timestamp : (timestamp,),
+        () : lambda user_id, timestamp : (),
+    }
+
+    # SQLite column types for each configured output type
+    COLUMN_TYPES = {
+        "int" : "INTEGER",
+        "float" : "REAL",
+        "str" : "TEXT",
+        "bytes" : "BLOB",
+    }
+
+    def __init__(self, path, batch_size = None, flush_interval = None, catalogue = None):
+
+        self.batch_size = batch_size or DatabaseWriter.BATCH_SIZE_DEFAULT
+        self.flush_interval = flush_interval or DatabaseWriter.FLUSH_INTERVAL_DEFAULT
+
+        # Transactions are managed by flush()
+        self.connection = sqlite3.connect(path, isolation_level = None)
+        # Readers don't block the writer (and vice versa) in WAL mode, and
+        # only the WAL needs to be synced on commit
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        # Keep more of the indexes in memory for large inserts
+        self.connection.execute(f"PRAGMA cache_size = -{DatabaseWriter.CACHE_SIZE // 1024}")
+
+        # Per class: (insert statement, context, field getter, indices of
+        # bytes fields, rows)
+        self.tables = {}
+        # Converters for the payloads of write_mbus (see DataConverter), or
+        # the calibration of each instrument (see CalibrationCatalogue)
+        self.converters = {}
+        self.catalogue = catalogue
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        # (type, row, error) of each row which couldn't be inserted
+        self.rejected = []
+        # Statistics
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.connection.close()
+
+    @staticmethod
+    def table_fields(record_class):
+
+        # Return a list of (field, column type) for a Packet, Data or Record type
+        if issubclass(record_class, Packet):
+            packet_class = record_class
+        elif issubclass(record_class, Data):
+            packet_class = record_class.PACKET_CLASS
+        elif issubclass(record_class, Record):
+            # Records only hold numeric values, and NUMERIC keeps any
+            # integers as integers
+            return [(field, "NUMERIC") for field in record_class._fields]
+        else:
+            raise TypeError("Can only write Packet, Data or Record objects")
+
+        columns = []
+        for field, field_config in Packet.CONFIG[packet_class].fields.items():
+            if issubclass(record_class, Data) and field_config.output_type != "bytes":
+                # Converted values are mostly floats, but NUMERIC keeps any
+                # integers as integers
+                column_type = "NUMERIC"
+            elif field in packet_class.DECODER.formats:
+                # Use the unpacked type for numeric fields, as e.g. floats
+                # may be stored as integers in the packet
+                column_type = "REAL" if packet_class.DECODER.formats[field][1][-1] in "fd" else "INTEGER"
+            else:
+                column_type = DatabaseWriter.COLUMN_TYPES.get(field_config.output_type, "BLOB")
+            columns.append((field, column_type))
+
+        return columns
+
+    def table(self, record_class):
+
+        # Create the table (and indexes) for a type on first use
+        table = self.tables.get(record_class)
+        if table != None:
+            return table
+
+        name = record_class.__name__
+        columns = DatabaseWriter.table_fields(record_class)
+        fields = tuple(field for field, _ in columns)
+
+        context_columns = [
+            (column, column_type) for column, column_type in DatabaseWriter.CONTEXT_COLUMNS
+            if column not in fields
+        ]
+        context = DatabaseWriter.CONTEXT[tuple(column for column, _ in context_columns)]
+        columns = context_columns + columns
+        self.connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" ('
+            + ", ".join(f'"{column}" {column_type}' for column, column_type in columns)
+            + ")"
+        )
+
+        # Check an existing table has the same columns
+        existing = [row[1] for row in self.connection.execute(f'PRAGMA table_info("{name}")')]
+        if existing != [column for column, _ in columns]:
+            raise ValueError(f"Table {name} exists with different columns {existing}")
+
+        self.connection.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}_user_id_timestamp" ON "{name}" (user_id, timestamp)'
+        )
+        if "sequence_number" in fields:
+            self.connection.execute(
+                f'CREATE INDEX IF NOT EXISTS "{name}_user_id_sequence_number" ON "{name}" (user_id, sequence_number)'
+            )
+
+        insert = f'INSERT INTO "{name}" VALUES ({", ".join("?" * len(columns))})'
+        # Positions (in the row) of fields stored as BLOBs, e.g. nested packets
+        blobs = tuple(
+            index for index, (_, column_type) in enumerate(columns)
+            if column_type == "BLOB"
+        )
+
+        # Get all fields in one call, always returning a tuple
+        if issubclass(record_class, Record):
+            # Unpack all the values of a record at once
+            getter = lambda values : values._layout.unpack(values._values)
+        elif len(fields) == 1:
+            getter = lambda values, getter = operator.attrgetter(fields[0]) : (getter(values),)
+        else:
+            getter = operator.attrgetter(*fields)
+
+        table = (insert, context, getter, blobs, [])
+        self.tables[record_class] = table
+        return table
+
+    def write(self, values, user_id = None, timestamp = None):
+
+        # Queue a Packet, Data or Record object to be written
+        table = self.tables.get(values.__class__)
+        if table == None:
+            table = self.table(values.__class__)
+        _, context, getter, blobs, rows = table
+
+        row = context(user_id, timestamp) + getter(values)
+
+        if blobs:
+            row = list(row)
+            for index in blobs:
+                value = row[index]
+                # Store the raw bytes of nested packets
+                if isinstance(value, Packet):
+                    value = value.raw
+                row[index] = None if value == None else bytes(value)
+
+        rows.append(row)
+        self.pending += 1
+
+        if self.pending >= self.batch_size \
+            or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_mbus(self, mbus_packet, timestamp = None, convert = True):
+
+        # Write the payload of an MBusPacket, and the values converted by its
+        # Data type (see DATA_CLASSES), with the user_id of the MBusPacket
+        payload = mbus_packet.payload
+        if not isinstance(payload, Packet):
+            return
+
+        user_id = mbus_packet.user_id
+        self.write(payload, user_id, timestamp)
+
+        if not convert:
+            return
+        if self.catalogue != None:
+            converter = self.catalogue.payload_converter(mbus_packet)
+            if converter != None:
+                self.write(converter.convert(payload), user_id, timestamp)
+            return
+        converter = self.converters.get(payload.__class__)
+        if converter == None:
+            data_class = DATA_CLASSES.get(payload.__class__)
+            if data_class == None:
+                return
+            converter = self.converters[payload.__class__] = data_class.converter()
+        self.write(converter.convert(payload), user_id, timestamp)
+
+    def flush(self):
+
+        # Insert all queued rows in one transaction
+        self.last_flush = time.monotonic()
+        if self.pending == 0:
+            return
+
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            for insert, _, _, _, rows in self.tables.values():
+                if rows:
+                    connection.executemany(insert, rows)
+        except DatabaseWriter.ROW_ERRORS:
+            connection.execute("ROLLBACK")
+            self.flush_rows()
+            return
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+        for _, _, _, _, rows in self.tables.values():
+            rows.clear()
+        self.rows_written += self.pending
+        self.pending = 0
+
+    def flush_rows(self):
+
+        # Insert queued rows one at a time, to find the rows which made a
+        # batch fail, and move those to rejected
+        connection = self.connection
+        written = 0
+        rejected = []
+        connection.execute("BEGIN")
+        try:
+            for record_class, (insert, _, _, _, rows) in self.tables.items():
+                for row in rows:
+                    try:
+                        connection.execute(insert, row)
+                        written += 1
+                    except DatabaseWriter.ROW_ERRORS as error:
+                        rejected.append((record_class, row, error))
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+        for _, _, _, _, rows in self.tables.values():
+            rows.clear()
+        self.rejected.extend(rejected)
+        self.rows_written += written
+        self.pending = 0
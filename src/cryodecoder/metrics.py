@@ -0,0 +1,430 @@
+from cryodecoder import Packet, MBusPacket, Data, DataConverter, LazyField, InvalidPacketError
+
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+##############################################################################
+# METRICS
+##############################################################################
+# Opt-in instrumentation of the decode and conversion hot paths. Nothing is
+# changed until Metrics.enable() is called, which wraps Packet.parse,
+# Packet.set_raw_data, MBusPacket.parse_payload and Data.convert to time
+# each call, and the constructors of the packet types to count packets
+# decoded, rejected (by reason) and bytes, for each packet and Data type.
+# Conversions by a DataConverter (as used by the CLI, DatabaseWriter and
+# decode_bulk) are counted under its Data type, from DataConverter.convert
+# and convert_record for single packets, and convert_packet_columns for
+# batches converted a field at a time.
+# Packets are counted once construction finishes, as packet types validate
+# their raw data after parsing (e.g. CryoeggPacket checks its length).
+# disable() puts the original methods back, so instrumentation costs
+# nothing when it's off.
+#
+# PacketDecoder binds the parsers of each field when a packet type is
+# compiled, so the parse_payload fields of compiled packet types are pointed
+# at the current method whenever it is wrapped or restored (see
+# PacketDecoder.set_parser). Packet types aren't recompiled, so their
+# DECODER and RECORD stay the same objects.
+#
+# Times include any nested packets (e.g. parsing a CryoReceiverPacket
+# includes its MBusPacket and payload). Lazy packets are counted when
+# constructed, although their fields are only checked when decoded, and
+# each field decoded on first access is timed as "decode_field" (by
+# LazyField). Packet types defined after enable() aren't counted. Counters
+# aren't locked, so counts from several threads may occasionally be lost.
+
+class Histogram:
+
+    # Cumulative latency histogram, as in Prometheus
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Count of observations in each bucket, and above the last one
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"count" : self.count, "sum" : self.sum, "buckets" : buckets}
+
+class TypeMetrics:
+
+    # Counters and latencies of one packet or Data type
+    __slots__ = ("count", "bytes", "rejected", "latency")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        # ErrorReason (or exception type) name -> count
+        self.rejected = {}
+        # Operation -> Histogram
+        self.latency = {}
+
+    def snapshot(self):
+        return {
+            "count" : self.count,
+            "bytes" : self.bytes,
+            "rejected" : dict(self.rejected),
+            "latency" : {operation : histogram.snapshot() for operation, histogram in self.latency.items()},
+        }
+
+class Metrics:
+
+    # Upper bounds of the latency buckets, in seconds
+    BUCKETS_DEFAULT = (
+        1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2, 1e-1
+    )
+    PORT_DEFAULT = 9464
+    # Metrics instance currently enabled, as methods can only be wrapped once
+    ACTIVE = None
+
+    def __init__(self, buckets = None):
+
+        self.buckets = tuple(sorted(buckets or Metrics.BUCKETS_DEFAULT))
+        # TypeMetrics of each packet and Data type
+        self.packets = {}
+        self.data = {}
+        # Payloads found by MBusPacket.parse_payload, by type name (or
+        # "unknown" for payloads left as raw bytes)
+        self.payloads = {}
+
+        # (class, name, original attribute) of each wrapped method
+        self.originals = []
+        self.server = None
+
+    @property
+    def enabled(self):
+        return Metrics.ACTIVE is self
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+
+    ##########################################################################
+    # Instrumentation
+    ##########################################################################
+
+    def enable(self):
+
+        if Metrics.ACTIVE is self:
+            return
+        if Metrics.ACTIVE != None:
+            raise RuntimeError("Another Metrics instance is already enabled")
+        Metrics.ACTIVE = self
+
+        for owner, name, wrapper in (
+            (Packet, "set_raw_data", self.wrap_set_raw_data),
+            (Packet, "parse", self.wrap_parse),
+            (MBusPacket, "parse_payload", self.wrap_parse_payload),
+            (Data, "convert", self.wrap_convert),
+            (DataConverter, "convert", self.wrap_converter("convert")),
+            (DataConverter, "convert_record", self.wrap_converter("convert_record")),
+            (DataConverter, "convert_packet_columns", self.wrap_convert_packet_columns),
+            (LazyField, "__get__", self.wrap_lazy_field),
+        ):
+            original = owner.__dict__[name]
+            self.originals.append((owner, name, original))
+            if isinstance(original, staticmethod):
+                setattr(owner, name, staticmethod(wrapper(original.__func__)))
+            else:
+                setattr(owner, name, wrapper(original))
+
+        # Constructors of Packet and each packet type which has its own
+        packet_classes = [Packet]
+        for packet_class in packet_classes:
+            packet_classes.extend(packet_class.__subclasses__())
+        for packet_class in dict.fromkeys(packet_classes):
+            original = packet_class.__dict__.get("__init__")
+            if original != None:
+                self.originals.append((packet_class, "__init__", original))
+                packet_class.__init__ = self.wrap_init(original)
+
+        Metrics.bind_parsers()
+
+    def disable(self):
+
+        if Metrics.ACTIVE is not self:
+            return
+        while self.originals:
+            owner, name, original = self.originals.pop()
+            setattr(owner, name, original)
+        Metrics.ACTIVE = None
+
+        Metrics.bind_parsers()
+
+    @staticmethod
+    def bind_parsers():
+        # Point the parse_payload fields of compiled packet types at the
+        # current method
+        for packet_class, packet_config in list(Packet.CONFIG.items()):
+            decoder = packet_class.__dict__.get("DECODER")
+            if decoder == None:
+                continue
+            for field, field_config in packet_config.fields.items():
+                if field_config.parser == "parse_payload":
+                    decoder.set_parser(field, packet_class.parse_payload)
+
+    def type_metrics(self, types, type_class):
+        metrics = types.get(type_class)
+        if metrics == None:
+            metrics = types[type_class] = TypeMetrics()
+        return metrics
+
+    def observe(self, metrics, operation, seconds):
+        histogram = metrics.latency.get(operation)
+        if histogram == None:
+            histogram = metrics.latency[operation] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def reject(self, metrics, error):
+        # By ErrorReason for InvalidPacketErrors, otherwise exception type
+        reason = error.reason.name if isinstance(error, InvalidPacketError) else error.__class__.__name__
+        metrics.rejected[reason] = metrics.rejected.get(reason, 0) + 1
+
+    def wrap_init(self, original):
+
+        # Counts a packet once the constructor of its own type finishes,
+        # rather than in the constructors of its base types
+        @functools.wraps(original)
+        def __init__(packet, *args, **kwargs):
+            if packet.__class__.__init__ is not __init__:
+                original(packet, *args, **kwargs)
+                return
+            metrics = self.type_metrics(self.packets, packet.__class__)
+            try:
+                original(packet, *args, **kwargs)
+            except Exception as error:
+                self.reject(metrics, error)
+                raise
+            # Packets made without raw data aren't decoded
+            if "raw" in packet.__dict__:
+                metrics.count += 1
+                metrics.bytes += len(packet.raw)
+
+        return __init__
+
+    def wrap_set_raw_data(self, original):
+
+        @functools.wraps(original)
+        def set_raw_data(packet, raw = None, encoding = "utf-8"):
+            start = time.perf_counter()
+            original(packet, raw, encoding)
+            self.observe(self.type_metrics(self.packets, packet.__class__), "set_raw_data", time.perf_counter() - start)
+
+        return set_raw_data
+
+    def wrap_parse(self, original):
+
+        @functools.wraps(original)
+        def parse(packet):
+            start = time.perf_counter()
+            original(packet)
+            self.observe(self.type_metrics(self.packets, packet.__class__), "parse", time.perf_counter() - start)
+
+        return parse
+
+    def wrap_parse_payload(self, original):
+
+        # Keeps the lazy argument, see PacketDecoder.sliced_field
+        @functools.wraps(original)
+        def parse_payload(raw, control_field, lazy = False):
+            start = time.perf_counter()
+            payload = original(raw, control_field, lazy = lazy)
+            seconds = time.perf_counter() - start
+            name = payload.__class__.__name__ if isinstance(payload, Packet) else "unknown"
+            self.payloads[name] = self.payloads.get(name, 0) + 1
+            self.observe(self.type_metrics(self.packets, MBusPacket), "parse_payload", seconds)
+            return payload
+
+        return parse_payload
+
+    def wrap_lazy_field(self, original):
+
+        @functools.wraps(original)
+        def __get__(field, packet, owner = None):
+            if packet is None:
+                return original(field, packet, owner)
+            start = time.perf_counter()
+            value = original(field, packet, owner)
+            self.observe(self.type_metrics(self.packets, packet.__class__), "decode_field", time.perf_counter() - start)
+            return value
+
+        return __get__
+
+    def wrap_convert(self, original):
+
+        @functools.wraps(original)
+        def convert(data, packet = None):
+            metrics = self.type_metrics(self.data, data.__class__)
+            start = time.perf_counter()
+            try:
+                original(data, packet)
+            except Exception as error:
+                self.reject(metrics, error)
+                raise
+            self.observe(metrics, "convert", time.perf_counter() - start)
+            metrics.count += 1
+
+        return convert
+
+    def wrap_converter(self, operation):
+
+        # DataConverter.convert and convert_record, by the Data type of the
+        # converter
+        def wrapper(original):
+
+            @functools.wraps(original)
+            def convert(converter, packet):
+                metrics = self.type_metrics(self.data, converter.data_class)
+                start = time.perf_counter()
+                try:
+                    converted = original(converter, packet)
+                except Exception as error:
+                    self.reject(metrics, error)
+                    raise
+                self.observe(metrics, operation, time.perf_counter() - start)
+                metrics.count += 1
+                return converted
+
+            return convert
+
+        return wrapper
+
+    def wrap_convert_packet_columns(self, original):
+
+        # Batches which fall back to converting one packet at a time are
+        # counted by convert or convert_record instead
+        @functools.wraps(original)
+        def convert_packet_columns(converter, packets, getter, converters):
+            metrics = self.type_metrics(self.data, converter.data_class)
+            start = time.perf_counter()
+            try:
+                columns = original(converter, packets, getter, converters)
+            except Exception as error:
+                self.reject(metrics, error)
+                raise
+            if columns != None:
+                self.observe(metrics, "convert_batch", time.perf_counter() - start)
+                metrics.count += len(packets)
+            return columns
+
+        return convert_packet_columns
+
+    ##########################################################################
+    # Reporting
+    ##########################################################################
+
+    def reset(self):
+        self.packets.clear()
+        self.data.clear()
+        self.payloads.clear()
+
+    def snapshot(self):
+        # Copy of every metric as plain values, e.g. for logging as JSON
+        return {
+            "packets" : {packet_class.__name__ : metrics.snapshot() for packet_class, metrics in list(self.packets.items())},
+            "data" : {data_class.__name__ : metrics.snapshot() for data_class, metrics in list(self.data.items())},
+            "payloads" : dict(self.payloads),
+        }
+
+    def prometheus(self):
+
+        # Metrics in the Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+        for kind, label, types, description in (
+            ("packets", "packet", snapshot["packets"], "Packets"),
+            ("data", "data", snapshot["data"], "Data objects"),
+        ):
+            family(f"cryodecoder_{kind}_total", "counter", f"{description} decoded", [
+                ("", ((label, name),), metrics["count"]) for name, metrics in types.items()
+            ])
+            family(f"cryodecoder_{kind}_rejected_total", "counter", f"{description} rejected, by reason", [
+                ("", ((label, name), ("reason", reason)), count)
+                for name, metrics in types.items() for reason, count in metrics["rejected"].items()
+            ])
+            if kind == "packets":
+                family("cryodecoder_bytes_total", "counter", "Bytes of raw data accepted", [
+                    ("", ((label, name),), metrics["bytes"]) for name, metrics in types.items()
+                ])
+
+            samples = []
+            for name, metrics in types.items():
+                for operation, histogram in metrics["latency"].items():
+                    labels = ((label, name), ("operation", operation))
+                    for bound, count in histogram["buckets"].items():
+                        samples.append(("_bucket", labels + (("le", repr(bound)),), count))
+                    samples.append(("_bucket", labels + (("le", "+Inf"),), histogram["count"]))
+                    samples.append(("_sum", labels, histogram["sum"]))
+                    samples.append(("_count", labels, histogram["count"]))
+            family(f"cryodecoder_{kind}_latency_seconds", "histogram", "Time taken by each operation", samples)
+
+        family("cryodecoder_payloads_total", "counter", "M-Bus payloads, by type", [
+            ("", (("payload", name),), count) for name, count in snapshot["payloads"].items()
+        ])
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port = None, address = "127.0.0.1"):
+
+        # Serve prometheus() over HTTP from a background thread, on a local
+        # address by default. Returns the server, which is shut down by
+        # close(). http.server is only imported if this is used.
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.close()
+        self.server = ThreadingHTTPServer((address, Metrics.PORT_DEFAULT if port == None else port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever, name = "cryodecoder-metrics", daemon = True).start()
+        return self.server
+
+    def close(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __repr__(self):
+        return f"Metrics: {'enabled' if self.enabled else 'disabled'}, {len(self.packets)} packet types, {len(self.data)} Data types"
@@ -1,8 +1,12 @@
-from cryodecoder import Packet
+from cryodecoder import Packet, InvalidPacketError, ErrorReason
 import struct
 
 class MBusPacket(Packet):
 
+    # Payload packet classes indexed by (control_field, payload length), see
+    # register_payload
+    PAYLOAD_TYPES = {}
+
     def __init__(self, *args, **kwargs):
         # Call super class constructor
         super().__init__(*args, **kwargs)
@@ -36,17 +40,27 @@ class MBusPacket(Packet):
         return int.from_bytes(raw, byteorder="little", signed=True)
     
     @staticmethod
-    def parse_payload(raw):
-        # Check length of payload
-        if len(raw) == CryoeggPacket.MIN_SIZE:
-            # Try and create a Cryoegg payload
-            return CryoeggPacket(raw)
-        elif len(raw) == CryowurstPacket.MIN_SIZE:
-            return CryowurstPacket(raw)
-        elif len(raw) == HydrobeanPacket.MIN_SIZE:
-            return HydrobeanPacket(raw)
-        else:
+    def parse_payload(raw, control_field, lazy = False):
+        # Look up the payload type from the CI byte and length of payload
+        payload_class = MBusPacket.PAYLOAD_TYPES.get((control_field, len(raw)))
+        if payload_class == None:
+            # Unknown payloads are left as raw bytes
             return raw
+        else:
+            return payload_class(raw, lazy = lazy)
+
+    @classmethod
+    def register_payload(this_class, packet_class):
+        # Register a configured packet class as a payload type, for each of
+        # the CI values given by control_field in its configuration. The
+        # length is taken from the configuration (equal to MIN_SIZE) so that
+        # the class isn't compiled until it's used.
+        config = Packet.CONFIG[packet_class]
+        for control_field in config.control_field:
+            key = (control_field, config.length)
+            if this_class.PAYLOAD_TYPES.get(key, packet_class) != packet_class:
+                raise ValueError(f"Payload type {packet_class.__name__} clashes with {this_class.PAYLOAD_TYPES[key].__name__} (CI 0x{control_field:02X}, length {config.length})")
+            this_class.PAYLOAD_TYPES[key] = packet_class
     
 class CryoeggPacket(Packet):
 
@@ -55,7 +69,10 @@ class CryoeggPacket(Packet):
         super().__init__(*args, **kwargs)
         # Validate packet length
         if len(self.raw) != self.__class__.MIN_SIZE:
-            raise ValueError(f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}")
+            raise InvalidPacketError(
+                f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}",
+                ErrorReason.TOO_LONG
+            )
 
     @staticmethod
     def parse_conductivity(raw):
@@ -88,7 +105,10 @@ class HydrobeanPacket(Packet):
         super().__init__(*args, **kwargs)
         # Validate packet length
         if len(self.raw) != self.__class__.MIN_SIZE:
-            raise ValueError(f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}")
+            raise InvalidPacketError(
+                f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}",
+                ErrorReason.TOO_LONG
+            )
 
     @staticmethod
     def parse_conductivity(raw):
@@ -116,7 +136,10 @@ class CryowurstPacket(Packet):
         super().__init__(*args, **kwargs)
         # Validate packet length
         if len(self.raw) != self.__class__.MIN_SIZE:
-            raise ValueError(f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}")
+            raise InvalidPacketError(
+                f"Invalid packet length ({len(self.raw)}), expecting {self.__class__.MIN_SIZE}",
+                ErrorReason.TOO_LONG
+            )
 
     @staticmethod
     def parse_conductivity(raw):
@@ -194,11 +217,11 @@ class CryoReceiverPacket(Packet):
         return int.from_bytes(raw, byteorder="little")
 
     @staticmethod
-    def parse_mbus_packet(raw):
+    def parse_mbus_packet(raw, lazy = False):
         
         # For any CryoReceiverPacket we're assuming that the
         # payload will be an MBusPacket, hence
-        return MBusPacket(raw)
+        return MBusPacket(raw, lazy = lazy)
     
 class SDSatellitePacket(Packet):
 
@@ -207,11 +230,14 @@ class SDSatellitePacket(Packet):
         super().__init__(*args, **kwargs)
         # Validate packet length
         if len(self.raw) > self.__class__.MIN_SIZE + self.length:
-            raise ValueError(f"Raw packet length ({len(self.raw)}) exceeds expected length {self.__class__.MIN_SIZE + self.length}")
+            raise InvalidPacketError(
+                f"Raw packet length ({len(self.raw)}) exceeds expected length {self.__class__.MIN_SIZE + self.length}",
+                ErrorReason.TOO_LONG
+            )
 
     @staticmethod
     def parse_header(raw):
-        return raw.decode("ascii")
+        return str(raw, "ascii")
     
     @staticmethod
     def parse_timestamp(raw):
@@ -239,7 +265,7 @@ class SDSatellitePacket(Packet):
         return int.from_bytes(raw, byteorder="little")
         
     @staticmethod
-    def parse_mbus_packet(raw):
-        return CryoReceiverPacket.parse_mbus_packet(raw)
+    def parse_mbus_packet(raw, lazy = False):
+        return CryoReceiverPacket.parse_mbus_packet(raw, lazy = lazy)
     
     
\ No newline at end of file
@@ -0,0 +1,142 @@
+from cryodecoder import Packet, SDSatellitePacket, SDArchive, ErrorReason, InvalidPacketError
+from cryodecoder.bulk import ErrorRecord
+
+import collections
+import mmap
+import multiprocessing
+import os
+
+##############################################################################
+# PARALLEL DECODING
+##############################################################################
+# SD archives are split into chunks of whole records using the length byte of
+# each SDSatellitePacket header (see SDArchive.split), and each chunk is
+# decoded by a worker process which maps the archive itself, so only the
+# chunk boundaries are sent to the workers and only the results come back.
+# Packets are views into the worker's mapping and can't be sent back, so a
+# function is applied to each packet in the worker to give picklable results.
+# Records which can't be decoded (or which function raises for) are left
+# out, and reported as ErrorRecords (see cryodecoder.bulk) if an errors
+# list is given.
+
+PARALLEL_CHUNK_SIZE_DEFAULT = 1 << 20 # bytes
+# Chunks dispatched to the pool but not yet yielded, per worker
+PARALLEL_CHUNKS_PER_WORKER = 2
+
+def packet_records(packet):
+
+    # Default function for decode_archive, which returns the raw (i.e. not
+    # converted) values of the SDSatellitePacket, its MBusPacket and the
+    # payload as compact records (see Record), or None for unknown payloads
+    mbus_packet = packet.mbus_packet
+    payload = mbus_packet.payload
+
+    records = [packet_record(packet), packet_record(mbus_packet), None]
+    if isinstance(payload, Packet):
+        records[2] = packet_record(payload)
+
+    return tuple(records)
+
+def packet_record(packet):
+    record = packet.RECORD
+    return record(*[getattr(packet, field) for field in record._fields])
+
+def decode_chunk(task):
+
+    # Decode the records between start and end of the archive, in a worker
+    path, start, end, function, lazy = task
+
+    with open(path, "rb") as archive_fh:
+        buffer = mmap.mmap(
+            archive_fh.fileno(), 0, access = mmap.ACCESS_READ
+        )
+
+    header_size = SDSatellitePacket.MIN_SIZE
+    length_offset = Packet.CONFIG[SDSatellitePacket].fields["length"].offset
+
+    results = []
+    errors = []
+    view = memoryview(buffer)
+    packet = None
+    try:
+        offset = start
+        while offset < end:
+            record_end = offset + header_size + buffer[offset + length_offset]
+            if record_end > end:
+                # The length byte doesn't match the chunk boundaries (e.g.
+                # the archive has changed), so nothing after it can be found
+                errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.TRUNCATED))
+                break
+            try:
+                packet = SDSatellitePacket(view[offset:record_end], lazy = lazy)
+                results.append(function(packet))
+            except InvalidPacketError as error:
+                errors.append(ErrorRecord(offset, SDSatellitePacket, error.reason))
+            except UnicodeDecodeError:
+                errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.INVALID_HEADER))
+            except (ValueError, TypeError, ArithmeticError):
+                errors.append(ErrorRecord(offset, SDSatellitePacket, ErrorReason.INVALID))
+            offset = record_end
+    finally:
+        # Release any views still held by the last packet before unmapping
+        del packet
+        view.release()
+        try:
+            buffer.close()
+        except BufferError:
+            # Results still hold views into the mapping (see SDArchive.close)
+            pass
+
+    return results, errors
+
+def decode_archive(path, function = None, workers = None, chunk_size = None, lazy = False, errors = None):
+
+    # Decode an SD archive in a pool of worker processes, yielding the result
+    # of function(packet) for each record in the original order of the
+    # archive. function must be picklable (i.e. defined at the top level of
+    # a module) as must be its results, and defaults to packet_records.
+    # ErrorRecords for records which can't be decoded are appended to
+    # errors, if given, as each chunk is yielded.
+    #
+    # Results are yielded as chunks complete, and only a few chunks per
+    # worker are dispatched ahead of the caller, so memory use doesn't grow
+    # when the caller (e.g. writing to a database) is slower than the
+    # workers.
+    path = os.fspath(path)
+    function = function or packet_records
+    workers = workers or os.cpu_count()
+    chunk_size = chunk_size or PARALLEL_CHUNK_SIZE_DEFAULT
+
+    if workers < 1 or chunk_size < 1:
+        raise ValueError("Number of workers and chunk size should be at least 1")
+
+    def chunk_results(chunk):
+        results, chunk_errors = chunk
+        if errors != None:
+            errors.extend(chunk_errors)
+        return results
+
+    with SDArchive(path) as archive:
+
+        tasks = (
+            (path, start, end, function, lazy)
+            for start, end in archive.split(chunk_size)
+        )
+
+        if workers == 1:
+            # Avoid the overhead of a pool (e.g. for debugging)
+            for task in tasks:
+                yield from chunk_results(decode_chunk(task))
+            return
+
+        with multiprocessing.Pool(workers) as pool:
+            # Results are yielded in the order of the chunks, and another
+            # chunk is dispatched each time one is yielded, unlike imap
+            # which dispatches every chunk at once and buffers the results
+            pending = collections.deque()
+            for task in tasks:
+                if len(pending) >= workers * PARALLEL_CHUNKS_PER_WORKER:
+                    yield from chunk_results(pending.popleft().get())
+                pending.append(pool.apply_async(decode_chunk, (task,)))
+            while pending:
+                yield from chunk_results(pending.popleft().get())
@@ -0,0 +1,447 @@
+from cryodecoder import Packet, MBusPacket, CryoReceiverPacket
+
+import io
+import json
+import os
+import time
+
+##############################################################################
+# PACKET READER
+##############################################################################
+# Implements the framing algorithm in docs/mbus_packets.md: each frame is
+# preceded by a length byte (which does not include itself), followed by the
+# M-Bus C field. Rather than shifting a 255 byte FIFO one byte at a time,
+# the stream is read in large chunks and scanned through a memoryview, so
+# only the chunk and at most one partial frame are ever held in memory.
+#
+# In follow mode the reader waits for more data at the end of the file,
+# like tail -f, so a partial frame at the end is held back until the rest
+# is appended. If the file is truncated or replaced (e.g. rotated), the
+# reader starts again from the beginning of the file at the path.
+#
+# With a checkpoint path, the stream offset reached is saved durably (see
+# save_checkpoint) every checkpoint_interval seconds and when the reader
+# stops, and reading resumes from it when the reader is next created. Only
+# packets which the caller has asked for the next packet after are counted
+# as done, so a packet being handled when the reader is closed is read
+# again on restart. For a clean stop, call stop() and let the loop finish,
+# and to save only once packets are stored elsewhere (e.g. after a database
+# commit), set checkpoint_interval to None and call save_checkpoint().
+
+class PacketReader:
+
+    CHUNK_SIZE_DEFAULT = 1 << 20 # bytes
+    # C field value for all Cryo* instruments
+    C_FIELD_DEFAULT = 0x44
+    # Maximum length byte values (docs/mbus_packets.md)
+    MBUS_LENGTH_MAX = 246
+    CRYORECEIVER_LENGTH_MAX = 253
+    POLL_INTERVAL_DEFAULT = 1.0 # seconds
+    CHECKPOINT_INTERVAL_DEFAULT = 5.0 # seconds
+    # Bytes before the checkpoint offset kept to recognise the file, as
+    # inodes may be reused
+    CHECKPOINT_FINGERPRINT_SIZE = 32
+
+    def __init__(self,
+        source,
+        packet_class = CryoReceiverPacket,
+        chunk_size = None,
+        c_field = C_FIELD_DEFAULT,
+        min_length = None,
+        max_length = None,
+        lazy = False,
+        unknown_payloads = False,
+        follow = False,
+        checkpoint = None,
+        checkpoint_interval = CHECKPOINT_INTERVAL_DEFAULT,
+        poll_interval = None,
+        idle_timeout = None
+    ):
+        self.packet_class = packet_class
+        # Decode packet fields on first access (see Packet), in which case
+        # frames with invalid contents are only detected when read
+        self.lazy = lazy
+        self.chunk_size = chunk_size or PacketReader.CHUNK_SIZE_DEFAULT
+        # Set c_field to None to skip checking the C field
+        self.c_field = c_field
+
+        # Limits on the length byte depend on what is wrapped in the frame
+        if issubclass(packet_class, CryoReceiverPacket):
+            self.min_length = min_length or \
+                MBusPacket.MIN_SIZE + CryoReceiverPacket.MIN_SIZE
+            self.max_length = max_length or PacketReader.CRYORECEIVER_LENGTH_MAX
+        else:
+            self.min_length = min_length or packet_class.MIN_SIZE
+            self.max_length = max_length or PacketReader.MBUS_LENGTH_MAX
+
+        if self.min_length < 1 or self.max_length > 255:
+            raise ValueError("Frame length limits should be within [1, 255]")
+
+        # Frames of M-Bus packets are also checked for a registered payload
+        # type, from the CI byte and payload length (docs/mbus_packets.md),
+        # so that noise which happens to look like a frame start isn't taken
+        # for a frame. This means frames from instruments whose payload
+        # type isn't registered (in packets.toml) are dropped, and only
+        # counted by unknown_frames (as well as bytes_skipped). Set
+        # unknown_payloads to keep them instead, with the payload as raw
+        # bytes.
+        self.unknown_payloads = unknown_payloads
+        self.check_payload = not unknown_payloads \
+            and issubclass(packet_class, (MBusPacket, CryoReceiverPacket))
+        mbus_fields = Packet.CONFIG[MBusPacket].fields
+        self.control_field_offset = mbus_fields["control_field"].offset
+        payload_start, payload_end = mbus_fields["payload"].offset
+        # Bytes of the frame other than the payload
+        self.frame_overhead = payload_start - payload_end - 1
+        if issubclass(packet_class, CryoReceiverPacket):
+            self.frame_overhead += CryoReceiverPacket.MIN_SIZE
+
+        # Accept paths, raw bytes or anything with a read() method
+        self.path = None
+        if isinstance(source, (str, os.PathLike)):
+            self.path = os.fspath(source)
+            self.stream = open(source, "rb")
+            self.close_stream = True
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self.stream = io.BytesIO(source)
+            self.close_stream = True
+        elif hasattr(source, "read"):
+            self.stream = source
+            self.close_stream = False
+        else:
+            raise TypeError("Source should be a path, bytes-like object or binary stream")
+
+        # Statistics
+        self.packets_read = 0
+        self.bytes_skipped = 0
+        # Frame starts dropped for an unregistered payload type, either
+        # noise or frames of unknown instruments (see unknown_payloads)
+        self.unknown_frames = 0
+        # Stream offset just past the last frame (or skipped byte) consumed
+        self.position = 0
+
+        # Follow mode, which needs a path to check for truncation
+        self.follow = follow
+        self.poll_interval = poll_interval or PacketReader.POLL_INTERVAL_DEFAULT
+        # Stop following after this many seconds without new data (None to
+        # follow until stop() is called)
+        self.idle_timeout = idle_timeout
+        self.stopped = False
+        self.watcher = None
+        if (follow or checkpoint != None) and self.path == None:
+            raise ValueError("Following and checkpoints need a path to read from")
+        self.truncations = 0
+
+        # Checkpoint, and the offset up to which packets are done with
+        self.checkpoint_path = None if checkpoint == None else os.fspath(checkpoint)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_position = 0
+        self.saved_position = None
+        self.next_checkpoint = 0.0
+        if self.checkpoint_path != None:
+            self.position = self.load_checkpoint()
+            self.stream.seek(self.position)
+            self.checkpoint_position = self.saved_position = self.position
+            if checkpoint_interval != None:
+                self.next_checkpoint = time.monotonic() + checkpoint_interval
+
+    def __iter__(self):
+        return self.read_packets()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.close_stream:
+            self.stream.close()
+        if self.watcher != None:
+            self.watcher.close()
+            self.watcher = None
+
+    def stop(self):
+        # Finish reading at the next packet, or while waiting for more data
+        # (e.g. from a signal handler or another thread)
+        self.stopped = True
+
+    ##########################################################################
+    # Checkpoints
+    ##########################################################################
+
+    def file_identity(self):
+        state = os.fstat(self.stream.fileno())
+        return state.st_dev, state.st_ino
+
+    def fingerprint(self, position):
+        # Bytes just before position, read without moving the stream
+        start = max(0, position - PacketReader.CHECKPOINT_FINGERPRINT_SIZE)
+        return os.pread(self.stream.fileno(), position - start, start).hex()
+
+    def load_checkpoint(self):
+
+        # Offset to resume from, which is the start of the file if there's
+        # no checkpoint, or it's for another file (e.g. after rotation) or
+        # past the end of this one, or the bytes before it have changed
+        # (truncated and rewritten)
+        try:
+            with open(self.checkpoint_path, "r") as checkpoint_fh:
+                checkpoint = json.load(checkpoint_fh)
+            position = int(checkpoint["position"])
+            identity = (checkpoint["device"], checkpoint["inode"])
+            fingerprint = checkpoint["fingerprint"]
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError, TypeError) as error:
+            raise ValueError(f"Invalid checkpoint {self.checkpoint_path}: {error}")
+
+        if identity != self.file_identity() or position > os.fstat(self.stream.fileno()).st_size \
+            or fingerprint != self.fingerprint(position):
+            return 0
+        return position
+
+    def save_checkpoint(self, position = None):
+
+        # Durably save the offset reached (by default, past every packet
+        # returned so far) by writing a temporary file, syncing it and
+        # renaming it over the checkpoint, so that a crash leaves either the
+        # old or the new checkpoint
+        if self.checkpoint_path == None:
+            raise ValueError("No checkpoint path given")
+        position = self.position if position == None else position
+        device, inode = self.file_identity()
+
+        temp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as checkpoint_fh:
+            json.dump({
+                "path" : self.path,
+                "device" : device,
+                "inode" : inode,
+                "position" : position,
+                "fingerprint" : self.fingerprint(position),
+            }, checkpoint_fh)
+            checkpoint_fh.flush()
+            os.fsync(checkpoint_fh.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+        # and sync the directory, so that the rename is durable too
+        try:
+            directory = os.open(os.path.dirname(os.path.abspath(self.checkpoint_path)), os.O_RDONLY)
+        except OSError:
+            pass
+        else:
+            try:
+                os.fsync(directory)
+            except OSError:
+                pass
+            finally:
+                os.close(directory)
+
+        self.saved_position = position
+        if self.checkpoint_interval != None:
+            self.next_checkpoint = time.monotonic() + self.checkpoint_interval
+
+    def update_checkpoint(self):
+        # Save the checkpoint if it's due and anything has been read
+        if self.checkpoint_path != None and self.checkpoint_interval != None \
+            and self.checkpoint_position != self.saved_position \
+            and time.monotonic() >= self.next_checkpoint:
+            self.save_checkpoint(self.checkpoint_position)
+
+    ##########################################################################
+    # Following
+    ##########################################################################
+
+    def wait_for_data(self):
+
+        # At the end of the file, wait until it grows, returning False if
+        # the reader should stop, or True to read again. The file is
+        # reopened (and read from the start) if it's truncated or replaced.
+        if self.watcher == None:
+            self.watcher = FileWatcher(self.path)
+
+        idle_since = time.monotonic()
+        while not self.stopped:
+
+            self.update_checkpoint()
+
+            offset = self.stream.tell()
+            size = os.fstat(self.stream.fileno()).st_size
+            if size > offset:
+                return True
+            if size < offset or self.replaced():
+                self.reopen()
+                return True
+
+            if self.idle_timeout != None:
+                remaining = idle_since + self.idle_timeout - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.watcher.wait(min(self.poll_interval, remaining))
+            else:
+                self.watcher.wait(self.poll_interval)
+
+        return False
+
+    def replaced(self):
+        # Whether the path now refers to a different file
+        try:
+            state = os.stat(self.path)
+        except FileNotFoundError:
+            # e.g. between rotating and creating the new file
+            return False
+        return (state.st_dev, state.st_ino) != self.file_identity()
+
+    def reopen(self):
+        # Start again from the beginning of the file at the path
+        self.stream.close()
+        self.stream = open(self.path, "rb")
+        self.watcher.close()
+        self.watcher = FileWatcher(self.path)
+        self.position = self.checkpoint_position = 0
+        self.truncations += 1
+
+    def read_packets(self):
+
+        buffer = bytearray()
+        # Stream offset of the start of the buffer
+        buffer_offset = self.position
+        eof = False
+
+        try:
+            while not eof and not self.stopped:
+
+                chunk = self.stream.read(self.chunk_size)
+                if chunk:
+                    buffer += chunk
+                elif not self.follow:
+                    eof = True
+                else:
+                    stream = self.stream
+                    if not self.wait_for_data():
+                        break
+                    if self.stream is not stream:
+                        # Reopened, so anything held is from the old file
+                        buffer.clear()
+                        buffer_offset = 0
+                    continue
+
+                view = memoryview(buffer)
+                end = len(view)
+                idx = 0
+
+                try:
+                    # Need at least the length byte and C field to check a frame
+                    while end - idx >= 2:
+
+                        length = view[idx]
+
+                        if length < self.min_length or length > self.max_length \
+                            or (self.c_field != None and view[idx + 1] != self.c_field):
+                            # Not the start of a frame, so move on by one byte
+                            idx += 1
+                            self.bytes_skipped += 1
+                            continue
+
+                        frame_end = idx + 1 + length
+                        if frame_end > end:
+                            # Wait for the rest of the frame
+                            break
+
+                        if self.check_payload and (
+                            view[idx + 1 + self.control_field_offset], length - self.frame_overhead
+                        ) not in MBusPacket.PAYLOAD_TYPES:
+                            # Unknown payload, so not a frame after all
+                            idx += 1
+                            self.bytes_skipped += 1
+                            self.unknown_frames += 1
+                            continue
+
+                        try:
+                            packet = self.packet_class(
+                                bytes(view[idx + 1 : frame_end]), lazy = self.lazy
+                            )
+                        except ValueError:
+                            # Treat frames that fail to decode (including
+                            # InvalidPacketError) as noise
+                            idx += 1
+                            self.bytes_skipped += 1
+                            continue
+
+                        idx = frame_end
+                        self.position = buffer_offset + idx
+                        self.packets_read += 1
+
+                        yield packet
+
+                        # The caller is done with the packet
+                        self.checkpoint_position = self.position
+                        if self.stopped:
+                            break
+                        self.update_checkpoint()
+
+                finally:
+                    view.release()
+
+                # Drop everything that has been consumed and keep any partial
+                # frame at the end for the next chunk
+                del buffer[:idx]
+                buffer_offset += idx
+                self.position = self.checkpoint_position = buffer_offset
+
+        finally:
+            # Save how far we got, and close anything opened by the reader,
+            # even if iteration stops early
+            try:
+                if self.checkpoint_path != None and self.checkpoint_position != self.saved_position:
+                    self.save_checkpoint(self.checkpoint_position)
+            finally:
+                self.close()
+
+class FileWatcher:
+
+    # Waits for a file to change, using inotify on Linux (through ctypes, so
+    # there's nothing to install) and otherwise sleeping for the timeout
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    EVENTS = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self, path):
+        self.fd = None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+            # IN_NONBLOCK and IN_CLOEXEC are O_NONBLOCK and O_CLOEXEC
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, os.fsencode(path), FileWatcher.EVENTS) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError, TypeError):
+            # Not Linux, or no libc
+            pass
+
+    def wait(self, timeout):
+        if self.fd == None:
+            time.sleep(timeout)
+            return
+        import select
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            # Discard the events, as the file is checked anyway
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
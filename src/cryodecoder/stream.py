@@ -0,0 +1,298 @@
+from cryodecoder import Packet
+
+import collections
+import time
+
+##############################################################################
+# STREAM PROCESSING
+##############################################################################
+# Stages which sit inline in the ingest path, taking one packet at a time.
+# Packets may be MBusPackets or anything wrapping one as mbus_packet (e.g.
+# CryoReceiverPacket or SDSatellitePacket).
+
+# Number of distinct sequence numbers of each payload type, see
+# sequence_modulus
+SEQUENCE_MODULI = {}
+
+def sequence_modulus(payload_class):
+
+    # From the width of the sequence_number field of a payload type, or None
+    # if it doesn't have one
+    if payload_class not in SEQUENCE_MODULI:
+        packet_config = Packet.CONFIG.get(payload_class)
+        field_config = None if packet_config == None else packet_config.fields.get("sequence_number")
+        SEQUENCE_MODULI[payload_class] = None if field_config == None else 1 << (8 * field_config.length)
+    return SEQUENCE_MODULI[payload_class]
+
+def unwrap_sequence(last, sequence_number, modulus):
+    # Place a wrapped sequence number relative to the last unwrapped one,
+    # taking the nearest (so up to modulus / 2 behind or ahead)
+    delta = (sequence_number - last) % modulus
+    if delta >= modulus >> 1:
+        delta -= modulus
+    return last + delta
+
+class Deduplicator:
+
+    # Drops copies of the same MBusPacket heard by several receivers (or on
+    # both channels), keyed by (user_id, sequence number, payload hash).
+    # Sequence numbers are unwrapped per instrument, so that packets a
+    # whole sequence apart with the same payload aren't mistaken for copies.
+    #
+    # Each packet is held until it leaves the window, after max_entries
+    # newer packets or window seconds, and then the copy with the best RSSI
+    # is returned by push(). Packets which are views into a shared buffer
+    # (e.g. from SDArchive) should be copied before they're pushed.
+
+    MAX_ENTRIES_DEFAULT = 4096 # packets
+
+    def __init__(self, window = None, max_entries = None):
+
+        # Window in seconds (of the timestamps given to push), or None to
+        # only limit the number of packets held
+        self.window = window
+        self.max_entries = max_entries or Deduplicator.MAX_ENTRIES_DEFAULT
+        if self.max_entries < 1 or (window != None and window < 0):
+            raise ValueError("Window and max_entries should be positive")
+
+        # key -> [timestamp, rssi, packet], oldest first
+        self.entries = collections.OrderedDict()
+        # Last unwrapped sequence number of each instrument
+        self.sequences = {}
+
+        # Statistics
+        self.packets_in = 0
+        self.packets_out = 0
+        self.dropped = 0
+        self.replaced = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, mbus_packet):
+
+        user_id = mbus_packet.user_id
+        payload = mbus_packet.payload
+        if isinstance(payload, Packet):
+            raw = payload.raw
+            modulus = sequence_modulus(payload.__class__)
+        else:
+            # Unknown payload, left as raw bytes
+            raw = payload
+            modulus = None
+
+        sequence_number = None
+        if modulus != None:
+            sequence_number = payload.sequence_number
+            last = self.sequences.get(user_id)
+            if last != None:
+                sequence_number = unwrap_sequence(last, sequence_number, modulus)
+            # Late (or repeated) packets don't move an instrument back
+            if last == None or sequence_number > last:
+                self.sequences[user_id] = sequence_number
+
+        return (user_id, sequence_number, hash(bytes(raw)))
+
+    def push(self, packet, timestamp = None):
+
+        # Add a packet, returning a list of any packets which have left the
+        # window (usually none), oldest first
+        mbus_packet = getattr(packet, "mbus_packet", packet)
+        if timestamp == None:
+            timestamp = time.monotonic()
+        self.packets_in += 1
+
+        key = self.key(mbus_packet)
+        entry = self.entries.get(key)
+        if entry != None:
+            # A copy, so keep whichever was heard best
+            self.dropped += 1
+            rssi = mbus_packet.rssi
+            if rssi > entry[1]:
+                entry[1] = rssi
+                entry[2] = packet
+                self.replaced += 1
+            return []
+
+        self.entries[key] = [timestamp, mbus_packet.rssi, packet]
+        return self.expire(timestamp)
+
+    def expire(self, timestamp = None):
+
+        # Return packets which have left the window by timestamp (e.g. to
+        # emit packets when the stream is idle), oldest first
+        entries = self.entries
+        expired = []
+        while len(entries) > self.max_entries:
+            expired.append(entries.popitem(last = False)[1][2])
+
+        if self.window != None and entries:
+            if timestamp == None:
+                timestamp = time.monotonic()
+            oldest = timestamp - self.window
+            while entries and next(iter(entries.values()))[0] <= oldest:
+                expired.append(entries.popitem(last = False)[1][2])
+
+        self.packets_out += len(expired)
+        return expired
+
+    def flush(self):
+        # Return all packets held, oldest first
+        expired = [entry[2] for entry in self.entries.values()]
+        self.entries.clear()
+        self.packets_out += len(expired)
+        return expired
+
+    def process(self, packets):
+        # Deduplicate an iterable of packets, using arrival time
+        for packet in packets:
+            yield from self.push(packet)
+        yield from self.flush()
+
+    def __repr__(self):
+        return f"Deduplicator: {len(self.entries)} held, {self.dropped} dropped"
+
+class SequenceState:
+
+    # Sequence tracking state of one instrument (see SequenceTracker)
+    __slots__ = (
+        "last", "bitmap", "received", "missing", "duplicates", "out_of_order", "loss_rate"
+    )
+
+    def __init__(self, sequence_number):
+        # Last (highest) unwrapped sequence number, and which of the
+        # SequenceTracker.WINDOW sequence numbers up to it were received
+        # (bit n for last - n)
+        self.last = sequence_number
+        self.bitmap = 1
+        self.received = 1
+        self.missing = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        # Exponentially weighted fraction of packets lost
+        self.loss_rate = 0.0
+
+    @property
+    def expected(self):
+        return self.received + self.missing
+
+    @property
+    def loss(self):
+        # Fraction of packets lost since the first one received
+        return self.missing / self.expected
+
+    def __repr__(self):
+        return (
+            f"SequenceState: last={self.last}, received={self.received}, missing={self.missing}, "
+            f"duplicates={self.duplicates}, out_of_order={self.out_of_order}, loss_rate={self.loss_rate:.3f}"
+        )
+
+class SequenceTracker:
+
+    # Counts received, missing, duplicate and out of order packets for each
+    # instrument from their sequence numbers, which are unwrapped so that
+    # wrap-around isn't counted as a gap. Packets up to WINDOW sequence
+    # numbers late fill in the gap they were counted in, and are told apart
+    # from duplicates by a bitmap of the packets received. Older packets
+    # can't be checked, so are assumed to be late rather than duplicates.
+    #
+    # loss_rate is an exponentially weighted moving average over expected
+    # packets (1 for lost, 0 for received), with weight alpha.
+
+    WINDOW = 64 # sequence numbers
+    MASK = (1 << WINDOW) - 1
+    ALPHA_DEFAULT = 0.01
+
+    def __init__(self, alpha = None):
+        self.alpha = alpha or SequenceTracker.ALPHA_DEFAULT
+        if not 0 < self.alpha <= 1:
+            raise ValueError("alpha should be within (0, 1]")
+        # SequenceState of each user_id
+        self.instruments = {}
+
+    def update(self, packet):
+
+        # Add a packet, returning the number of packets found to be missing
+        # before it (0 if none, or if it has no sequence number)
+        mbus_packet = getattr(packet, "mbus_packet", packet)
+        payload = mbus_packet.payload
+        if not isinstance(payload, Packet):
+            return 0
+        modulus = sequence_modulus(payload.__class__)
+        if modulus == None:
+            return 0
+        return self.update_sequence(mbus_packet.user_id, payload.sequence_number, modulus)
+
+    def update_sequence(self, user_id, sequence_number, modulus = 256):
+
+        state = self.instruments.get(user_id)
+        if state == None:
+            self.instruments[user_id] = SequenceState(sequence_number)
+            return 0
+
+        alpha = self.alpha
+        sequence_number = unwrap_sequence(state.last, sequence_number, modulus)
+        delta = sequence_number - state.last
+
+        if delta > 0:
+            # Newer, after delta - 1 lost packets
+            missing = delta - 1
+            state.last = sequence_number
+            state.bitmap = ((state.bitmap << delta) | 1) & SequenceTracker.MASK
+            state.received += 1
+            state.missing += missing
+            # Apply the lost packets and then this one to the average
+            state.loss_rate = 1.0 - (1.0 - state.loss_rate) * (1.0 - alpha) ** missing
+            state.loss_rate *= 1.0 - alpha
+            return missing
+
+        age = -delta
+        if age < SequenceTracker.WINDOW:
+            bit = 1 << age
+            if state.bitmap & bit:
+                state.duplicates += 1
+                return 0
+            state.bitmap |= bit
+            # This packet was counted as lost age packets ago, which the
+            # average has decayed since
+            state.loss_rate = max(0.0, state.loss_rate - alpha * (1.0 - alpha) ** age)
+
+        # Late, so no longer missing
+        state.out_of_order += 1
+        state.received += 1
+        state.missing = max(0, state.missing - 1)
+        return 0
+
+    def process(self, packets):
+        # Track an iterable of packets, passing them through
+        for packet in packets:
+            self.update(packet)
+            yield packet
+
+    def __getitem__(self, user_id):
+        return self.instruments[user_id]
+
+    def __contains__(self, user_id):
+        return user_id in self.instruments
+
+    def __iter__(self):
+        return iter(self.instruments.items())
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def loss_rate(self, user_id):
+        return self.instruments[user_id].loss_rate
+
+    def totals(self):
+        # Counts summed over all instruments
+        totals = {"received" : 0, "missing" : 0, "duplicates" : 0, "out_of_order" : 0}
+        for state in self.instruments.values():
+            totals["received"] += state.received
+            totals["missing"] += state.missing
+            totals["duplicates"] += state.duplicates
+            totals["out_of_order"] += state.out_of_order
+        return totals
+
+    def __repr__(self):
+        return f"SequenceTracker: {len(self.instruments)} instruments"
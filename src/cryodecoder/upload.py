@@ -0,0 +1,304 @@
+from cryodecoder import Packet, Data, Record
+
+import gzip
+import http.client
+import json
+import math
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+##############################################################################
+# UPLOADER
+##############################################################################
+# Uploads Data objects and records to an external server. Records are queued
+# (blocking the caller when the queue is full) and a background thread sends
+# them in batches as gzipped JSON over a persistent HTTP connection:
+#
+#       {"records" : [{"type" : "CryoeggData", "user_id" : ..., "timestamp" : ..., <fields>}, ...]}
+#
+# Failed uploads are retried with exponential backoff, after which the batch
+# is spooled to disk and sent again once the server is reachable.
+
+class Uploader:
+
+    BATCH_SIZE_DEFAULT = 1000 # records
+    FLUSH_INTERVAL_DEFAULT = 5.0 # seconds
+    QUEUE_SIZE_DEFAULT = 10000 # records
+    RETRIES_DEFAULT = 5
+    BACKOFF_DEFAULT = 0.5 # seconds, doubled after each retry
+    BACKOFF_MAX = 30.0 # seconds
+    TIMEOUT_DEFAULT = 10.0 # seconds
+    SPOOL_SUFFIX = ".json.gz"
+
+    # Queue markers for the upload thread
+    FLUSH = object()
+    STOP = object()
+
+    def __init__(self,
+        url,
+        batch_size = None,
+        flush_interval = None,
+        queue_size = None,
+        retries = None,
+        backoff = None,
+        timeout = None,
+        spool_dir = None,
+        headers = None
+    ):
+        parsed_url = urllib.parse.urlsplit(url)
+        if parsed_url.scheme not in ("http", "https"):
+            raise ValueError("Upload URL should be http or https")
+        self.url = url
+        self.scheme = parsed_url.scheme
+        self.host = parsed_url.netloc
+        self.path = parsed_url.path or "/"
+        if parsed_url.query:
+            self.path += "?" + parsed_url.query
+
+        self.batch_size = batch_size or Uploader.BATCH_SIZE_DEFAULT
+        self.flush_interval = flush_interval or Uploader.FLUSH_INTERVAL_DEFAULT
+        self.retries = Uploader.RETRIES_DEFAULT if retries == None else retries
+        self.backoff = Uploader.BACKOFF_DEFAULT if backoff == None else backoff
+        self.timeout = timeout or Uploader.TIMEOUT_DEFAULT
+        self.headers = {
+            "Content-Type" : "application/json",
+            "Content-Encoding" : "gzip",
+        }
+        self.headers.update(headers or {})
+
+        # Batches which couldn't be uploaded are kept here, if given
+        self.spool_dir = spool_dir
+        if spool_dir != None:
+            os.makedirs(spool_dir, exist_ok = True)
+
+        # Fields of each Data type which are uploaded
+        self.data_fields = {}
+
+        # Statistics
+        self.records_sent = 0
+        self.batches_sent = 0
+        self.batches_spooled = 0
+        self.batches_rejected = 0
+        self.batches_dropped = 0
+        self.last_error = None
+
+        self.connection = None
+        self.closing = threading.Event()
+        self.queue = queue.Queue(queue_size or Uploader.QUEUE_SIZE_DEFAULT)
+        self.thread = threading.Thread(target = self.run, name = "cryodecoder-uploader", daemon = True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def put(self, values, user_id = None, timestamp = None, block = True, timeout = None):
+
+        # Queue a Data object, record or dict for upload. Blocks while the
+        # queue is full, unless block is False, in which case queue.Full is
+        # raised.
+        if self.closing.is_set():
+            raise ValueError("Uploader is closed")
+        self.queue.put(self.row(values, user_id, timestamp), block, timeout)
+
+    def row(self, values, user_id, timestamp):
+
+        # Convert to a JSON-compatible dict now, so that nothing (e.g. packet
+        # buffers) is kept alive by the queue
+        if isinstance(values, Record):
+            fields = values._asdict()
+            # NaN isn't valid JSON
+            for field, value in fields.items():
+                if math.isnan(value):
+                    fields[field] = None
+        elif isinstance(values, Data):
+            data_fields = self.data_fields.get(values.__class__)
+            if data_fields == None:
+                data_fields = self.data_fields[values.__class__] = [
+                    field for field, field_config
+                    in Packet.CONFIG[values.PACKET_CLASS].fields.items()
+                    if field_config.output_type != "bytes"
+                ]
+            fields = {field : getattr(values, field) for field in data_fields}
+        elif isinstance(values, dict):
+            fields = dict(values)
+        else:
+            raise TypeError("Can only upload Data objects, records or dicts")
+
+        row = {
+            "type" : values.__class__.__name__,
+            "user_id" : user_id,
+            "timestamp" : timestamp
+        }
+        row.update(fields)
+        return row
+
+    def flush(self):
+        # Wait until everything queued so far has been uploaded (or spooled)
+        self.queue.put(Uploader.FLUSH)
+        self.queue.join()
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+        self.flush()
+        # Don't retry any further once closing, just spool
+        self.closing.set()
+        self.queue.put(Uploader.STOP)
+        self.thread.join()
+
+    ##########################################################################
+    # Upload thread
+    ##########################################################################
+
+    def run(self):
+
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        try:
+            while True:
+
+                try:
+                    item = self.queue.get(timeout = max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    # Flush interval has passed
+                    item = None
+
+                if item is Uploader.STOP:
+                    self.queue.task_done()
+                    return
+
+                try:
+                    if item is Uploader.FLUSH or item is None:
+                        if batch:
+                            self.send_batch(batch)
+                        elif item is None:
+                            # Nothing new, so try to send anything spooled
+                            self.send_spool()
+                        batch = []
+                        deadline = time.monotonic() + self.flush_interval
+                    else:
+                        batch.append(item)
+                        if len(batch) >= self.batch_size:
+                            self.send_batch(batch)
+                            batch = []
+                            deadline = time.monotonic() + self.flush_interval
+                except Exception as error:
+                    # Keep the thread running (e.g. if the spool is full, or
+                    # a value can't be encoded), dropping the batch
+                    self.last_error = error
+                    self.batches_dropped += 1
+                    batch = []
+                finally:
+                    if item is not None:
+                        self.queue.task_done()
+        finally:
+            if self.connection != None:
+                self.connection.close()
+
+    def send_batch(self, batch):
+
+        payload = gzip.compress(
+            json.dumps({"records" : batch}, separators = (",", ":")).encode("utf-8")
+        )
+
+        status = self.send(payload)
+        if status != None:
+            if status < 300:
+                self.records_sent += len(batch)
+            # The server is reachable, so send anything spooled
+            self.send_spool()
+        elif self.spool_dir != None:
+            self.spool(payload)
+        else:
+            self.batches_dropped += 1
+
+    def send(self, payload, retries = None):
+
+        # Upload a payload, retrying with exponential backoff. Returns the
+        # HTTP status if the upload succeeded or was rejected by the server
+        # (in which case sending it again won't help), otherwise None.
+        retries = self.retries if retries == None else retries
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                status = self.post(payload)
+            except (OSError, http.client.HTTPException) as error:
+                status = None
+                self.last_error = error
+                # Reconnect on the next attempt
+                self.disconnect()
+
+            if status != None and 200 <= status < 300:
+                self.batches_sent += 1
+                return status
+            elif status != None and 400 <= status < 500:
+                self.batches_rejected += 1
+                self.last_error = f"Upload rejected with HTTP status {status}"
+                return status
+            elif status != None:
+                self.last_error = f"Upload failed with HTTP status {status}"
+
+            attempt += 1
+            if attempt > retries or self.closing.wait(delay):
+                return None
+            delay = min(2 * delay, Uploader.BACKOFF_MAX)
+
+    def post(self, payload):
+
+        # POST over the persistent connection, opening it if needed
+        if self.connection == None:
+            if self.scheme == "https":
+                self.connection = http.client.HTTPSConnection(self.host, timeout = self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(self.host, timeout = self.timeout)
+
+        self.connection.request("POST", self.path, body = payload, headers = self.headers)
+        response = self.connection.getresponse()
+        # Read the whole response so the connection can be reused
+        response.read()
+        if response.will_close:
+            self.disconnect()
+        return response.status
+
+    def disconnect(self):
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
+
+    def spool(self, payload):
+
+        # Write to a temporary file and rename, so that partially written
+        # files are never sent
+        path = os.path.join(self.spool_dir, f"{time.time_ns():020d}{Uploader.SPOOL_SUFFIX}")
+        with open(path + ".tmp", "wb") as spool_fh:
+            spool_fh.write(payload)
+        os.replace(path + ".tmp", path)
+        self.batches_spooled += 1
+
+    def spooled(self):
+        # Spooled payloads, oldest first
+        if self.spool_dir == None:
+            return []
+        return sorted(
+            os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir)
+            if name.endswith(Uploader.SPOOL_SUFFIX)
+        )
+
+    def send_spool(self):
+
+        for path in self.spooled():
+            with open(path, "rb") as spool_fh:
+                payload = spool_fh.read()
+            # Stop at the first failure, without retrying, and try again later
+            status = self.send(payload, retries = 0)
+            if status == None:
+                return
+            os.remove(path)
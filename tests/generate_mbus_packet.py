@@ -1,13 +1,21 @@
+import argparse
 import random
+import struct
+
+from cryodecoder import Packet, CryoeggPacket, CryowurstPacket, HydrobeanPacket
+
+##############################################################################
+# Single frames
+##############################################################################
 
 class FakeMBusPacket:
 
     @staticmethod
-    def to_bytes(payload):
+    def to_bytes(payload, control_field = 0x00, user_id = None, rng = random):
 
         # Total length is given by:
         #
-        #   length | 1 byte | 1 byte 
+        #   length | 1 byte | 1 byte
         #   c_field | 1 byte | 2 bytes
         #   m_field | 2 bytes | 4 bytes
         #   id_field | 4 bytes | 8 bytes
@@ -23,45 +31,436 @@ class FakeMBusPacket:
 
         # Create output
         output = bytearray(18 + len(payload))
-        
-        # Assign length
-        output[0] = len(output)
+
+        # Assign length, which doesn't include the length byte itself
+        output[0] = len(output) - 1
         # Assign c-field
         output[1] = 0x44
         # Assign m-field
-        output[2] = 0x48
-        output[3] = 0x24
+        output[2] = 0x24
+        output[3] = 0x48
         # Assign user id
-        output[4] = 0xCE
-        output[5] = 0x24
-        output[6] = 0x00
-        output[7] = random.randrange(0,100)
+        if user_id == None:
+            user_id = 0xCE240000 + rng.randrange(0, 100)
+        output[4:8] = user_id.to_bytes(4, "little")
         # Assign ver
         output[8] = 0x01
-        # Assign dev 
+        # Assign dev
         output[9] = 0x07
         # Assign ci-field
-        output[10] = 0x00
+        output[10] = control_field
         # Assign payload
-        output[11:len(payload)] = payload
+        output[11:11+len(payload)] = payload
         # Assign rssi
-        output[11+len(payload)] = random.randrange(-127, 30) & 0xff
+        output[11+len(payload)] = rng.randrange(-127, 30) & 0xff
         # Assign channel
-        output[12+len(payload)] = random.randrange(1,3)
+        output[12+len(payload)] = rng.randrange(1,3)
         # Assign temperature
-        output[13+len(payload)] = random.randrange(0, 256)
+        output[13+len(payload)] = rng.randrange(0, 256)
         # Assign pressure
-        output[14+len(payload)] = random.randrange(0, 256)
-        output[15+len(payload)] = random.randrange(0, 256)
+        output[14+len(payload)] = rng.randrange(0, 256)
+        output[15+len(payload)] = rng.randrange(0, 256)
         # Assign voltage
-        output[16+len(payload)] = random.randrange(0, 256)
-        output[17+len(payload)] = random.randrange(0, 256)
-        
+        output[16+len(payload)] = rng.randrange(0, 256)
+        output[17+len(payload)] = rng.randrange(0, 256)
+
         return output
 
-if __name__ == "__main__":
-    
-    with open("test/fake_mbus_packets.bin", 'wb') as fh:
+##############################################################################
+# Synthetic traffic
+##############################################################################
+# Generates a deterministic (for a given seed) stream of receiver frames or
+# SD records from a population of instruments, each with its own user_id and
+# sequence number, and with realistic raw payload values which drift around
+# a per-instrument level. Loss, duplication and corruption can be added to
+# test how decoders and sinks handle them.
+
+# Relative frequency of each instrument type
+INSTRUMENT_MIX_DEFAULT = {
+    CryoeggPacket : 0.5,
+    CryowurstPacket : 0.3,
+    HydrobeanPacket : 0.2,
+}
+
+# user_id prefix for each instrument type (docs/packet_types.md)
+USER_ID_PREFIX = {
+    CryoeggPacket : 0xCE220000,
+    CryowurstPacket : 0xCF200000,
+    HydrobeanPacket : 0xCB220000,
+}
+
+# Range of raw values for each payload field, with any field not listed here
+# taking the full range of its type
+FIELD_RANGES = {
+    CryoeggPacket : {
+        "conductivity" : (200, 3500), # mV
+        "temperature_pt1000" : (950, 1100),
+        "pressure" : (16384, 30000), # 0 to ~14 bar on a 30 bar sensor
+        "temperature" : (16000, 17500), # ~-2 to 3 degC
+        "battery_voltage" : (3000, 3700), # mV
+    },
+    CryowurstPacket : {
+        "temperature" : (-640, 640), # -5 to 5 degC
+        "magnetometer_x" : (-2000, 2000),
+        "magnetometer_y" : (-2000, 2000),
+        "magnetometer_z" : (-2000, 2000),
+        "accelerometer_x" : (-1000, 1000), # mg
+        "accelerometer_y" : (-1000, 1000),
+        "accelerometer_z" : (-1000, 1000),
+        "pitch_x" : (-900, 900), # 10 * degrees
+        "roll_y" : (-900, 900),
+        "conductivity" : (200, 3500),
+        "pressure" : (16384, 30000),
+        "battery_voltage" : (3000, 3700),
+    },
+    HydrobeanPacket : {
+        "conductivity" : (200, 3500),
+        "pressure" : (16384, 30000),
+        "temperature" : (16000, 17500),
+        "battery_voltage" : (3000, 3700),
+    },
+}
+
+# Relative size of the packet to packet variation in each field
+NOISE = 0.01
+
+SD_HEADER = b'W1'
+SD_RECORD = struct.Struct("<2sIffHBB")
+RECEIVER_TRAILER = struct.Struct("<BBHH")
+
+class PayloadLayout:
+
+    # Byte layout of the fields of a payload type, from its configuration
+    def __init__(self, packet_class):
+
+        config = Packet.CONFIG[packet_class]
+        self.packet_class = packet_class
+        self.size = packet_class.MIN_SIZE
+        self.control_field = config.control_field[0]
+        # (field, offset, length, byte order, signed, low, high)
+        self.fields = []
+        self.sequence = None
+
+        for field, field_config in config.fields.items():
+            length = field_config.length
+            byteorder = "big" if field_config.endianness == "big" else "little"
+            signed = bool(field_config.signed)
+            if signed:
+                limits = (-(1 << (8 * length - 1)), (1 << (8 * length - 1)) - 1)
+            else:
+                limits = (0, (1 << (8 * length)) - 1)
+            low, high = FIELD_RANGES.get(packet_class, {}).get(field, limits)
+            spec = (field, field_config.offset, length, byteorder, signed, low, high)
+            if field == "sequence_number":
+                self.sequence = spec
+            else:
+                self.fields.append(spec)
+
+class Instrument:
+
+    __slots__ = ("layout", "user_id", "sequence", "levels")
+
+    def __init__(self, layout, user_id, rng):
+        self.layout = layout
+        self.user_id = user_id
+        # Start part way through the sequence, so some instruments wrap early
+        self.sequence = rng.randrange(0, 1 << (8 * layout.sequence[2]))
+        # Level each field drifts around
+        self.levels = [rng.uniform(low, high) for _, _, _, _, _, low, high in layout.fields]
+
+    def payload(self, rng):
+
+        layout = self.layout
+        payload = bytearray(layout.size)
+
+        for i, (_, offset, length, byteorder, signed, low, high) in enumerate(layout.fields):
+            # Random walk within the field's range
+            level = self.levels[i] + rng.gauss(0, NOISE * (high - low))
+            level = min(max(level, low), high)
+            self.levels[i] = level
+            payload[offset : offset + length] = \
+                int(level).to_bytes(length, byteorder, signed = signed)
+
+        _, offset, length, byteorder, _, _, _ = layout.sequence
+        payload[offset : offset + length] = self.sequence.to_bytes(length, byteorder)
+        # Wrap at the width of the sequence number field
+        self.sequence = (self.sequence + 1) % (1 << (8 * length))
+
+        return payload
+
+class TrafficGenerator:
+
+    def __init__(self,
+        seed = 0,
+        instruments = 100,
+        mix = None,
+        loss = 0.0,
+        duplication = 0.0,
+        corruption = 0.0,
+        start_time = 1700000000,
+        interval = 1.0
+    ):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.duplication = duplication
+        self.corruption = corruption
+        # SD timestamps advance by interval seconds for each packet
+        self.timestamp = float(start_time)
+        self.interval = interval
+
+        mix = mix or INSTRUMENT_MIX_DEFAULT
+        self.layouts = {packet_class : PayloadLayout(packet_class) for packet_class in mix}
+
+        # Share the instruments out between types according to the mix
+        total = sum(mix.values())
+        self.instruments = []
+        for packet_class, weight in mix.items():
+            for i in range(max(1, round(instruments * weight / total))):
+                self.instruments.append(Instrument(
+                    self.layouts[packet_class], USER_ID_PREFIX[packet_class] + i + 1, self.rng
+                ))
+
+        # Statistics
+        self.packets_lost = 0
+        self.packets_duplicated = 0
+        self.packets_corrupted = 0
+
+    def mbus_frame(self, instrument):
+        # M-Bus frame (without the length byte)
+        return b''.join((
+            b'\x44\x24\x48',
+            instrument.user_id.to_bytes(4, "little"),
+            b'\x01\x07',
+            bytes([instrument.layout.control_field]),
+            instrument.payload(self.rng),
+            bytes([self.rng.randrange(-110, -40) & 0xff])
+        ))
 
-        for k in range(10):
-            fh.write(FakeMBusPacket.to_bytes(bytearray()))
\ No newline at end of file
+    def receiver_frame(self, instrument):
+        frame = self.mbus_frame(instrument) + RECEIVER_TRAILER.pack(
+            self.rng.randrange(1, 3),
+            self.rng.randrange(0, 40),
+            self.rng.randrange(9800, 10300), # mbar / 10
+            self.rng.randrange(11000, 14000) # mV
+        )
+        return bytes([len(frame)]) + frame
+
+    def sd_record(self, instrument):
+        frame = self.mbus_frame(instrument)
+        self.timestamp += self.interval
+        return SD_RECORD.pack(
+            SD_HEADER,
+            int(self.timestamp),
+            self.rng.uniform(-20, 30),
+            self.rng.uniform(980, 1030),
+            self.rng.randrange(11000, 14000),
+            self.rng.randrange(1, 3),
+            len(frame)
+        ) + frame
+
+    def corrupt(self, frame, start):
+        # Flip the bits of a random byte, leaving the framing (before start)
+        frame = bytearray(frame)
+        frame[self.rng.randrange(start, len(frame))] ^= self.rng.randrange(1, 256)
+        return bytes(frame)
+
+    def frames(self, count, file_format = "receiver"):
+
+        # Yield count frames (receiver) or records (SD), including any
+        # duplicates but not lost packets
+        if file_format == "receiver":
+            make_frame = self.receiver_frame
+            # Keep the length byte and C field, which the reader uses to
+            # find frames
+            start = 2
+        elif file_format == "sd":
+            make_frame = self.sd_record
+            # SD archives have no resynchronisation, so keep the length byte
+            start = SD_RECORD.size
+        else:
+            raise ValueError("File format should be 'receiver' or 'sd'")
+
+        rng = self.rng
+        instruments = self.instruments
+        emitted = 0
+
+        while emitted < count:
+            frame = make_frame(rng.choice(instruments))
+            if rng.random() < self.loss:
+                self.packets_lost += 1
+                continue
+            if rng.random() < self.corruption:
+                frame = self.corrupt(frame, start)
+                self.packets_corrupted += 1
+            yield frame
+            emitted += 1
+            if emitted < count and rng.random() < self.duplication:
+                yield frame
+                emitted += 1
+                self.packets_duplicated += 1
+
+    def write(self, output_fh, count, file_format = "receiver", chunk_size = 10000):
+        # Write in chunks of frames to keep the number of writes down
+        frames = self.frames(count, file_format)
+        while True:
+            chunk = [frame for _, frame in zip(range(chunk_size), frames)]
+            if not chunk:
+                break
+            output_fh.write(b''.join(chunk))
+
+    def generate_numpy(self, count, file_format = "receiver"):
+
+        # Vectorised equivalent of frames(), returning the whole stream as
+        # bytes. Instruments are drawn from the same population, but values
+        # come from a NumPy generator so streams differ from frames().
+        import numpy as np
+
+        rng = np.random.default_rng(self.seed)
+        instruments = self.instruments
+
+        # Choose an instrument for each packet, mark lost packets and
+        # duplicates, then keep only the packets needed for count frames
+        choice = rng.integers(0, len(instruments), count + int(count * self.loss * 2) + 16)
+        kept = np.flatnonzero(rng.random(len(choice)) >= self.loss)
+        repeats = 1 + (rng.random(len(kept)) < self.duplication)
+        used = 0 if count == 0 else min(int(np.searchsorted(np.cumsum(repeats), count)) + 1, len(kept))
+        kept, repeats = kept[:used], repeats[:used]
+        drawn = int(kept[-1]) + 1 if used else 0
+        choice = choice[:drawn]
+
+        # Assign sequence numbers before dropping lost packets, so that they
+        # leave gaps, and only advance instruments by the packets drawn
+        sequence = np.zeros(drawn, dtype = np.int64)
+        for index, instrument in enumerate(instruments):
+            mask = choice == index
+            sequence[mask] = instrument.sequence + np.arange(mask.sum())
+            instrument.sequence = (instrument.sequence + int(mask.sum())) % (1 << (8 * instrument.layout.sequence[2]))
+        self.packets_lost += drawn - used
+
+        # Duplicate packets in place, then trim back to count
+        choice = np.repeat(choice[kept], repeats)[:count]
+        sequence = np.repeat(sequence[kept], repeats)[:count]
+        self.packets_duplicated += len(choice) - used
+        count = len(choice)
+
+        if file_format == "receiver":
+            header_size, trailer_size, start = 1, RECEIVER_TRAILER.size, 2
+        elif file_format == "sd":
+            header_size, trailer_size, start = SD_RECORD.size, 0, SD_RECORD.size
+        else:
+            raise ValueError("File format should be 'receiver' or 'sd'")
+
+        # Frame length for each packet, and where each one starts
+        payload_sizes = np.array([instrument.layout.size for instrument in instruments])
+        mbus_sizes = 11 + payload_sizes[choice]
+        sizes = header_size + mbus_sizes + trailer_size
+        offsets = np.zeros(count, dtype = np.int64)
+        np.cumsum(sizes[:-1], out = offsets[1:])
+        output = np.zeros(int(sizes.sum()), dtype = np.uint8)
+
+        def put(position, values, length, byteorder = "<", signed = False):
+            # Write integer values of the given width at each position
+            dtype = np.dtype(f"{byteorder}{'i' if signed else 'u'}{length}")
+            columns = np.asarray(values).astype(dtype).view(np.uint8).reshape(-1, length)
+            for i in range(length):
+                output[position + i] = columns[:, i]
+
+        # Receiver length byte or SD header
+        if file_format == "receiver":
+            put(offsets, sizes - 1, 1)
+        else:
+            timestamps = self.timestamp + self.interval * np.arange(1, count + 1)
+            self.timestamp = float(timestamps[-1]) if count else self.timestamp
+            put(offsets, np.full(count, SD_HEADER[0]), 1)
+            put(offsets + 1, np.full(count, SD_HEADER[1]), 1)
+            put(offsets + 2, timestamps.astype(np.int64), 4)
+            put(offsets + 6, rng.uniform(-20, 30, count).astype("<f4").view("<u4"), 4)
+            put(offsets + 10, rng.uniform(980, 1030, count).astype("<f4").view("<u4"), 4)
+            put(offsets + 14, rng.integers(11000, 14000, count), 2)
+            put(offsets + 16, rng.integers(1, 3, count), 1)
+            put(offsets + 17, mbus_sizes, 1)
+
+        # M-Bus header
+        mbus = offsets + header_size
+        user_ids = np.array([instrument.user_id for instrument in instruments])
+        control_fields = np.array([instrument.layout.control_field for instrument in instruments])
+        put(mbus, np.full(count, 0x44), 1)
+        put(mbus + 1, np.full(count, 0x4824), 2)
+        put(mbus + 3, user_ids[choice], 4)
+        put(mbus + 7, np.full(count, 0x01), 1)
+        put(mbus + 8, np.full(count, 0x07), 1)
+        put(mbus + 9, control_fields[choice], 1)
+
+        # Payloads, for each instrument type
+        payload = mbus + 10
+        for layout in self.layouts.values():
+            members = np.array([i for i, instrument in enumerate(instruments) if instrument.layout is layout])
+            rows = np.isin(choice, members)
+            n = int(rows.sum())
+            if n == 0:
+                continue
+            # Per instrument level for each field, plus packet to packet noise
+            levels = np.array([instruments[i].levels for i in choice[rows]])
+            for j, (_, offset, length, byteorder, signed, low, high) in enumerate(layout.fields):
+                values = levels[:, j] + rng.normal(0, NOISE * (high - low), n)
+                put(payload[rows] + offset, np.clip(values, low, high).astype(np.int64),
+                    length, ">" if byteorder == "big" else "<", signed)
+            _, offset, length, byteorder, _, _, _ = layout.sequence
+            put(payload[rows] + offset, sequence[rows] % (1 << (8 * length)),
+                length, ">" if byteorder == "big" else "<")
+
+        # RSSI, then the receiver fields
+        rssi = payload + payload_sizes[choice]
+        put(rssi, rng.integers(-110, -40, count), 1, signed = True)
+        if file_format == "receiver":
+            put(rssi + 1, rng.integers(1, 3, count), 1)
+            put(rssi + 2, rng.integers(0, 40, count), 1)
+            put(rssi + 3, rng.integers(9800, 10300, count), 2)
+            put(rssi + 5, rng.integers(11000, 14000, count), 2)
+
+        # Corrupt a random byte of some frames, after any framing
+        corrupted = np.flatnonzero(rng.random(count) < self.corruption)
+        self.packets_corrupted += len(corrupted)
+        positions = offsets[corrupted] + start + \
+            (rng.random(len(corrupted)) * (sizes[corrupted] - start)).astype(np.int64)
+        output[positions] ^= rng.integers(1, 256, len(corrupted)).astype(np.uint8)
+
+        return output.tobytes()
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Generate synthetic Cryo* receiver or SD traffic.")
+    parser.add_argument("output", help = "Output file")
+    parser.add_argument("-n", "--count", type = int, default = 100000, help = "Number of frames")
+    parser.add_argument("-f", "--format", choices = ("receiver", "sd"), default = "receiver")
+    parser.add_argument("-s", "--seed", type = int, default = 0)
+    parser.add_argument("-i", "--instruments", type = int, default = 100, help = "Number of instruments (user_ids)")
+    parser.add_argument("--loss", type = float, default = 0.0, help = "Fraction of packets lost")
+    parser.add_argument("--duplication", type = float, default = 0.0, help = "Fraction of packets duplicated")
+    parser.add_argument("--corruption", type = float, default = 0.0, help = "Fraction of packets corrupted")
+    parser.add_argument("--numpy", action = "store_true", help = "Use vectorised (NumPy) generation")
+    args = parser.parse_args(argv)
+
+    generator = TrafficGenerator(
+        seed = args.seed,
+        instruments = args.instruments,
+        loss = args.loss,
+        duplication = args.duplication,
+        corruption = args.corruption
+    )
+
+    with open(args.output, "wb") as output_fh:
+        if args.numpy:
+            # Generate in blocks to bound memory use
+            remaining = args.count
+            while remaining > 0:
+                block = min(remaining, 1000000)
+                output_fh.write(generator.generate_numpy(block, args.format))
+                generator.seed += 1
+                remaining -= block
+        else:
+            generator.write(output_fh, args.count, args.format)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import math
+
+import pytest
+import cryodecoder
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+
+RECORD = cryodecoder.CryoeggPacket.RECORD
+
+def record(pressure, temperature = 0.0):
+    return RECORD(1.0, 20.0, pressure, temperature, 3.6, 0)
+
+def test_aggregator_windows():
+
+    aggregator = cryodecoder.Aggregator(windows = (60, 3600), fields = ("pressure",))
+
+    closed = []
+    for timestamp, pressure in ((0, 1.0), (30, 3.0), (59, 2.0), (61, 10.0)):
+        closed += aggregator.push(record(pressure), timestamp, user_id = 1)
+
+    # The first minute closes once a sample is past it
+    assert closed == [cryodecoder.WindowAggregate(1, "pressure", 60, 0, 3, 6.0, 1.0, 3.0)]
+    assert closed[0].mean == 2.0 and closed[0].end == 60
+    assert len(aggregator) == 2
+
+    closed = aggregator.flush()
+    assert [(aggregate.window, aggregate.start, aggregate.count) for aggregate in closed] == [(60, 60, 1), (3600, 0, 4)]
+    assert closed[1].min == 1.0 and closed[1].max == 10.0
+    assert len(aggregator) == 0
+
+def test_aggregator_instruments_and_fields():
+
+    aggregator = cryodecoder.Aggregator(windows = (60,))
+    aggregator.push(record(1.0, 5.0), 0, user_id = 1)
+    aggregator.push(record(2.0, math.nan), 10, user_id = 2)
+    closed = aggregator.flush()
+
+    # Measurements only, and missing values are skipped
+    assert {(aggregate.user_id, aggregate.field) for aggregate in closed} == {
+        (1, "conductivity"), (1, "temperature_pt1000"), (1, "pressure"), (1, "temperature"), (1, "battery_voltage"),
+        (2, "conductivity"), (2, "temperature_pt1000"), (2, "pressure"), (2, "battery_voltage"),
+    }
+
+    # Data objects give the same aggregates as their records
+    data = cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA))
+    from_data = cryodecoder.Aggregator(windows = (60,))
+    from_record = cryodecoder.Aggregator(windows = (60,))
+    from_data.push(data, 0)
+    from_record.push(data.to_record(), 0)
+    assert from_data.flush() == from_record.flush()
+
+    with pytest.raises(TypeError):
+        aggregator.push((1.0, 2.0), 0)
+    with pytest.raises(ValueError):
+        cryodecoder.Aggregator(windows = (0,))
+
+def test_aggregator_lateness():
+
+    aggregator = cryodecoder.Aggregator(windows = (60,), fields = ("pressure",), lateness = 30)
+    aggregator.push(record(1.0), 50, user_id = 1)
+    # Within the lateness, so the first minute is still open
+    assert aggregator.push(record(2.0), 70, user_id = 1) == []
+    assert aggregator.push(record(3.0), 55, user_id = 1) == []
+
+    closed = aggregator.push(record(4.0), 95, user_id = 1)
+    assert [(aggregate.start, aggregate.count, aggregate.sum) for aggregate in closed] == [(0, 2, 4.0)]
+
+    # Too late
+    assert aggregator.push(record(5.0), 10, user_id = 1) == []
+    assert aggregator.late == 1
+
+    # Quiet instruments are closed by an explicit watermark
+    closed = aggregator.expire(1000)
+    assert [(aggregate.start, aggregate.count) for aggregate in closed] == [(60, 2)]
+
+def test_aggregator_max_open():
+
+    aggregator = cryodecoder.Aggregator(windows = (60,), max_open = 10)
+    for user_id in range(100):
+        aggregator.push(record(1.0), 0, user_id = user_id)
+        assert len(aggregator) <= 10
+    assert aggregator.closed == 90
+
+def test_aggregator_process():
+
+    samples = [(record(float(timestamp)), timestamp, timestamp % 3) for timestamp in range(0, 7200, 10)]
+    aggregates = list(cryodecoder.Aggregator(windows = (60, 3600), fields = ("pressure",)).process(samples))
+
+    # Every sample counted once per window length
+    for window in (60, 3600):
+        assert sum(aggregate.count for aggregate in aggregates if aggregate.window == window) == len(samples)
+    assert sum(aggregate.sum for aggregate in aggregates if aggregate.window == 3600) == sum(range(0, 7200, 10))
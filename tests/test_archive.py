@@ -0,0 +1,168 @@
+import pytest
+import cryodecoder
+
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+SD_PACKET_DATA_LONG = bytes.fromhex("573184aad764b82c4a41a4025b44920c0124440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe9e573184aad764b82c4a41a4025b44920c0224440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe94")
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = tmp_path / "archive.bin"
+    # Four records, followed by a truncated fifth record
+    path.write_bytes(SD_PACKET_DATA + SD_PACKET_DATA_LONG + SD_PACKET_DATA + SD_PACKET_DATA[:20])
+    return path
+
+def test_sdarchive_length(archive_path):
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        assert len(archive) == 4
+        assert archive[1].channel == 1
+        assert archive[2].channel == 2
+
+def test_sdarchive_lazy_scan(archive_path):
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        packet = archive[0]
+        # Only the first record should have been located
+        assert len(archive.offsets) == 1
+        assert packet.mbus_packet.user_id == 0xCF200001
+
+def test_sdarchive_indexing(archive_path):
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        assert archive[-1] == cryodecoder.SDSatellitePacket(SD_PACKET_DATA)
+        with pytest.raises(IndexError):
+            archive[4]
+        with pytest.raises(IndexError):
+            archive[-5]
+
+def test_sdarchive_slicing(archive_path):
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        view = archive[1:3]
+        assert len(view) == 2
+        assert len(archive.offsets) == 3
+        assert [packet.channel for packet in view] == [1, 2]
+        assert view[-1] == archive[2]
+        assert len(archive[::-1]) == 4
+
+def test_sdarchive_iteration(archive_path):
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        packets = list(archive)
+        assert len(packets) == 4
+        assert all(isinstance(p.mbus_packet.payload, cryodecoder.CryowurstPacket) for p in packets)
+
+def test_sdarchive_empty(tmp_path):
+
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+
+    with cryodecoder.SDArchive(path) as archive:
+        assert len(archive) == 0
+        assert list(archive) == []
+
+##############################################################################
+# Sidecar index
+##############################################################################
+
+def sd_record(timestamp, channel, user_id):
+    # Patch the timestamp, channel and M-Bus user_id of a real record
+    record = bytearray(SD_PACKET_DATA)
+    record[2:6] = timestamp.to_bytes(4, "little")
+    record[16] = channel
+    record[21:25] = user_id.to_bytes(4, "little")
+    return bytes(record)
+
+def test_sdarchiveindex_build(tmp_path):
+
+    path = tmp_path / "archive.bin"
+    path.write_bytes(b"".join(
+        sd_record(1000 + i, 1 + i % 2, 0xCF200001 + i % 3) for i in range(30)
+    ))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        index = archive.index
+        assert len(index) == 30
+        assert list(index.timestamps) == list(range(1000, 1030))
+        assert index.user_ids[4] == 0xCF200002
+        assert index.channels[3] == 2
+        assert archive[5].timestamp == 1005
+
+    assert (tmp_path / "archive.bin.idx").exists()
+
+def test_sdarchiveindex_select(tmp_path):
+
+    path = tmp_path / "archive.bin"
+    path.write_bytes(b"".join(
+        sd_record(1000 + i, 1, 0xCF200001 + i % 3) for i in range(30)
+    ))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+
+        in_range = archive.select(start = 1010, end = 1014)
+        assert [p.timestamp for p in in_range] == [1010, 1011, 1012, 1013, 1014]
+
+        by_user = archive.select(user_id = 0xCF200002)
+        assert len(by_user) == 10
+        assert all(p.mbus_packet.user_id == 0xCF200002 for p in by_user)
+
+        both = archive.select(user_id = 0xCF200001, start = 1010, end = 1020)
+        assert [p.timestamp for p in both] == [1012, 1015, 1018]
+
+        assert len(archive.select(user_id = 0x12345678)) == 0
+
+def test_sdarchiveindex_incremental(tmp_path):
+
+    path = tmp_path / "archive.bin"
+    path.write_bytes(b"".join(sd_record(i, 1, 0xCF200001) for i in range(10)))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert len(archive) == 10
+
+    # Grow the archive, including a partial record
+    with open(path, "ab") as fh:
+        fh.write(b"".join(sd_record(i, 1, 0xCF200002) for i in range(10, 15)))
+        fh.write(sd_record(15, 1, 0xCF200002)[:10])
+
+    index_size = (tmp_path / "archive.bin.idx").stat().st_size
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert len(archive) == 15
+        assert list(archive.index.timestamps) == list(range(15))
+
+    # New records should have been appended rather than rewriting the index
+    assert (tmp_path / "archive.bin.idx").stat().st_size > index_size
+    index = cryodecoder.SDArchiveIndex(str(tmp_path / "archive.bin.idx"))
+    assert index.load()
+    assert len(index) == 15
+
+def test_sdarchiveindex_rebuild_on_change(tmp_path):
+
+    path = tmp_path / "archive.bin"
+    path.write_bytes(b"".join(sd_record(i, 1, 0xCF200001) for i in range(10)))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert len(archive) == 10
+
+    # Rewrite the archive with different contents of the same size
+    path.write_bytes(b"".join(sd_record(100 + i, 1, 0xCF200001) for i in range(10)))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert list(archive.index.timestamps) == list(range(100, 110))
+
+def test_sdarchiveindex_rebuild_on_edit(tmp_path):
+
+    path = tmp_path / "archive.bin"
+    records = [sd_record(i, 1, 0xCF200001) for i in range(2000)]
+    path.write_bytes(b"".join(records))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert archive.index.timestamps[0] == 0
+
+    # Edit the first record in place, well before the end of the archive
+    with open(path, "r+b") as fh:
+        fh.write(sd_record(5000, 1, 0xCF200001))
+
+    with cryodecoder.SDArchive(path, index = True) as archive:
+        assert archive.index.timestamps[0] == 5000
+        assert len(archive) == 2000
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+import cryodecoder
+
+np = pytest.importorskip("numpy")
+from cryodecoder.batch import packet_dtype, decode_batch
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+VALID_CRYOWURST_DATA = bytes.fromhex("010a00610137004a002d00e6fc35001a0085047f00000dc6f8")
+
+def random_frames(packet_class, count, seed = 0):
+    rng = random.Random(seed)
+    return [
+        bytes(rng.randrange(256) for _ in range(packet_class.MIN_SIZE))
+        for _ in range(count)
+    ]
+
+def test_packet_dtype_cryowurst():
+
+    dtype = packet_dtype(cryodecoder.CryowurstPacket)
+
+    assert dtype.itemsize == 25
+    assert dtype.fields["temperature"][0] == np.dtype(">i2")
+    assert dtype.fields["conductivity"][0] == np.dtype(">u2")
+    assert dtype.fields["sequence_number"][0] == np.dtype("u1")
+
+@pytest.mark.parametrize("packet_class", [
+    cryodecoder.CryoeggPacket,
+    cryodecoder.CryowurstPacket,
+    cryodecoder.HydrobeanPacket,
+])
+def test_decode_batch_matches_packets(packet_class):
+
+    frames = random_frames(packet_class, 200)
+    columns = decode_batch(packet_class, b"".join(frames))
+
+    for i, frame in enumerate(frames):
+        packet = packet_class(frame)
+        for field in columns:
+            assert columns[field][i] == getattr(packet, field)
+
+def test_decode_batch_frame_list():
+
+    columns = decode_batch(
+        cryodecoder.CryoeggPacket,
+        [VALID_CRYOEGG_DATA, cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)]
+    )
+
+    assert list(columns["conductivity"]) == [0x0FA0, 0x0FA0]
+    assert columns["conductivity"].dtype.isnative
+
+def test_decode_batch_invalid_length():
+
+    with pytest.raises(ValueError):
+        decode_batch(cryodecoder.CryoeggPacket, VALID_CRYOEGG_DATA + b'\x00')
+
+    with pytest.raises(ValueError):
+        decode_batch(cryodecoder.CryowurstPacket, [VALID_CRYOWURST_DATA[:-1]])
+
+def test_decode_batch_variable_packet():
+
+    with pytest.raises(ValueError, match = r".*not a fixed size packet.*"):
+        packet_dtype(cryodecoder.MBusPacket)
@@ -0,0 +1,116 @@
+import io
+
+import pytest
+import cryodecoder
+
+import generate_mbus_packet
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+VALID_CRYOWURST_DATA = bytes.fromhex("010a00610137004a002d00e6fc35001a0085047f00000dc6f8")
+MBUS_HEADER = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07'
+RECEIVER_TRAILER = b'\x01\x25\x4C\x27\xE0\x2E'
+SD_HEADER = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124")
+
+def receiver_frame(payload, control_field = 0xAA, trailer = RECEIVER_TRAILER):
+    frame = MBUS_HEADER + bytes([control_field]) + payload + b'\x5A' + trailer
+    return bytes([len(frame)]) + frame
+
+def sd_record(payload, control_field = 0xAA, header = SD_HEADER):
+    frame = MBUS_HEADER + bytes([control_field]) + payload + b'\x5A'
+    return header[:-1] + bytes([len(frame)]) + frame
+
+def generated(file_format, count, **kwargs):
+    output_fh = io.BytesIO()
+    generate_mbus_packet.TrafficGenerator(seed = 1, **kwargs).write(output_fh, count, file_format)
+    return output_fh.getvalue()
+
+def test_invalid_packet_error():
+
+    # Still a ValueError, with a reason
+    with pytest.raises(ValueError):
+        cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA[:5])
+    with pytest.raises(cryodecoder.InvalidPacketError) as error:
+        cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA + b'\x00')
+    assert error.value.reason == cryodecoder.ErrorReason.TOO_LONG
+
+    packet = cryodecoder.CryoReceiverPacket(receiver_frame(VALID_CRYOEGG_DATA, trailer = b'\x03' + RECEIVER_TRAILER[1:])[1:])
+    with pytest.raises(cryodecoder.InvalidPacketError) as error:
+        cryodecoder.CryoReceiverData(packet)
+    assert error.value.reason == cryodecoder.ErrorReason.INVALID_CHANNEL
+
+def test_decode_bulk_receiver():
+
+    stream = b''.join([
+        receiver_frame(VALID_CRYOEGG_DATA),
+        b'\x00\x01\x02',
+        receiver_frame(VALID_CRYOWURST_DATA, control_field = 0xAC),
+        receiver_frame(VALID_CRYOEGG_DATA, control_field = 0x12),
+        receiver_frame(VALID_CRYOEGG_DATA, trailer = b'\x03' + RECEIVER_TRAILER[1:]),
+        # Magnetometer x out of range
+        receiver_frame(VALID_CRYOWURST_DATA[:2] + b'\x7f\xff' + VALID_CRYOWURST_DATA[4:], control_field = 0xAC),
+        receiver_frame(VALID_CRYOEGG_DATA)[:10],
+    ])
+    records, errors = cryodecoder.decode_bulk(stream, cryodecoder.CryoReceiverPacket)
+
+    frame_size = len(receiver_frame(VALID_CRYOEGG_DATA))
+    assert [(record.offset, record.user_id, record.timestamp) for record in records] == [(0, 0xCE240002, None), (frame_size + 3, 0xCE240002, None)]
+    assert records[0].record == cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)).to_record()
+    assert isinstance(records[1].record, cryodecoder.CryowurstPacket.RECORD)
+
+    # A frame with an unknown payload is just noise, as there are no
+    # record boundaries to skip to
+    assert [(error.packet_class, error.reason) for error in errors] == [
+        (cryodecoder.CryoReceiverPacket, cryodecoder.ErrorReason.NOISE),
+        (cryodecoder.CryoReceiverPacket, cryodecoder.ErrorReason.NOISE),
+        (cryodecoder.CryoReceiverData, cryodecoder.ErrorReason.INVALID_CHANNEL),
+        (cryodecoder.CryowurstData, cryodecoder.ErrorReason.OUT_OF_RANGE),
+        (cryodecoder.CryoReceiverPacket, cryodecoder.ErrorReason.TRUNCATED),
+    ]
+    assert errors[0].offset == frame_size
+
+def test_decode_bulk_receiver_false_frame_start():
+
+    # Noise which looks like a frame start shouldn't swallow the frame after it
+    stream = b'\x14\x44' + receiver_frame(VALID_CRYOEGG_DATA) * 5
+    records, errors = cryodecoder.decode_bulk(stream, cryodecoder.CryoReceiverPacket)
+
+    assert [record.offset for record in records] == [2 + i * len(receiver_frame(VALID_CRYOEGG_DATA)) for i in range(5)]
+    assert [tuple(error) for error in errors] == [(0, cryodecoder.CryoReceiverPacket, cryodecoder.ErrorReason.NOISE)]
+
+def test_decode_bulk_archive(tmp_path):
+
+    archive = b''.join([
+        sd_record(VALID_CRYOEGG_DATA),
+        sd_record(VALID_CRYOEGG_DATA, header = b'\xff' + SD_HEADER[1:]),
+        sd_record(VALID_CRYOEGG_DATA, control_field = 0x12),
+        sd_record(VALID_CRYOEGG_DATA)[:-3],
+    ])
+    path = tmp_path / "archive.bin"
+    path.write_bytes(archive)
+
+    records, errors = cryodecoder.decode_bulk(path)
+    packet = cryodecoder.SDSatellitePacket(sd_record(VALID_CRYOEGG_DATA))
+    assert [(record.offset, record.user_id, record.timestamp) for record in records] == [(0, 0xCE240002, packet.timestamp)]
+    assert [error.reason for error in errors] == [
+        cryodecoder.ErrorReason.INVALID_HEADER, cryodecoder.ErrorReason.UNKNOWN_PAYLOAD, cryodecoder.ErrorReason.TRUNCATED
+    ]
+
+    with pytest.raises(ValueError):
+        cryodecoder.BulkDecoder(cryodecoder.MBusPacket)
+
+@pytest.mark.parametrize("file_format", ["sd", "receiver"])
+def test_decode_bulk_generated(file_format):
+
+    packet_class = cryodecoder.SDSatellitePacket if file_format == "sd" else cryodecoder.CryoReceiverPacket
+
+    # Clean traffic decodes to the same payloads as reading it packet by packet
+    data = generated(file_format, 500)
+    records, errors = cryodecoder.decode_bulk(data, packet_class)
+    assert len(records) == 500 and errors == []
+
+    # and corrupt traffic never raises
+    decoder = cryodecoder.BulkDecoder(packet_class)
+    records, errors = decoder.decode(generated(file_format, 500, corruption = 0.5))
+    assert len(records) + len(errors) >= 500
+    assert len(errors) > 0
+    assert decoder.frames == len(records) and sum(decoder.errors.values()) == len(errors)
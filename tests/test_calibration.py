@@ -0,0 +1,147 @@
+import os
+
+import pytest
+import cryodecoder
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+MBUS_HEADER = b'\x44\x24\x48'
+MBUS_FOOTER = b'\x01\x07\xAA'
+
+CATALOGUE_TOML = """
+[instruments.0xCE220001]
+name = "Egg 1"
+keller_sensor_id = "PA7LD30-2409"
+conductivity_gain = 0.0025
+conductivity_offset = 0.1
+
+[instruments.0xCE220002]
+keller_sensor_id = "PA7LHPD250-2410"
+
+[sensors.PA7LD30-2409]
+pressure_keller_max = 30.5
+"""
+
+CATALOGUE_CSV = """user_id,keller_sensor_id,conductivity_gain,conductivity_offset
+0xCE220001,PA7LD30-2409,0.0025,0.1
+3458334722,PA7LHPD250-2410,,
+"""
+
+def mbus_packet(user_id, payload = VALID_CRYOEGG_DATA):
+    return cryodecoder.MBusPacket(
+        MBUS_HEADER + user_id.to_bytes(4, "little") + MBUS_FOOTER + payload + b'\x5A'
+    )
+
+@pytest.fixture
+def catalogue_path(tmp_path):
+    path = tmp_path / "calibration.toml"
+    path.write_text(CATALOGUE_TOML)
+    return path
+
+def test_keller_sensor_id():
+
+    data = cryodecoder.CryoeggData(keller_sensor_id = "PA7LHPD250-2410")
+    assert (data.pressure_type, data.pressure_keller_min, data.pressure_keller_max) == ("PA", 0.0, 250.0)
+
+    data = cryodecoder.CryoeggData(keller_sensor_id = "PR7LD3-2401", atmospheric_pressure = 1.0)
+    assert (data.pressure_type, data.pressure_keller_max) == ("PR", 3.0)
+
+    # Explicit values take precedence
+    data = cryodecoder.CryoeggData(keller_sensor_id = "PA7LD30-2409", pressure_keller_max = 30.5)
+    assert data.pressure_keller_max == 30.5
+
+    with pytest.raises(ValueError):
+        cryodecoder.CryoeggData(keller_sensor_id = "7LD30")
+
+def test_catalogue_settings(catalogue_path):
+
+    catalogue = cryodecoder.CalibrationCatalogue(catalogue_path)
+
+    assert len(catalogue) == 2
+    assert 0xCE220001 in catalogue
+
+    settings = catalogue.settings(0xCE220001)
+    assert settings["pressure_keller_max"] == 30.5
+    assert settings["conductivity_calibration"](1000) == pytest.approx(2.6)
+    # Not in the catalogue, so the defaults
+    assert catalogue.settings(0xCE229999) == {}
+
+def test_catalogue_convert(catalogue_path):
+
+    catalogue = cryodecoder.CalibrationCatalogue(catalogue_path)
+
+    for user_id, kwargs in (
+        (0xCE220001, {
+            "keller_sensor_id" : "PA7LD30-2409",
+            "pressure_keller_max" : 30.5,
+            "conductivity_calibration" : cryodecoder.LinearCalibration(0.0025, 0.1)
+        }),
+        (0xCE220002, {"keller_sensor_id" : "PA7LHPD250-2410"}),
+        (0xCE229999, {}),
+    ):
+        packet = mbus_packet(user_id)
+        expected = cryodecoder.CryoeggData(packet.payload, **kwargs)
+        data = catalogue.convert(packet)
+
+        assert data.pressure == expected.pressure
+        assert data.conductivity == expected.conductivity
+
+    # Unknown payloads have no Data type
+    assert catalogue.convert(mbus_packet(0xCE220001, b'\x00' * 4)) == None
+
+def test_catalogue_cache(catalogue_path):
+
+    catalogue = cryodecoder.CalibrationCatalogue(catalogue_path, cache_size = 2)
+
+    converter = catalogue.converter(cryodecoder.CryoeggData, 0xCE220001)
+    assert catalogue.converter(cryodecoder.CryoeggData, 0xCE220001) is converter
+
+    # Least recently used converters are dropped
+    catalogue.converter(cryodecoder.CryoeggData, 0xCE220002)
+    catalogue.converter(cryodecoder.CryoeggData, 0xCE220003)
+    assert len(catalogue.converters) == 2
+    assert catalogue.converter(cryodecoder.CryoeggData, 0xCE220001) is not converter
+
+def test_catalogue_reload(catalogue_path):
+
+    catalogue = cryodecoder.CalibrationCatalogue(catalogue_path, check_interval = 0)
+    converter = catalogue.converter(cryodecoder.CryoeggData, 0xCE220002)
+
+    catalogue_path.write_text(CATALOGUE_TOML.replace("PA7LHPD250-2410", "PA7LHPD100-2410"))
+    # Make sure the modification time changes
+    stat = os.stat(catalogue_path)
+    os.utime(catalogue_path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    reloaded = catalogue.converter(cryodecoder.CryoeggData, 0xCE220002)
+    assert reloaded is not converter
+    assert reloaded.settings.pressure_keller_max == 100.0
+    assert catalogue.reloads == 1
+
+    # An invalid file keeps the previous calibrations
+    catalogue_path.write_text("[instruments.0xCE220002]\nunknown = 1\n")
+    os.utime(catalogue_path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+    assert catalogue.converter(cryodecoder.CryoeggData, 0xCE220002) is reloaded
+    assert isinstance(catalogue.last_error, ValueError)
+
+def test_catalogue_csv(tmp_path):
+
+    path = tmp_path / "calibration.csv"
+    path.write_text(CATALOGUE_CSV)
+    catalogue = cryodecoder.CalibrationCatalogue(path)
+
+    assert catalogue.settings(0xCE220002) == {"keller_sensor_id" : "PA7LHPD250-2410"}
+    assert catalogue.settings(0xCE220001)["conductivity_calibration"].gain == 0.0025
+
+@pytest.mark.parametrize("source", [
+    "[instruments.0xCE220001]\npressure_keller_maximum = 30\n",
+    "[instruments.egg]\npressure_keller_max = 30\n",
+    "[instruments.0xCE220001]\nkeller_sensor_id = \"7LD30\"\n",
+    "[sensors.PA7LD30-2409]\nconductivity_gain = 1\n",
+    "[eggs.0xCE220001]\n",
+])
+def test_catalogue_invalid(tmp_path, source):
+
+    path = tmp_path / "calibration.toml"
+    path.write_text(source)
+
+    with pytest.raises(ValueError):
+        cryodecoder.CalibrationCatalogue(path)
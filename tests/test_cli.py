@@ -0,0 +1,124 @@
+import csv
+import pathlib
+
+import pytest
+import cryodecoder
+from cryodecoder.cli import main, convert, detect_format
+
+TEST_DIR = pathlib.Path(__file__).parent
+
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+VALID_MBUSPACKET_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA\xAA\x0F\x03\x04\xF2\x3F\xF2\x56\x8C\x0F\x19\x5A'
+VALID_CRYORECEIVER_DATA = VALID_MBUSPACKET_DATA + b'\x01\x25\x4C\x27\xE0\x2E'
+
+def frame(data):
+    return bytes([len(data)]) + data
+
+def read_csv(path):
+    with open(path, newline = "") as csv_fh:
+        return list(csv.reader(csv_fh))
+
+def test_detect_format(tmp_path):
+
+    sd_path = tmp_path / "sd.bin"
+    sd_path.write_bytes(SD_PACKET_DATA)
+    receiver_path = tmp_path / "receiver.bin"
+    receiver_path.write_bytes(frame(VALID_CRYORECEIVER_DATA))
+
+    assert detect_format(sd_path) == "sd"
+    assert detect_format(receiver_path) == "receiver"
+    assert detect_format(TEST_DIR / "mbuspacket_cryoegg_multiple.bin") == "mbus"
+
+def test_convert_mbus(tmp_path):
+
+    assert main([
+        "convert", str(TEST_DIR / "mbuspacket_cryoegg_multiple.bin"), 
+        "-o", str(tmp_path), "-q"
+    ]) == 0
+
+    rows = read_csv(tmp_path / "mbuspacket_cryoegg_multiple_cryoegg.csv")
+    assert rows[0][:3] == ["user_id", "control_field", "rssi"]
+    assert len(rows) == 28
+
+    # Values are converted with CryoeggData
+    packet = next(iter(cryodecoder.PacketReader(
+        TEST_DIR / "mbuspacket_cryoegg_multiple.bin", cryodecoder.MBusPacket
+    )))
+    data = cryodecoder.CryoeggData(packet.payload)
+    assert float(rows[1][rows[0].index("pressure")]) == pytest.approx(data.pressure)
+
+def test_convert_sd(tmp_path):
+
+    path = tmp_path / "sd.bin"
+    path.write_bytes(SD_PACKET_DATA * 5)
+
+    converter = convert(path, progress = False)
+
+    assert converter.paths == [str(tmp_path / "sd_cryowurst.csv")]
+    rows = read_csv(tmp_path / "sd_cryowurst.csv")
+    assert rows[0][:2] == ["timestamp", "channel"]
+    assert len(rows) == 6
+    assert int(rows[1][rows[0].index("user_id")]) == 0xCF200001
+    # In the same units as receiver CSVs (bar and volts)
+    assert float(rows[1][rows[0].index("pressure_logger")]) == pytest.approx(0.8762, abs = 1e-4)
+    assert float(rows[1][rows[0].index("solar_voltage")]) == pytest.approx(3.201)
+
+def test_convert_sd_corrupt_records(tmp_path):
+
+    # Records which can't be decoded are skipped, and the rest converted
+    path = tmp_path / "sd.bin"
+    invalid_header = b'\xff' + SD_PACKET_DATA[1:]
+    short_mbus = SD_PACKET_DATA[:17] + b'\x05' + SD_PACKET_DATA[18:23]
+    path.write_bytes(SD_PACKET_DATA * 2 + invalid_header + short_mbus + SD_PACKET_DATA * 2)
+
+    converter = convert(path, progress = False)
+
+    assert converter.packets_skipped == 2
+    assert len(read_csv(tmp_path / "sd_cryowurst.csv")) == 5
+
+def test_convert_duplicate_names(tmp_path):
+
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "sd.bin").write_bytes(SD_PACKET_DATA)
+
+    # Would overwrite each other's CSVs in the same output directory
+    with pytest.raises(SystemExit):
+        main(["convert", str(tmp_path / "a" / "sd.bin"), str(tmp_path / "b" / "sd.bin"), "-o", str(tmp_path), "-q"])
+    assert not (tmp_path / "sd_cryowurst.csv").exists()
+
+    # but not alongside each input
+    assert main(["convert", str(tmp_path / "a" / "sd.bin"), str(tmp_path / "b" / "sd.bin"), "-q"]) == 0
+    assert (tmp_path / "b" / "sd_cryowurst.csv").exists()
+
+def test_convert_receiver(tmp_path, capsys):
+
+    path = tmp_path / "receiver.bin"
+    # An invalid channel is skipped
+    invalid = VALID_CRYORECEIVER_DATA[:-6] + b'\x03' + VALID_CRYORECEIVER_DATA[-5:]
+    path.write_bytes(frame(VALID_CRYORECEIVER_DATA) * 3 + frame(invalid))
+
+    main(["convert", str(path), "--batch-size", "2"])
+
+    rows = read_csv(tmp_path / "receiver_cryoegg.csv")
+    assert len(rows) == 4
+    assert rows[1][:4] == ["1", "37", "1.006", "12.0"]
+    # Progress is reported on stderr
+    captured = capsys.readouterr()
+    assert "4 packets" in captured.err
+    assert "1 packets skipped" in captured.err
+    assert captured.out == ""
+
+def test_convert_calibration(tmp_path):
+
+    path = tmp_path / "receiver.bin"
+    path.write_bytes(frame(VALID_CRYORECEIVER_DATA))
+    catalogue_path = tmp_path / "calibration.toml"
+    catalogue_path.write_text("[instruments.0xCE240002]\nkeller_sensor_id = \"PA7LD30-2409\"\n")
+
+    main(["convert", str(path), "-c", str(catalogue_path), "-q"])
+
+    rows = read_csv(tmp_path / "receiver_cryoegg.csv")
+    packet = cryodecoder.CryoReceiverPacket(VALID_CRYORECEIVER_DATA)
+    data = cryodecoder.CryoeggData(packet.mbus_packet.payload, keller_sensor_id = "PA7LD30-2409")
+    assert float(rows[1][rows[0].index("pressure")]) == pytest.approx(data.pressure)
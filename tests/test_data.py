@@ -3,6 +3,7 @@ import cryodecoder
 
 VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
 VALID_CRYOWURST_DATA = bytes.fromhex("010a00610137004a002d00e6fc35001a0085047f00000dc6f8") #b'\x0e=\xff\xad\xfd\xf2\x024\x01$\xfdv\x02\xbd\x00\xaa\xfek\r:\x00\x00\rv\xb0'
+VALID_SDSATELLITE_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
 VALID_CRYORECEIVER_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA\xAA\x0F\x03\x04\xF2\x3F\xF2\x56\x8C\x0F\x19\x5A' + b'\x01\x25\x4C\x27\xE0\x2E'
 
 ##############################################################################
@@ -205,4 +206,195 @@ def test_cryoreceiverdata_mbus_packet():
 ##############################################################################
 # SD/Satellite Data Tests
 ##############################################################################
-# TODO: implement tests for SD/Satellite Data Tests
\ No newline at end of file
+
+def test_sdsatellitedata_units():
+
+    packet = cryodecoder.SDSatellitePacket(VALID_SDSATELLITE_DATA)
+    data = cryodecoder.SDSatelliteData(packet)
+
+    # Same units as CryoReceiverData (bar and volts)
+    assert abs(data.pressure_logger - 0.8762) < 0.0001
+    assert abs(data.solar_voltage - 3.201) < 0.001
+    assert abs(data.temperature_logger - 12.17) < 0.01
+    assert data.timestamp == packet.timestamp
+    assert data.channel == 1
+    assert isinstance(data.mbus_packet, cryodecoder.MBusPacket)
+
+##############################################################################
+# Column-wise conversion tests
+##############################################################################
+
+def test_cryoeggdata_convert_columns():
+
+    pytest.importorskip("numpy")
+    from cryodecoder.batch import decode_batch
+
+    raw = [
+        VALID_CRYOEGG_DATA,
+        b'\x10\x27\x03\x04\x00\x80\xF0\x5A\x10\x0E\xFF',
+        b'\x00\x00\x03\x04\xFF\xFF\x00\x00\x00\x00\x01',
+    ]
+    settings = dict(
+        pressure_keller_max = 30.0,
+        pressure_type = "PR",
+        atmospheric_pressure = 0.95,
+        conductivity_calibration = cryodecoder.LinearCalibration(2.5e-3, 0.1)
+    )
+
+    columns = cryodecoder.CryoeggData(**settings).convert_columns(
+        decode_batch(cryodecoder.CryoeggPacket, raw)
+    )
+
+    for i, frame in enumerate(raw):
+        data = cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(frame), **settings)
+        for field in columns:
+            assert columns[field][i] == pytest.approx(getattr(data, field))
+
+def test_cryowurstdata_convert_columns():
+
+    pytest.importorskip("numpy")
+    from cryodecoder.batch import decode_batch
+
+    columns = cryodecoder.CryowurstData(magnetometer_full_scale = 1000).convert_columns(
+        decode_batch(cryodecoder.CryowurstPacket, [VALID_CRYOWURST_DATA] * 3)
+    )
+    data = cryodecoder.CryowurstData(
+        cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA), magnetometer_full_scale = 1000
+    )
+
+    for field in columns:
+        assert len(columns[field]) == 3
+        assert columns[field][2] == pytest.approx(getattr(data, field))
+
+def test_cryowurstdata_convert_columns_magnetometer_range():
+
+    np = pytest.importorskip("numpy")
+
+    with pytest.raises(ValueError):
+        cryodecoder.CryowurstData().convert_columns(
+            {"magnetometer_x" : np.array([0, 32767], dtype = np.int16)}
+        )
+
+##############################################################################
+# Compact records
+##############################################################################
+
+def test_cryoeggdata_to_record():
+
+    data = cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA))
+    record = data.to_record()
+
+    assert isinstance(record, cryodecoder.CryoeggPacket.RECORD)
+    assert type(record).__name__ == "CryoeggRecord"
+    assert record.pressure == data.pressure
+    assert record._asdict() == {
+        field : getattr(data, field) for field in record._fields
+    }
+    # Records don't carry an instance dictionary
+    assert not hasattr(record, "__dict__")
+
+def test_cryoreceiverdata_to_record():
+
+    packet = cryodecoder.CryoReceiverPacket(VALID_CRYORECEIVER_DATA)
+    record = cryodecoder.CryoReceiverData(packet).to_record()
+
+    # Only numeric fields are kept, not the nested packet
+    assert record._fields == ("channel", "temperature_logger", "pressure_logger", "solar_voltage")
+    assert record.channel == 1
+    assert abs(record.solar_voltage - 12.0) < 0.001
+    # Values keep their types
+    assert type(record.channel) is int
+    assert type(record.solar_voltage) is float
+    assert [type(value) for value in record] == [int, int, float, float]
+
+def test_record_types():
+
+    record_class = cryodecoder.CryoReceiverPacket.RECORD
+
+    # Integers, including 64 bit counters, and None survive the round trip
+    record = record_class(1, None, (1 << 64) - 1, -(1 << 63))
+    assert list(record) == [1, None, (1 << 64) - 1, -(1 << 63)]
+    assert record.temperature_logger is None
+    assert record.pressure_logger == (1 << 64) - 1
+    assert record != record_class(1.0, None, (1 << 64) - 1, -(1 << 63))
+
+    # The record type is the same after compiling the packet type again
+    cryodecoder.Packet.compile(cryodecoder.CryoReceiverPacket)
+    assert cryodecoder.CryoReceiverPacket.RECORD is record_class
+    assert record == record_class(*record)
+
+def test_cryowurstdata_to_record_pickle():
+
+    import pickle
+
+    data = cryodecoder.CryowurstData(cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA))
+    record = data.to_record()
+
+    assert pickle.loads(pickle.dumps(record)) == record
+    assert list(record) == [getattr(data, field) for field in record._fields]
+
+##############################################################################
+# DataConverter Tests
+##############################################################################
+
+def test_dataconverter_matches_data():
+
+    kwargs = {
+        "pressure_keller_max" : 250.0,
+        "conductivity_calibration" : cryodecoder.LinearCalibration(0.5, 1.0)
+    }
+    converter = cryodecoder.CryoeggData.converter(**kwargs)
+
+    for raw in (VALID_CRYOEGG_DATA, bytes(range(11))):
+        packet = cryodecoder.CryoeggPacket(raw)
+        data = cryodecoder.CryoeggData(packet, **kwargs)
+        converted = converter.convert(packet)
+
+        assert isinstance(converted, cryodecoder.CryoeggData)
+        assert vars(converted) == vars(data)
+        assert converter.convert_record(packet) == data.to_record()
+
+def test_dataconverter_cryoreceiverdata():
+
+    # Fields which aren't numeric (mbus_packet) are converted too
+    packet = cryodecoder.CryoReceiverPacket(VALID_CRYORECEIVER_DATA)
+    converter = cryodecoder.DataConverter(cryodecoder.CryoReceiverData)
+
+    assert vars(converter.convert(packet)) == vars(cryodecoder.CryoReceiverData(packet))
+    assert converter.convert_batch([packet] * 40)[-1].solar_voltage == 12.0
+
+@pytest.mark.parametrize("count", [3, 100])
+def test_dataconverter_batch(count):
+
+    packets = [
+        cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA[:-1] + bytes([i]))
+        for i in range(count)
+    ]
+    converter = cryodecoder.CryowurstData.converter(pressure_keller_max = 30.0)
+    expected = [cryodecoder.CryowurstData(packet, pressure_keller_max = 30.0) for packet in packets]
+
+    # Converted with NumPy for larger batches, with the same values
+    assert [vars(data) for data in converter.convert_batch(packets)] == [vars(data) for data in expected]
+    records = converter.convert_records(iter(packets))
+    assert records == [data.to_record() for data in expected]
+    assert type(records[-1].sequence_number) is int
+
+def test_dataconverter_batch_scalar_calibration():
+
+    # Calibrations which only accept single values are applied one at a time
+    converter = cryodecoder.CryoeggData.converter(conductivity_calibration = lambda raw : float(raw) / 100)
+    packets = [cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)] * 50
+
+    assert converter.convert_records(packets)[0].conductivity == 40.0
+
+def test_dataconverter_invalid():
+
+    converter = cryodecoder.CryoeggData.converter()
+
+    with pytest.raises(TypeError):
+        converter.convert(cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA))
+    with pytest.raises(TypeError):
+        converter.convert_records([cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA)] * 50)
+    # Settings are validated when the converter is built
+    with pytest.raises(ValueError):
+        cryodecoder.CryoeggData.converter(conductivity_calibration = 1.0)
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+import cryodecoder
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+VALID_MBUSPACKET_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA\xAA\x0F\x03\x04\xF2\x3F\xF2\x56\x8C\x0F\x19\x5A'
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+
+def query(path, sql):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(sql).fetchall()
+
+def test_databasewriter_tables(tmp_path):
+
+    path = tmp_path / "cryo.db"
+    mbus_packet = cryodecoder.MBusPacket(VALID_MBUSPACKET_DATA)
+
+    with cryodecoder.DatabaseWriter(path) as writer:
+        writer.write_mbus(mbus_packet, timestamp = 1700000000)
+
+    # One table per packet and Data type, with the configured fields
+    columns = [row[1] for row in query(path, 'PRAGMA table_info("CryoeggPacket")')]
+    assert columns == ["user_id", "timestamp"] + list(cryodecoder.Packet.CONFIG[cryodecoder.CryoeggPacket].fields)
+
+    packet_rows = query(path, 'SELECT user_id, timestamp, sequence_number FROM "CryoeggPacket"')
+    assert packet_rows == [(0xCE240002, 1700000000, 0x19)]
+
+    data = cryodecoder.CryoeggData(mbus_packet.payload)
+    data_rows = query(path, 'SELECT pressure, battery_voltage FROM "CryoeggData"')
+    assert data_rows == [(pytest.approx(data.pressure), pytest.approx(data.battery_voltage))]
+
+    indexes = {row[1] for row in query(path, 'PRAGMA index_list("CryoeggData")')}
+    assert indexes == {"CryoeggData_user_id_timestamp", "CryoeggData_user_id_sequence_number"}
+
+    assert query(path, "PRAGMA journal_mode") == [("wal",)]
+
+def test_databasewriter_batches(tmp_path):
+
+    path = tmp_path / "cryo.db"
+    packet = cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)
+
+    writer = cryodecoder.DatabaseWriter(path, batch_size = 10, flush_interval = 3600)
+    for i in range(25):
+        writer.write(packet, user_id = i)
+
+    # Rows are only inserted once a whole batch is queued
+    assert writer.rows_written == 20
+    assert query(path, 'SELECT COUNT(*) FROM "CryoeggPacket"') == [(20,)]
+
+    writer.close()
+    assert query(path, 'SELECT COUNT(*) FROM "CryoeggPacket"') == [(25,)]
+
+def test_databasewriter_flush_interval(tmp_path):
+
+    writer = cryodecoder.DatabaseWriter(tmp_path / "cryo.db", flush_interval = 1e-9)
+    writer.write(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA))
+
+    assert writer.rows_written == 1
+    writer.close()
+
+def test_databasewriter_records_and_blobs(tmp_path):
+
+    path = tmp_path / "cryo.db"
+    packet = cryodecoder.SDSatellitePacket(SD_PACKET_DATA)
+    record = cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)).to_record()
+
+    with cryodecoder.DatabaseWriter(path) as writer:
+        writer.write(packet, user_id = packet.mbus_packet.user_id)
+        writer.write(record, user_id = 1)
+
+    # SD records have their own timestamp field
+    assert query(path, 'SELECT user_id, timestamp FROM "SDSatellitePacket"') \
+        == [(0xCF200001, packet.timestamp)]
+    # Nested packets are stored as their raw bytes
+    assert query(path, 'SELECT header, mbus_packet FROM "SDSatellitePacket"') \
+        == [("W1", SD_PACKET_DATA[18:])]
+    assert query(path, 'SELECT conductivity FROM "CryoeggRecord"') \
+        == [(pytest.approx(record.conductivity),)]
+
+def test_databasewriter_rejected_rows(tmp_path):
+
+    path = tmp_path / "cryo.db"
+    packet = cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)
+
+    writer = cryodecoder.DatabaseWriter(path, batch_size = 3, flush_interval = 3600)
+    writer.write(packet, user_id = 1)
+    writer.flush()
+    writer.connection.execute('CREATE UNIQUE INDEX "unique_user_id" ON "CryoeggPacket" (user_id)')
+
+    # A row which violates a constraint doesn't fail the rest of its batch,
+    # or any later batches
+    for user_id in (2, 1, 3, 4, 5, 6):
+        writer.write(packet, user_id = user_id)
+    writer.close()
+
+    assert query(path, 'SELECT user_id FROM "CryoeggPacket" ORDER BY user_id') == [(i,) for i in range(1, 7)]
+    assert writer.rows_written == 6
+    assert [(record_class, row[0]) for record_class, row, _ in writer.rejected] == [(cryodecoder.CryoeggPacket, 1)]
+    assert isinstance(writer.rejected[0][2], sqlite3.IntegrityError)
+
+def test_databasewriter_invalid(tmp_path):
+
+    path = tmp_path / "cryo.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE "CryoeggPacket" (a, b)')
+
+    with cryodecoder.DatabaseWriter(path) as writer:
+        with pytest.raises(TypeError):
+            writer.write(b"raw")
+        with pytest.raises(ValueError, match = r".*different columns.*"):
+            writer.write(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA))
@@ -0,0 +1,125 @@
+import pytest
+import cryodecoder
+
+import generate_mbus_packet
+
+def decode(path, file_format, unknown_payloads = False):
+    # Return (user_id, payload) for each frame of a generated file
+    if file_format == "sd":
+        with cryodecoder.SDArchive(path) as archive:
+            return [(packet.mbus_packet.user_id, packet.mbus_packet.payload) for packet in archive]
+    with cryodecoder.PacketReader(
+        path, cryodecoder.CryoReceiverPacket, unknown_payloads = unknown_payloads
+    ) as reader:
+        return [(packet.mbus_packet.user_id, packet.mbus_packet.payload) for packet in reader]
+
+def write(tmp_path, generator, count, file_format, numpy = False):
+    path = tmp_path / f"{file_format}.bin"
+    with open(path, "wb") as output_fh:
+        if numpy:
+            output_fh.write(generator.generate_numpy(count, file_format))
+        else:
+            generator.write(output_fh, count, file_format, chunk_size = 100)
+    return path
+
+def test_fake_mbus_packet():
+
+    payload = bytes(range(11))
+    raw = generate_mbus_packet.FakeMBusPacket.to_bytes(payload, 0xAA, 0xCE220001)
+
+    packet = cryodecoder.CryoReceiverPacket(raw[1:])
+    assert raw[0] == len(raw) - 1
+    assert packet.mbus_packet.user_id == 0xCE220001
+    assert isinstance(packet.mbus_packet.payload, cryodecoder.CryoeggPacket)
+    assert bytes(packet.mbus_packet.payload.raw) == payload
+
+@pytest.mark.parametrize("numpy", [False, True])
+@pytest.mark.parametrize("file_format", ["receiver", "sd"])
+def test_traffic_decodes(tmp_path, file_format, numpy):
+
+    if numpy:
+        pytest.importorskip("numpy")
+
+    generator = generate_mbus_packet.TrafficGenerator(seed = 1, instruments = 20)
+    packets = decode(write(tmp_path, generator, 1000, file_format, numpy), file_format)
+
+    assert len(packets) == 1000
+    assert {payload.__class__ for _, payload in packets} == {
+        cryodecoder.CryoeggPacket, cryodecoder.CryowurstPacket, cryodecoder.HydrobeanPacket
+    }
+    assert len({user_id for user_id, _ in packets}) == 20
+
+    # Sequence numbers increment per instrument, wrapping at the field width
+    last = {}
+    for user_id, payload in packets:
+        if user_id in last:
+            length = cryodecoder.Packet.CONFIG[payload.__class__].fields["sequence_number"].length
+            assert payload.sequence_number == (last[user_id] + 1) % (1 << (8 * length))
+        last[user_id] = payload.sequence_number
+
+@pytest.mark.parametrize("numpy", [False, True])
+def test_traffic_deterministic(numpy):
+
+    if numpy:
+        pytest.importorskip("numpy")
+
+    def generate(seed):
+        generator = generate_mbus_packet.TrafficGenerator(
+            seed = seed, loss = 0.1, duplication = 0.1, corruption = 0.1
+        )
+        if numpy:
+            return generator.generate_numpy(500)
+        return b"".join(generator.frames(500))
+
+    assert generate(3) == generate(3)
+    assert generate(3) != generate(4)
+
+def test_traffic_impairments(tmp_path):
+
+    generator = generate_mbus_packet.TrafficGenerator(
+        seed = 2, instruments = 10, loss = 0.2, duplication = 0.1, corruption = 0.05
+    )
+    count = 5000
+    packets = decode(write(tmp_path, generator, count, "receiver"), "receiver", unknown_payloads = True)
+
+    # Corrupted frames keep their framing, so every frame is still read
+    # (including those with a corrupted CI byte, as unknown payloads)
+    assert len(packets) == count
+    assert generator.packets_lost == pytest.approx(0.2 / 0.8 * count, rel = 0.15)
+    assert generator.packets_duplicated == pytest.approx(0.1 * count, rel = 0.2)
+    assert generator.packets_corrupted == pytest.approx(0.05 * count, rel = 0.3)
+
+    duplicates = sum(
+        a == b for (a, payload_a), (b, payload_b) in zip(packets, packets[1:])
+        if isinstance(payload_a, cryodecoder.Packet) and payload_a == payload_b
+    )
+    assert duplicates >= generator.packets_duplicated - generator.packets_corrupted
+
+@pytest.mark.parametrize("loss", [0.0, 0.1])
+def test_traffic_numpy_sequence_gaps(loss):
+
+    pytest.importorskip("numpy")
+
+    # Gaps in the sequence numbers of blocks are only those of lost packets
+    generator = generate_mbus_packet.TrafficGenerator(seed = 5, instruments = 10, loss = loss, duplication = 0.1)
+    data = generator.generate_numpy(1000) + generator.generate_numpy(1000)
+    tracker = cryodecoder.SequenceTracker()
+    for packet in cryodecoder.PacketReader(data):
+        tracker.update(packet)
+
+    totals = tracker.totals()
+    assert totals["received"] + totals["duplicates"] == 2000
+    assert totals["duplicates"] == generator.packets_duplicated
+    if loss == 0:
+        assert totals["missing"] == generator.packets_lost == 0
+    else:
+        # Packets lost after the last one received from an instrument
+        # aren't seen as missing
+        assert totals["missing"] <= generator.packets_lost <= totals["missing"] + 10
+
+def test_traffic_invalid_format():
+
+    generator = generate_mbus_packet.TrafficGenerator()
+
+    with pytest.raises(ValueError):
+        next(generator.frames(1, "csv"))
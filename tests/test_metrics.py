@@ -0,0 +1,115 @@
+import urllib.request
+
+import pytest
+import cryodecoder
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+VALID_MBUS_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA' + VALID_CRYOEGG_DATA + b'\x5A'
+VALID_RECEIVER_DATA = VALID_MBUS_DATA + b'\x01\x25\x4C\x27\xE0\x2E'
+
+@pytest.fixture
+def metrics():
+    metrics = cryodecoder.Metrics()
+    metrics.enable()
+    yield metrics
+    metrics.disable()
+    metrics.close()
+
+def test_metrics_counts(metrics):
+
+    for _ in range(3):
+        cryodecoder.CryoReceiverPacket(VALID_RECEIVER_DATA)
+    with pytest.raises(ValueError):
+        cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA[:5])
+    # Rejected after parsing, by the length check of the packet type
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA + b'\x00')
+    cryodecoder.MBusPacket(VALID_MBUS_DATA[:-3] + b'\x5A')
+    cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA))
+
+    snapshot = metrics.snapshot()
+    receiver = snapshot["packets"]["CryoReceiverPacket"]
+    assert receiver["count"] == 3
+    assert receiver["bytes"] == 3 * len(VALID_RECEIVER_DATA)
+    assert receiver["latency"]["parse"]["count"] == 3
+    assert snapshot["packets"]["MBusPacket"]["count"] == 4
+    assert snapshot["packets"]["MBusPacket"]["latency"]["parse_payload"]["count"] == 4
+    assert snapshot["packets"]["CryoeggPacket"]["count"] == 4
+    assert snapshot["packets"]["CryoeggPacket"]["rejected"] == {"TOO_SHORT" : 1, "TOO_LONG" : 5}
+    assert snapshot["packets"]["CryoeggPacket"]["bytes"] == 4 * len(VALID_CRYOEGG_DATA)
+    assert snapshot["payloads"] == {"CryoeggPacket" : 3, "unknown" : 1}
+    assert snapshot["data"]["CryoeggData"]["count"] == 1
+
+    # Conversions by a DataConverter, one at a time and in batches
+    converter = cryodecoder.CryoeggData.converter()
+    packet = cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA)
+    converter.convert(packet)
+    converter.convert_record(packet)
+    converter.convert_batch([packet] * 2)
+    converter.convert_records([packet] * 40)
+    with pytest.raises(TypeError):
+        converter.convert(cryodecoder.MBusPacket(VALID_MBUS_DATA))
+    data = metrics.snapshot()["data"]["CryoeggData"]
+    assert data["count"] == 1 + 2 + 2 + 40
+    assert data["rejected"] == {"TypeError" : 1}
+
+    # Cumulative buckets
+    buckets = list(receiver["latency"]["parse"]["buckets"].values())
+    assert buckets == sorted(buckets) and buckets[-1] <= 3
+
+    metrics.reset()
+    assert metrics.snapshot() == {"packets" : {}, "data" : {}, "payloads" : {}}
+
+def test_metrics_disable():
+
+    parse = cryodecoder.Packet.parse
+    init = cryodecoder.CryoeggPacket.__init__
+    parse_payload = cryodecoder.MBusPacket.parse_payload
+    decoder = cryodecoder.MBusPacket.DECODER
+    record = cryodecoder.CryoeggPacket.RECORD
+
+    with cryodecoder.Metrics() as metrics:
+        assert metrics.enabled
+        assert cryodecoder.Packet.parse is not parse
+        # Packet types aren't recompiled
+        assert cryodecoder.MBusPacket.DECODER is decoder
+        assert cryodecoder.CryoeggPacket.RECORD is record
+        with pytest.raises(RuntimeError):
+            cryodecoder.Metrics().enable()
+
+    # Original methods, and nothing counted once disabled
+    assert not metrics.enabled
+    assert cryodecoder.Packet.parse is parse
+    assert cryodecoder.CryoeggPacket.__init__ is init
+    assert cryodecoder.MBusPacket.parse_payload is parse_payload
+    assert cryodecoder.MBusPacket.DECODER is decoder
+    assert cryodecoder.CryoeggPacket.RECORD is record
+    packet = cryodecoder.CryoReceiverPacket(VALID_RECEIVER_DATA)
+    assert metrics.snapshot()["packets"] == {}
+    assert isinstance(packet.mbus_packet.payload, cryodecoder.CryoeggPacket)
+
+    # Lazy nested packets still work, and their fields are timed as they're
+    # decoded
+    with cryodecoder.Metrics() as metrics:
+        packet = cryodecoder.CryoReceiverPacket(VALID_RECEIVER_DATA, lazy = True)
+        assert packet.mbus_packet.payload.sequence_number == 0
+        snapshot = metrics.snapshot()
+    assert snapshot["packets"]["CryoReceiverPacket"]["latency"]["decode_field"]["count"] == 1
+    assert snapshot["packets"]["CryoeggPacket"]["latency"]["decode_field"]["count"] == 1
+    assert snapshot["payloads"] == {"CryoeggPacket" : 1}
+
+def test_metrics_prometheus(metrics):
+
+    cryodecoder.CryoReceiverPacket(VALID_RECEIVER_DATA)
+    text = metrics.prometheus()
+    assert '# TYPE cryodecoder_packets_total counter' in text
+    assert 'cryodecoder_packets_total{packet="CryoReceiverPacket"} 1' in text
+    assert 'cryodecoder_packets_latency_seconds_count{packet="CryoReceiverPacket",operation="parse"} 1' in text
+    assert 'cryodecoder_packets_latency_seconds_bucket{packet="CryoReceiverPacket",operation="parse",le="+Inf"} 1' in text
+    assert 'cryodecoder_payloads_total{payload="CryoeggPacket"} 1' in text
+
+    server = metrics.serve(port = 0)
+    port = server.server_address[1]
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        assert response.read().decode() == metrics.prometheus()
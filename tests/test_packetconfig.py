@@ -9,4 +9,124 @@ def test_import():
 def test_packetconfig_length():
 
     assert cryodecoder.CryoeggPacket.MIN_SIZE == 11
-    assert cryodecoder.MBusPacket.MIN_SIZE == 11
\ No newline at end of file
+    assert cryodecoder.MBusPacket.MIN_SIZE == 11
+
+def test_packetconfig_length_fixed_offset_pair():
+
+    # Fields given by two offsets from the same end have a fixed width
+    assert cryodecoder.CryoReceiverPacket.MIN_SIZE == 6
+    assert cryodecoder.SDSatellitePacket.MIN_SIZE == 18
+
+def test_packetconfig_signed_parameter():
+
+    fields = cryodecoder.Packet.CONFIG[cryodecoder.CryowurstPacket].fields
+
+    assert fields["magnetometer_x"].signed is True
+    assert fields["conductivity"].signed is False
+
+def test_packetdecoder_single_struct():
+
+    # Fixed layouts should be decoded with a single unpack_from call
+    for packet_class in (
+        cryodecoder.CryoeggPacket, 
+        cryodecoder.CryowurstPacket, 
+        cryodecoder.HydrobeanPacket
+    ):
+        decoder = packet_class.DECODER
+        assert len(decoder.head) == 1
+        assert len(decoder.tail) == 0
+        assert len(decoder.sliced) == 0
+
+def test_packetdecoder_matches_parsers():
+
+    raw = bytearray(range(1, 26))
+    packet = cryodecoder.CryowurstPacket(raw)
+
+    # Compare decoded fields against calling each parser on its slice
+    for field, field_config in cryodecoder.Packet.CONFIG[cryodecoder.CryowurstPacket].fields.items():
+        parser = getattr(cryodecoder.CryowurstPacket, field_config.parser)
+        expected = parser(raw[field_config.offset : field_config.offset + field_config.length])
+        assert getattr(packet, field) == expected
+
+def test_packetdecoder_parser_mismatch_falls_back():
+
+    # A field whose parser disagrees with the configured layout is sliced
+    config = cryodecoder.PacketConfig(
+        {"value" : {"offset" : 0, "length" : 2, "endianness" : "big", "parser" : "parse_conductivity"}},
+        "CryoeggPacket"
+    )
+    decoder = cryodecoder.PacketDecoder(cryodecoder.CryoeggPacket, config)
+
+    assert len(decoder.head) == 0
+    assert [field for field, _, _, _ in decoder.sliced] == ["value"]
+
+def test_packetconfig_control_field():
+
+    config = cryodecoder.Packet.CONFIG
+
+    assert config[cryodecoder.CryoeggPacket].control_field == [0xAA]
+    assert config[cryodecoder.CryowurstPacket].control_field == [0xAC]
+    assert config[cryodecoder.HydrobeanPacket].control_field == [0xAB]
+    # control_field is also a field of MBusPacket, which isn't a payload
+    assert config[cryodecoder.MBusPacket].control_field == []
+    assert config[cryodecoder.MBusPacket].fields["payload"].arguments == ["control_field"]
+
+def test_packetconfig_invalid_argument():
+
+    config = cryodecoder.PacketConfig(
+        {"value" : {"offset" : [0, -1], "length" : None, "parser" : "parse_payload", "arguments" : ["missing"]}},
+        "MBusPacket"
+    )
+
+    with pytest.raises(ValueError, match = r"Argument missing .*"):
+        cryodecoder.PacketDecoder(cryodecoder.MBusPacket, config)
+
+def test_compiled_packet_config_cache(tmp_path):
+
+    path = tmp_path / "packets.toml"
+    path.write_text('[ExamplePacket]\ncontrol_field = 0x01\n[ExamplePacket.value]\noffset = 0\nlength = 2\nparser = "parse_value"\n')
+    cache_dir = tmp_path / "cache"
+
+    config = cryodecoder.load_compiled_packet_config(path, cache_dir)
+    cache_files = list(cache_dir.iterdir())
+    assert len(cache_files) == 1
+
+    # Loaded from the cache, with the same values
+    cached = cryodecoder.load_compiled_packet_config(path, cache_dir)
+    assert cached["ExamplePacket"].to_values() == config["ExamplePacket"].to_values()
+    assert cached["ExamplePacket"].control_field == [0x01]
+    assert cached["ExamplePacket"].fields["value"].length == 2
+
+    # Changing the file changes the key
+    path.write_text(path.read_text().replace("length = 2", "length = 4"))
+    changed = cryodecoder.load_compiled_packet_config(path, cache_dir)
+    assert changed["ExamplePacket"].fields["value"].length == 4
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # A corrupt cache file is rebuilt
+    cache_files[0].write_bytes(b"not marshal")
+    path.write_text(path.read_text().replace("length = 4", "length = 2"))
+    assert cryodecoder.load_compiled_packet_config(path, cache_dir)["ExamplePacket"].fields["value"].length == 2
+
+def test_compiled_packet_config_matches_toml():
+
+    path = cryodecoder.packet_config_path
+    compiled = cryodecoder.compile_packet_config(cryodecoder.load_packet_config(path))
+
+    for name, packet_config in cryodecoder.PACKET_CONFIG.items():
+        assert packet_config.to_values() == compiled[name].to_values()
+
+def test_packet_configure_lazy():
+
+    raw = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+    cryodecoder.Packet.configure(cryodecoder.CryoeggPacket, cryodecoder.PACKET_CONFIG, lazy = True)
+
+    # Not compiled until used
+    for name in ("MIN_SIZE", "DECODER", "RECORD"):
+        assert name not in cryodecoder.CryoeggPacket.__dict__
+
+    packet = cryodecoder.CryoeggPacket(raw)
+
+    assert "DECODER" in cryodecoder.CryoeggPacket.__dict__
+    assert cryodecoder.CryoeggPacket.MIN_SIZE == 11
+    assert packet.conductivity == 4000
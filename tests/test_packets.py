@@ -1,3 +1,5 @@
+import tracemalloc
+
 import pytest
 import cryodecoder
 
@@ -125,3 +127,190 @@ def test_sdsatellitereceiverpacket_badlength():
 
     with pytest.raises(ValueError, match=r"Raw packet length .*") as e_info:
         packet = cryodecoder.SDSatellitePacket(long_sd_packet_data)
+
+##############################################################################
+# Lazy decoding
+##############################################################################
+def test_lazy_packet_fields():
+
+    packet = cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA, lazy = True)
+    eager = cryodecoder.CryowurstPacket(VALID_CRYOWURST_DATA)
+
+    # Nothing is decoded until it is accessed
+    assert "conductivity" not in vars(packet)
+    assert packet.conductivity == 0x47f
+    assert "conductivity" in vars(packet)
+    assert "pressure" not in vars(packet)
+
+    for field in cryodecoder.Packet.CONFIG[cryodecoder.CryowurstPacket].fields:
+        assert getattr(packet, field) == getattr(eager, field)
+
+def test_lazy_packet_nested():
+
+    packet = cryodecoder.CryoReceiverPacket(
+        VALID_MBUSPACKET_DATA + VALID_CRYORECEIVER_DATA, lazy = True
+    )
+
+    # Negative offsets are resolved against the packet length
+    assert packet.channel == 1
+    assert packet.solar_voltage == 12000
+    # and nested packets are only built when touched
+    assert "mbus_packet" not in vars(packet)
+    assert packet.mbus_packet.user_id == 0xCE240002
+    assert isinstance(packet.mbus_packet.payload, cryodecoder.CryoeggPacket)
+
+def test_lazy_packet_set_raw_data():
+
+    packet = cryodecoder.CryoeggPacket(VALID_CRYOEGG_DATA, lazy = True)
+    assert packet.sequence_number == 0
+
+    # Cached fields are discarded when the raw data changes
+    packet.set_raw_data(VALID_CRYOEGG_DATA[:-1] + b'\x07')
+    assert packet.sequence_number == 7
+
+def test_lazy_sdsatellitepacket_length():
+
+    long_sd_packet_data = bytes.fromhex("573184aad764b82c4a41a4025b44920c0124440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe9e573184aad764b82c4a41a4025b44920c0224440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe94")
+
+    # Validation in __init__ still applies to lazy packets
+    with pytest.raises(ValueError, match=r"Raw packet length .*"):
+        cryodecoder.SDSatellitePacket(long_sd_packet_data, lazy = True)
+
+def test_lazy_packet_nested_lazy():
+
+    packet = cryodecoder.MBusPacket(VALID_MBUSPACKET_DATA, lazy = True)
+
+    # Nested packets of a lazy packet are also lazy
+    assert "sequence_number" not in vars(packet.payload)
+    assert packet.payload.sequence_number == 0x19
+
+##############################################################################
+# Payload dispatch
+##############################################################################
+def mbus_packet_with_payload(control_field, payload):
+    return VALID_MBUSPACKET_DATA[:9] + bytes([control_field]) + payload + b'\x5A'
+
+def test_mbuspacket_payload_control_field():
+
+    # Payload type is given by the CI field as well as the length
+    assert isinstance(
+        cryodecoder.MBusPacket(mbus_packet_with_payload(0xAA, VALID_CRYOEGG_DATA)).payload,
+        cryodecoder.CryoeggPacket
+    )
+    assert isinstance(
+        cryodecoder.MBusPacket(mbus_packet_with_payload(0xAC, VALID_CRYOWURST_DATA)).payload,
+        cryodecoder.CryowurstPacket
+    )
+    assert isinstance(
+        cryodecoder.MBusPacket(mbus_packet_with_payload(0xAB, bytes(10))).payload,
+        cryodecoder.HydrobeanPacket
+    )
+
+def test_mbuspacket_payload_unknown():
+
+    # An unknown CI, or a known CI with the wrong length, leaves raw bytes
+    packet = cryodecoder.MBusPacket(mbus_packet_with_payload(0xAD, VALID_CRYOEGG_DATA))
+    assert bytes(packet.payload) == VALID_CRYOEGG_DATA
+
+    packet = cryodecoder.MBusPacket(mbus_packet_with_payload(0xAC, VALID_CRYOEGG_DATA))
+    assert bytes(packet.payload) == VALID_CRYOEGG_DATA
+
+def test_mbuspacket_payload_lazy():
+
+    packet = cryodecoder.MBusPacket(
+        mbus_packet_with_payload(0xAC, VALID_CRYOWURST_DATA), lazy = True
+    )
+
+    assert "control_field" not in vars(packet)
+    assert isinstance(packet.payload, cryodecoder.CryowurstPacket)
+    assert "temperature" not in vars(packet.payload)
+
+def test_mbuspacket_register_payload_clash():
+
+    # Registering the same type again is fine, but a different type for
+    # the same CI and length is not
+    cryodecoder.MBusPacket.register_payload(cryodecoder.CryoeggPacket)
+
+    class OtherPacket(cryodecoder.CryoeggPacket):
+        pass
+    cryodecoder.Packet.CONFIG[OtherPacket] = cryodecoder.Packet.CONFIG[cryodecoder.CryoeggPacket]
+    try:
+        with pytest.raises(ValueError, match = r".*clashes with CryoeggPacket.*"):
+            cryodecoder.MBusPacket.register_payload(OtherPacket)
+    finally:
+        del cryodecoder.Packet.CONFIG[OtherPacket]
+
+##############################################################################
+# Zero-copy views
+##############################################################################
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+
+def sd_packet_with_payload(payload):
+    mbus = SD_PACKET_DATA[18:28] + payload + SD_PACKET_DATA[-1:]
+    return SD_PACKET_DATA[:17] + bytes([len(mbus)]) + mbus
+
+def test_packet_memoryview_nested_views():
+
+    buffer = SD_PACKET_DATA * 4
+    view = memoryview(buffer)[len(SD_PACKET_DATA) : 2 * len(SD_PACKET_DATA)]
+
+    packet = cryodecoder.SDSatellitePacket(view)
+
+    # All nested packets refer back to the caller's buffer
+    assert packet.raw.obj is buffer
+    assert packet.mbus_packet.raw.obj is buffer
+    assert packet.mbus_packet.payload.raw.obj is buffer
+    assert packet.header == "W1"
+
+    # until a copy is asked for
+    copied = packet.copy()
+    assert copied == cryodecoder.SDSatellitePacket(SD_PACKET_DATA)
+    assert isinstance(copied.raw.obj, bytes)
+    assert copied.mbus_packet.payload.raw.obj is copied.raw.obj
+
+def test_packet_bytearray_resizable():
+
+    # A caller's bytearray can still be reused once decoded, as nested
+    # packets are copies rather than views into it
+    buffer = bytearray(VALID_MBUSPACKET_DATA)
+    packet = cryodecoder.MBusPacket(buffer)
+    assert packet.raw is buffer
+    buffer.clear()
+    assert isinstance(packet.payload, cryodecoder.CryoeggPacket)
+    assert packet.payload.sequence_number == 0x19
+
+    # including for lazy packets
+    buffer = bytearray(VALID_MBUSPACKET_DATA)
+    packet = cryodecoder.MBusPacket(buffer, lazy = True)
+    payload = packet.payload
+    buffer.clear()
+    assert payload.sequence_number == 0x19
+
+def allocated_per_record(raw, count = 500):
+
+    buffer = raw * count
+    view = memoryview(buffer)
+    size = len(raw)
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        packets = [
+            cryodecoder.SDSatellitePacket(view[i * size : (i + 1) * size])
+            for i in range(count)
+        ]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(packets) == count
+    return (after - before) / count
+
+def test_packet_memoryview_allocations():
+
+    small = allocated_per_record(sd_packet_with_payload(bytes(30)))
+    large = allocated_per_record(sd_packet_with_payload(bytes(200)))
+
+    # Allocation per record is a small constant, independent of its size
+    assert small < 4096
+    assert abs(large - small) < 64
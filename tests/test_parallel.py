@@ -0,0 +1,100 @@
+import operator
+
+import pytest
+import cryodecoder
+
+SD_PACKET_DATA = bytes.fromhex("5731b5a4d7644abf4241fb0d5b44810c0124440102010020cf0107ac00f5fefe0206fe96fff4001efc1afffa0011033200000ddf078e")
+SD_PACKET_DATA_LONG = bytes.fromhex("573184aad764b82c4a41a4025b44920c0124440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe9e573184aad764b82c4a41a4025b44920c0224440300020020cf0107ac010c005f01320040002d00e5fc35001a0084047d00000dc8fe94")
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = tmp_path / "archive.bin"
+    # 100 records with alternating channels, followed by a truncated record
+    path.write_bytes(SD_PACKET_DATA_LONG * 50 + SD_PACKET_DATA[:20])
+    return path
+
+def test_sdarchive_split(archive_path):
+
+    record_size = len(SD_PACKET_DATA)
+
+    with cryodecoder.SDArchive(archive_path) as archive:
+        chunks = list(archive.split(3 * record_size - 1))
+
+    # Chunks are whole records, and the truncated record is left out
+    assert chunks[0] == (0, 3 * record_size)
+    assert chunks[-1] == (99 * record_size, 100 * record_size)
+    assert len(chunks) == 34
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_decode_archive_order(archive_path, workers):
+
+    channels = list(cryodecoder.decode_archive(
+        archive_path, 
+        operator.attrgetter("channel"), 
+        workers = workers, 
+        chunk_size = 100
+    ))
+
+    assert channels == [1, 2] * 50
+
+def test_decode_archive_records(archive_path):
+
+    records = list(cryodecoder.decode_archive(archive_path, workers = 2, chunk_size = 1000))
+
+    assert len(records) == 100
+    with cryodecoder.SDArchive(archive_path) as archive:
+        for (sd_record, mbus_record, payload_record), packet in zip(records, archive):
+            assert sd_record.channel == packet.channel
+            assert mbus_record.user_id == packet.mbus_packet.user_id
+            assert payload_record.temperature == packet.mbus_packet.payload.temperature
+
+def test_decode_archive_bounded(archive_path, monkeypatch):
+
+    # Chunks are only dispatched a few at a time ahead of the caller
+    split = cryodecoder.SDArchive.split
+    dispatched = []
+    def counted_split(archive, chunk_size):
+        for chunk in split(archive, chunk_size):
+            dispatched.append(chunk)
+            yield chunk
+    monkeypatch.setattr(cryodecoder.SDArchive, "split", counted_split)
+
+    workers = 2
+    records = cryodecoder.decode_archive(archive_path, operator.attrgetter("channel"), workers = workers, chunk_size = 1)
+    assert next(records) == 1
+    assert len(dispatched) <= workers * cryodecoder.parallel.PARALLEL_CHUNKS_PER_WORKER + 1
+    assert list(records) == [2] + [1, 2] * 49
+    assert len(dispatched) == 100
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_decode_archive_corrupt_records(tmp_path, workers):
+
+    # Records which can't be decoded are reported, and the rest still decoded
+    path = tmp_path / "archive.bin"
+    invalid_header = b'\xff' + SD_PACKET_DATA[1:]
+    short_mbus = SD_PACKET_DATA[:17] + b'\x05' + SD_PACKET_DATA[18:23]
+    path.write_bytes(SD_PACKET_DATA * 10 + invalid_header + short_mbus + SD_PACKET_DATA * 10)
+
+    errors = []
+    channels = list(cryodecoder.decode_archive(
+        path, operator.attrgetter("channel"), workers = workers, chunk_size = 100, errors = errors
+    ))
+
+    assert channels == [1] * 20
+    assert [tuple(error) for error in errors] == [
+        (10 * len(SD_PACKET_DATA), cryodecoder.SDSatellitePacket, cryodecoder.ErrorReason.INVALID_HEADER),
+        (11 * len(SD_PACKET_DATA), cryodecoder.SDSatellitePacket, cryodecoder.ErrorReason.TOO_SHORT),
+    ]
+
+def test_decode_archive_empty(tmp_path):
+
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+
+    assert list(cryodecoder.decode_archive(path, workers = 2)) == []
+
+def test_decode_archive_invalid_workers(archive_path):
+
+    with pytest.raises(ValueError):
+        list(cryodecoder.decode_archive(archive_path, workers = -1))
@@ -0,0 +1,169 @@
+import io
+import pathlib
+
+import pytest
+import cryodecoder
+
+TEST_DIR = pathlib.Path(__file__).parent
+
+VALID_MBUSPACKET_DATA = b'\x44\x24\x48\x02\x00\x24\xCE\x01\x07\xAA\xAA\x0F\x03\x04\xF2\x3F\xF2\x56\x8C\x0F\x19\x5A'
+VALID_CRYORECEIVER_DATA = VALID_MBUSPACKET_DATA + b'\x01\x25\x4C\x27\xE0\x2E'
+
+def frame(raw):
+    # Prefix with the length byte (not including itself)
+    return bytes([len(raw)]) + raw
+
+def test_packetreader_mbus_file():
+
+    reader = cryodecoder.PacketReader(
+        TEST_DIR / "mbuspacket_cryoegg_multiple.bin", 
+        packet_class = cryodecoder.MBusPacket
+    )
+    packets = list(reader)
+
+    assert len(packets) == 27
+    assert all(isinstance(p.payload, cryodecoder.CryoeggPacket) for p in packets)
+    assert reader.bytes_skipped == 0
+
+def test_packetreader_partial_trailing_frame():
+
+    # The last frame in this file is truncated
+    reader = cryodecoder.PacketReader(
+        TEST_DIR / "mbuspacket_cryoegg_multiple_rssi.bin", 
+        packet_class = cryodecoder.MBusPacket
+    )
+    packets = list(reader)
+
+    assert len(packets) == 174
+    assert reader.position == 174 * 23
+
+def test_packetreader_chunk_boundaries():
+
+    data = (TEST_DIR / "mbuspacket_cryoegg_multiple_rssi.bin").read_bytes()
+
+    expected = list(cryodecoder.PacketReader(data, packet_class = cryodecoder.MBusPacket))
+    # Chunks smaller than a frame force frames to span several reads
+    chunked = list(cryodecoder.PacketReader(
+        io.BytesIO(data), packet_class = cryodecoder.MBusPacket, chunk_size = 7
+    ))
+
+    assert chunked == expected
+
+def test_packetreader_cryoreceiver_resync():
+
+    # Junk between frames should be skipped
+    data = b'\x00\xFF\x44' + frame(VALID_CRYORECEIVER_DATA) + b'\x03\x02' \
+        + frame(VALID_CRYORECEIVER_DATA)
+
+    reader = cryodecoder.PacketReader(data)
+    packets = list(reader)
+
+    assert len(packets) == 2
+    assert all(isinstance(p, cryodecoder.CryoReceiverPacket) for p in packets)
+    assert packets[0].mbus_packet.user_id == 0xCE240002
+    assert reader.bytes_skipped == 5
+    assert reader.position == len(data)
+
+def test_packetreader_false_frame_start():
+
+    # Noise which looks like a frame start (a plausible length byte and C
+    # field) shouldn't swallow the real frames after it
+    data = b'\x14\x44' + frame(VALID_CRYORECEIVER_DATA) * 5
+
+    reader = cryodecoder.PacketReader(data)
+    packets = list(reader)
+
+    assert len(packets) == 5
+    assert all(isinstance(p.mbus_packet.payload, cryodecoder.CryoeggPacket) for p in packets)
+    assert reader.bytes_skipped == 2
+    assert reader.unknown_frames == 1
+
+    # Unless unknown payloads are kept
+    packets = list(cryodecoder.PacketReader(data, unknown_payloads = True))
+    assert not isinstance(packets[0].mbus_packet.payload, cryodecoder.Packet)
+
+def test_packetreader_invalid_source():
+
+    with pytest.raises(TypeError):
+        cryodecoder.PacketReader(12)
+
+##############################################################################
+# Follow mode and checkpoints
+##############################################################################
+
+def read(reader, count):
+    # Read count packets, then stop
+    packets = []
+    for packet in reader:
+        packets.append(packet)
+        if len(packets) == count:
+            reader.stop()
+    return packets
+
+def test_packetreader_follow(tmp_path):
+
+    path = tmp_path / "receiver.bin"
+    data = frame(VALID_CRYORECEIVER_DATA) * 3
+    # Ends with a partial frame
+    path.write_bytes(data[:-5])
+
+    reader = cryodecoder.PacketReader(path, follow = True, poll_interval = 0.01, idle_timeout = 5)
+    packets = reader.read_packets()
+    assert next(packets) == cryodecoder.CryoReceiverPacket(VALID_CRYORECEIVER_DATA)
+    assert next(packets)
+
+    # Held back until the rest of the frame arrives
+    with open(path, "ab") as log_fh:
+        log_fh.write(data[-5:] + frame(VALID_CRYORECEIVER_DATA))
+    assert next(packets) and next(packets)
+    assert reader.position == len(data) + len(frame(VALID_CRYORECEIVER_DATA))
+
+    # Truncated and rewritten
+    path.write_bytes(frame(VALID_CRYORECEIVER_DATA))
+    assert next(packets)
+    assert reader.truncations == 1 and reader.position == len(frame(VALID_CRYORECEIVER_DATA))
+
+    reader.stop()
+    assert list(packets) == []
+
+def test_packetreader_idle_timeout(tmp_path):
+
+    path = tmp_path / "receiver.bin"
+    path.write_bytes(frame(VALID_CRYORECEIVER_DATA))
+    reader = cryodecoder.PacketReader(path, follow = True, poll_interval = 0.01, idle_timeout = 0.05)
+    assert len(list(reader)) == 1
+
+def test_packetreader_checkpoint(tmp_path):
+
+    path = tmp_path / "receiver.bin"
+    checkpoint = tmp_path / "receiver.checkpoint"
+    frames = [frame(VALID_CRYORECEIVER_DATA[:-1] + bytes([i])) for i in range(10)]
+    path.write_bytes(b''.join(frames[:6]))
+
+    # Stopped cleanly after 4 packets, so resumes at the fifth
+    reader = cryodecoder.PacketReader(path, checkpoint = checkpoint)
+    first = read(reader, 4)
+    reader = cryodecoder.PacketReader(path, checkpoint = checkpoint, follow = True, poll_interval = 0.01, idle_timeout = 0.05)
+    with open(path, "ab") as log_fh:
+        log_fh.write(b''.join(frames[6:]))
+    rest = list(reader)
+    assert [packet.raw for packet in first + rest] == [bytearray(raw[1:]) for raw in frames]
+
+    # A packet being handled when the reader is closed is read again
+    path.write_bytes(b''.join(frames))
+    checkpoint.unlink()
+    reader = cryodecoder.PacketReader(path, checkpoint = checkpoint)
+    for i, packet in enumerate(reader):
+        if i == 2:
+            break
+    reader = cryodecoder.PacketReader(path, checkpoint = checkpoint)
+    assert next(iter(reader)).raw == bytearray(frames[2][1:])
+
+    # Checkpoints for a replaced file start from the beginning
+    reader.close()
+    path.unlink()
+    path.write_bytes(b''.join(frames[5:8]))
+    assert len(list(cryodecoder.PacketReader(path, checkpoint = checkpoint))) == 3
+
+    with pytest.raises(ValueError):
+        cryodecoder.PacketReader(b'', follow = True)
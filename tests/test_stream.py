@@ -0,0 +1,165 @@
+import pytest
+import cryodecoder
+
+MBUS_HEADER = b'\x44\x24\x48'
+MBUS_FOOTER = b'\x01\x07\xAA'
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+
+def mbus_packet(user_id = 0xCE220001, sequence_number = 0, rssi = -60, payload = None):
+    payload = payload or VALID_CRYOEGG_DATA[:-1] + bytes([sequence_number])
+    return cryodecoder.MBusPacket(
+        MBUS_HEADER + user_id.to_bytes(4, "little") + MBUS_FOOTER + payload
+        + rssi.to_bytes(1, "little", signed = True)
+    )
+
+##############################################################################
+# Deduplicator Tests
+##############################################################################
+
+def test_unwrap_sequence():
+
+    assert cryodecoder.unwrap_sequence(255, 0, 256) == 256
+    assert cryodecoder.unwrap_sequence(256, 255, 256) == 255
+    assert cryodecoder.unwrap_sequence(1000, 1000 % 256, 256) == 1000
+    assert cryodecoder.unwrap_sequence(10, 200, 256) == -56
+
+def test_deduplicator_best_rssi():
+
+    dedup = cryodecoder.Deduplicator(max_entries = 2)
+
+    # Heard by three receivers
+    assert dedup.push(mbus_packet(rssi = -90)) == []
+    best = mbus_packet(rssi = -50)
+    assert dedup.push(best) == []
+    assert dedup.push(mbus_packet(rssi = -70)) == []
+    assert dedup.dropped == 2
+    assert dedup.replaced == 1
+    assert len(dedup) == 1
+
+    # Emitted once it leaves the window
+    dedup.push(mbus_packet(sequence_number = 1))
+    assert dedup.push(mbus_packet(sequence_number = 2)) == [best]
+    assert len(dedup.flush()) == 2
+    assert (dedup.packets_in, dedup.packets_out) == (5, 3)
+
+def test_deduplicator_keys():
+
+    dedup = cryodecoder.Deduplicator()
+    packets = [
+        mbus_packet(),
+        # Same sequence number, from another instrument or with another payload
+        mbus_packet(user_id = 0xCE220002),
+        mbus_packet(payload = b'\x00' * 10 + b'\x00'),
+        # Unknown payload types are compared by payload
+        mbus_packet(payload = b'\x01\x02\x03'),
+        mbus_packet(payload = b'\x01\x02\x03'),
+    ]
+
+    assert list(dedup.process(packets)) == packets[:4]
+    assert dedup.dropped == 1
+
+def test_deduplicator_sequence_wrap():
+
+    # The same payload a whole sequence later isn't a copy
+    dedup = cryodecoder.Deduplicator(max_entries = 1000)
+    packets = [mbus_packet(payload = VALID_CRYOEGG_DATA[:-1] + bytes([i % 256])) for i in range(300)]
+    packets.append(mbus_packet(payload = VALID_CRYOEGG_DATA[:-1] + bytes([299 % 256]), rssi = -10))
+
+    output = list(dedup.process(packets))
+
+    assert len(output) == 300
+    assert dedup.dropped == 1
+    assert output[-1].rssi == -10
+
+def test_deduplicator_time_window():
+
+    dedup = cryodecoder.Deduplicator(window = 2.0)
+
+    dedup.push(mbus_packet(), timestamp = 0.0)
+    dedup.push(mbus_packet(), timestamp = 1.0)
+    assert dedup.push(mbus_packet(sequence_number = 1), timestamp = 1.5) == []
+    assert len(dedup.expire(timestamp = 2.0)) == 1
+    # A copy arriving after the window has passed isn't suppressed
+    assert dedup.push(mbus_packet(), timestamp = 3.5) == [mbus_packet(sequence_number = 1)]
+    assert dedup.dropped == 1
+
+def test_deduplicator_receiver_packets():
+
+    receiver_data = bytes(mbus_packet().raw) + b'\x01\x25\x4C\x27\xE0\x2E'
+    packets = [cryodecoder.CryoReceiverPacket(receiver_data) for _ in range(3)]
+
+    output = list(cryodecoder.Deduplicator().process(packets))
+
+    assert output == packets[:1]
+    assert isinstance(output[0], cryodecoder.CryoReceiverPacket)
+
+def test_deduplicator_invalid():
+
+    with pytest.raises(ValueError):
+        cryodecoder.Deduplicator(max_entries = -1)
+
+##############################################################################
+# SequenceTracker Tests
+##############################################################################
+
+def test_sequence_tracker_counts():
+
+    tracker = cryodecoder.SequenceTracker()
+
+    # 3 and 4 lost, 6 repeated, then 4 arrives late
+    for sequence_number in (0, 1, 2, 5, 6, 6):
+        tracker.update(mbus_packet(sequence_number = sequence_number))
+    state = tracker[0xCE220001]
+    assert (state.last, state.received, state.missing, state.duplicates) == (6, 5, 2, 1)
+
+    assert tracker.update(mbus_packet(sequence_number = 4)) == 0
+    assert (state.received, state.missing, state.out_of_order) == (6, 1, 1)
+    # Now a duplicate
+    tracker.update(mbus_packet(sequence_number = 4))
+    assert (state.duplicates, state.out_of_order) == (2, 1)
+    assert state.loss == pytest.approx(1 / 7)
+
+def test_sequence_tracker_wrap():
+
+    tracker = cryodecoder.SequenceTracker()
+
+    # Wrap-around isn't a gap, but a lost packet across it is
+    for sequence_number in list(range(250, 256)) + list(range(0, 5)):
+        assert tracker.update(mbus_packet(sequence_number = sequence_number)) == 0
+    assert tracker.update(mbus_packet(sequence_number = 6)) == 1
+    state = tracker[0xCE220001]
+    assert (state.last, state.received, state.missing) == (262, 12, 1)
+
+def test_sequence_tracker_loss_rate():
+
+    tracker = cryodecoder.SequenceTracker(alpha = 0.1)
+
+    # Every other packet lost
+    for sequence_number in range(0, 2000, 2):
+        tracker.update_sequence(1, sequence_number % 256)
+    assert tracker.loss_rate(1) == pytest.approx(0.5, abs = 0.05)
+    assert tracker[1].missing == 999
+
+    # Late packets are taken back out of the average, so filling in the
+    # gaps gives no loss
+    tracker = cryodecoder.SequenceTracker(alpha = 0.1)
+    for sequence_number in range(0, 20, 2):
+        tracker.update_sequence(1, sequence_number)
+    for sequence_number in range(1, 19, 2):
+        tracker.update_sequence(1, sequence_number)
+    assert tracker[1].missing == 0
+    assert tracker.loss_rate(1) == pytest.approx(0.0, abs = 1e-9)
+
+def test_sequence_tracker_instruments():
+
+    tracker = cryodecoder.SequenceTracker()
+    packets = [mbus_packet(user_id, sequence_number) for sequence_number in range(10) for user_id in (1, 2)]
+    packets.append(mbus_packet(3, payload = b'\x00\x01'))
+
+    assert list(tracker.process(packets)) == packets
+    # Unknown payloads have no sequence number
+    assert len(tracker) == 2 and 3 not in tracker
+    assert tracker.totals() == {"received" : 20, "missing" : 0, "duplicates" : 0, "out_of_order" : 0}
+
+    with pytest.raises(ValueError):
+        cryodecoder.SequenceTracker(alpha = 2.0)
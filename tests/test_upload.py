@@ -0,0 +1,163 @@
+import gzip
+import http.server
+import json
+import queue
+import socket
+import threading
+
+import pytest
+import cryodecoder
+
+VALID_CRYOEGG_DATA = b'\xA0\x0F\x03\x04\xF3\x3F\x45\x59\xAC\x0F\x00'
+
+class UploadHandler(http.server.BaseHTTPRequestHandler):
+
+    # Keep connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        server.connections.add(self.client_address)
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200:
+            assert self.headers["Content-Encoding"] == "gzip"
+            server.batches.append(json.loads(gzip.decompress(body))["records"])
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def start_server(port = 0):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), UploadHandler)
+    server.batches = []
+    server.connections = set()
+    # HTTP status to return for each request, then 200
+    server.statuses = []
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+@pytest.fixture
+def server():
+    server = start_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/upload"
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def cryoegg_data(sequence_number = 0):
+    raw = bytearray(VALID_CRYOEGG_DATA)
+    raw[10] = sequence_number
+    return cryodecoder.CryoeggData(cryodecoder.CryoeggPacket(raw))
+
+def test_uploader_batches(server):
+
+    with cryodecoder.Uploader(url(server), batch_size = 10, flush_interval = 60) as uploader:
+        for i in range(25):
+            uploader.put(cryoegg_data(i), user_id = 0xCE220001, timestamp = i)
+
+    # Two full batches, and the rest on close, over one connection
+    assert [len(batch) for batch in server.batches] == [10, 10, 5]
+    assert len(server.connections) == 1
+    assert uploader.records_sent == 25
+
+    record = server.batches[0][3]
+    assert record["type"] == "CryoeggData"
+    assert record["user_id"] == 0xCE220001
+    assert record["sequence_number"] == 3
+    assert record["pressure"] == pytest.approx(cryoegg_data().pressure)
+
+def test_uploader_records_and_flush_interval(server):
+
+    with cryodecoder.Uploader(url(server), flush_interval = 0.05) as uploader:
+        uploader.put(cryoegg_data().to_record(), user_id = 1)
+        uploader.put({"note" : "test"})
+        # Sent without waiting for a full batch
+        for _ in range(100):
+            if server.batches:
+                break
+            threading.Event().wait(0.05)
+        assert len(server.batches) == 1
+
+    assert server.batches[0][0]["type"] == "CryoeggRecord"
+    assert server.batches[0][1] == {"type" : "dict", "user_id" : None, "timestamp" : None, "note" : "test"}
+
+def test_uploader_retry(server):
+
+    server.statuses = [503, 503]
+
+    with cryodecoder.Uploader(url(server), backoff = 0.01) as uploader:
+        uploader.put(cryoegg_data())
+
+    assert len(server.batches) == 1
+    assert uploader.batches_sent == 1
+
+def test_uploader_rejected(server):
+
+    server.statuses = [400]
+
+    with cryodecoder.Uploader(url(server), backoff = 0.01) as uploader:
+        uploader.put(cryoegg_data())
+
+    # Not retried
+    assert server.batches == []
+    assert uploader.batches_rejected == 1
+
+def test_uploader_spool(tmp_path):
+
+    port = unused_port()
+    spool_dir = tmp_path / "spool"
+
+    # Server unreachable, so both batches are spooled
+    with cryodecoder.Uploader(f"http://127.0.0.1:{port}/", batch_size = 2,
+        retries = 1, backoff = 0.01, spool_dir = spool_dir) as uploader:
+        for i in range(4):
+            uploader.put(cryoegg_data(i))
+
+    assert uploader.batches_spooled == 2
+    assert len(list(spool_dir.iterdir())) == 2
+
+    # and are sent, in order, once it's back
+    server = start_server(port)
+    try:
+        with cryodecoder.Uploader(f"http://127.0.0.1:{port}/", spool_dir = spool_dir) as uploader:
+            uploader.put(cryoegg_data(4))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [[r["sequence_number"] for r in batch] for batch in server.batches] == [[4], [0, 1], [2, 3]]
+    assert list(spool_dir.iterdir()) == []
+
+def test_uploader_backpressure():
+
+    uploader = cryodecoder.Uploader(f"http://127.0.0.1:{unused_port()}/",
+        batch_size = 1, queue_size = 1, retries = 100, backoff = 10)
+    try:
+        # The upload thread is stuck retrying the first record, so the
+        # queue fills up
+        uploader.put(cryoegg_data())
+        uploader.put(cryoegg_data(), timeout = 1)
+        with pytest.raises(queue.Full):
+            uploader.put(cryoegg_data(), block = False)
+    finally:
+        uploader.closing.set()
+        uploader.close()
+
+def test_uploader_invalid():
+
+    with pytest.raises(ValueError):
+        cryodecoder.Uploader("ftp://example.com")
+
+    with cryodecoder.Uploader("http://127.0.0.1:1/", retries = 0) as uploader:
+        with pytest.raises(TypeError):
+            uploader.put(b"raw")